@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Bulk editing of the vehicle composition of many roads.
+
+A composition, given as (vehicle, timevar, fraction) rows, is validated
+once and then written to all given roads with set-based SQL: the road
+ids and the composition are loaded into temporary tables, and the
+existing vehicle rows are replaced by a single DELETE and a single
+INSERT ... SELECT in one transaction.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import time
+
+from AirviroOfflineEdb.road_vehicles import VehicleRow, VehicleSums
+from AirviroOfflineEdb.validation_rules import (
+    TRAFFIC_SUM_TOLERANCE,
+    traffic_sum_message
+)
+
+
+def validate_composition(con, composition):
+    """Validate a composition, raise ValueError if not valid.
+
+    Each vehicle may only occur once, timevars must exist and the
+    fractions of traffic vehicles must sum to 100 %.
+    """
+    vehicles = dict(
+        (row[0], (row[1], row[2])) for row in con.execute(
+            'SELECT id, isheavy, istraffic FROM road_vehicles'
+        )
+    )
+    timevars = set(
+        row[0] for row in con.execute('SELECT id FROM road_timevars')
+    )
+    sums = VehicleSums()
+    for vehicle, timevar, fraction in composition:
+        if vehicle not in vehicles:
+            raise ValueError('Vehicle %s does not exist' % vehicle)
+        if timevar not in timevars:
+            raise ValueError('Timevar %s does not exist' % timevar)
+        if fraction < 0 or fraction > 100:
+            raise ValueError(
+                'Fraction %s of vehicle %s outside range 0 - 100' % (
+                    fraction, vehicle
+                )
+            )
+        isheavy, istraffic = vehicles[vehicle]
+        sums.add(vehicle, isheavy, istraffic, fraction)
+
+    duplicates = sums.duplicates()
+    if len(duplicates) > 0:
+        raise ValueError('Duplicate rows for vehicle %s' % duplicates[0])
+    if abs(sums.traffic - 100.0) > TRAFFIC_SUM_TOLERANCE:
+        raise ValueError(
+            'Composition %s' % traffic_sum_message(sums.traffic)
+        )
+
+
+def apply_composition(con, roads, composition, validate=True):
+    """Replace the vehicle composition of roads in one transaction.
+
+    @param roads: iterable of road id's
+    @param composition: iterable of (vehicle, timevar, fraction)
+    Returns (number of roads, time taken in seconds).
+    """
+    start = time.time()
+    composition = [VehicleRow(*row) for row in composition]
+    if validate:
+        validate_composition(con, composition)
+
+    con.execute('DROP TABLE IF EXISTS temp.bulk_roads')
+    con.execute('DROP TABLE IF EXISTS temp.bulk_composition')
+    con.execute('CREATE TEMP TABLE bulk_roads (id INTEGER PRIMARY KEY)')
+    con.execute(
+        'CREATE TEMP TABLE bulk_composition '
+        '(vehicle INTEGER, timevar INTEGER, fraction REAL)'
+    )
+    try:
+        with con:
+            con.executemany(
+                'INSERT OR IGNORE INTO temp.bulk_roads VALUES (?)',
+                ((road,) for road in roads)
+            )
+            con.executemany(
+                'INSERT INTO temp.bulk_composition VALUES (?, ?, ?)',
+                composition
+            )
+            con.execute(
+                'DELETE FROM road_vehicle_link '
+                'WHERE road IN (SELECT id FROM temp.bulk_roads)'
+            )
+            con.execute(
+                """
+                INSERT INTO road_vehicle_link
+                  (road, vehicle, timevar, fraction)
+                SELECT r.id, c.vehicle, c.timevar, c.fraction
+                FROM temp.bulk_roads r
+                CROSS JOIN temp.bulk_composition c
+                """
+            )
+            nroads = con.execute(
+                'SELECT count(*) FROM temp.bulk_roads'
+            ).fetchone()[0]
+    finally:
+        con.execute('DROP TABLE temp.bulk_roads')
+        con.execute('DROP TABLE temp.bulk_composition')
+    return nroads, time.time() - start
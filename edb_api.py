@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""Python API for edb operations without the QGIS user interface.
+
+Edb wraps an offline edb file and gives access to the operations of the
+plugin, using the same modules as the dock widget and forms:
+
+- info: tables, row counts, sources and tiled grids
+- validate: form rules and vehicle compositions (validation_runner)
+- scan: rules and statistical outliers (quality_scan)
+- apply_composition: bulk edit of road vehicles (bulk_edit)
+- calculate: emissions of all sources (emission_calc)
+- export_grid/import_grid: tiled grid rasters (grid_tiles)
+- convert_grids: grid sources to tiled grids (grid_tiles)
+- export_table: rows of a table as csv
+- diff: added, removed and changed rows compared with another edb
+
+run_batch runs an operation on many edbs in parallel, one edb per
+process.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+import csv
+import multiprocessing
+import os
+import traceback
+from collections import namedtuple, OrderedDict
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb import (
+    bulk_edit,
+    emission_calc,
+    emission_totals,
+    grid_tiles,
+    quality_scan,
+    validation_runner
+)
+from AirviroOfflineEdb.sqlite_utils import relation_in_db, table_fingerprint
+
+TableDiff = namedtuple('TableDiff', 'added removed changed')
+
+# result of an operation in a batch, error is None if successful
+BatchResult = namedtuple('BatchResult', 'filename result error')
+
+# operations that can be run with run_batch
+BATCH_OPERATIONS = (
+    'info', 'validate', 'scan', 'calculate', 'apply_composition',
+    'export_table'
+)
+
+
+class Edb(object):
+
+    """An offline edb opened without QGIS."""
+
+    def __init__(self, filename):
+        if not os.path.isfile(filename):
+            raise ValueError('Edb %s does not exist' % filename)
+        self.filename = os.path.abspath(filename)
+        self._con = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @property
+    def con(self):
+        if self._con is None:
+            self._con = sqlite3.connect(self.filename)
+            self._con.row_factory = sqlite3.Row
+            self._con.execute('PRAGMA foreign_keys = ON')
+        return self._con
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def tables(self):
+        """Return names of all tables, excluding sqlite and spatialite."""
+        return [
+            row[0] for row in self.con.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' "
+                "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            )
+        ]
+
+    def epsg(self):
+        """Return srid of the geometry columns, None if not spatial."""
+        if not relation_in_db(self.con, 'geometry_columns'):
+            return None
+        row = self.con.execute(
+            'SELECT srid FROM geometry_columns LIMIT 1'
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def info(self):
+        """Return an OrderedDict describing the edb."""
+        row_counts = OrderedDict(
+            (table, self.con.execute(
+                'SELECT count(*) FROM "%s"' % table
+            ).fetchone()[0])
+            for table in self.tables()
+        )
+        return OrderedDict([
+            ('filename', self.filename),
+            ('size', os.path.getsize(self.filename)),
+            ('epsg', self.epsg()),
+            ('sources', OrderedDict(
+                (table, row_counts[table])
+                for table in emission_calc.SOURCE_TYPES if table in row_counts
+            )),
+            ('tiled_grids', grid_tiles.tiled_grids(self.con)),
+            ('tables', row_counts)
+        ])
+
+    def validate(self, tables=None, processes=None, progress=None):
+        """Validate tables and write the validation report to the edb.
+
+        Returns a dict with the number of issues per table, see
+        validation_runner.run_validation.
+        """
+        return validation_runner.run_validation(
+            self.filename, tables, processes=processes, progress=progress
+        )
+
+    def scan(self):
+        """Return quality scan issues, see quality_scan.scan_edb."""
+        return quality_scan.scan_edb(self.con)
+
+    def road_ids(self, where=None):
+        """Return id's of roads matching an sql expression, or all roads."""
+        query = 'SELECT id FROM roads'
+        if where:
+            query += ' WHERE %s' % where
+        return [row[0] for row in self.con.execute(query + ' ORDER BY id')]
+
+    def apply_composition(self, composition, roads=None, where=None):
+        """Replace the vehicle composition of roads.
+
+        @param composition: iterable of (vehicle, timevar, fraction)
+        @param roads: road id's, default is the roads matching where
+        @param where: sql expression selecting roads, default is all roads
+        Returns (number of roads, time taken in seconds).
+        """
+        if roads is None:
+            roads = self.road_ids(where)
+        return bulk_edit.apply_composition(self.con, roads, composition)
+
+    def calculate(self, source_types=None, substances=None, processes=None,
+                  progress=None):
+        """Calculate emissions, returns number of rows per source type."""
+        return emission_calc.calculate_emissions(
+            self.filename, source_types, substances,
+            processes=processes, progress=progress
+        )
+
+    def totals(self):
+        """Return {substance name: total emission} of calculated emissions."""
+        totals = emission_totals.EmissionTotals(self.filename)
+        try:
+            totals.load_totals()
+        finally:
+            totals.close()
+        return OrderedDict(
+            (totals.substance_names.get(substance, substance), emis)
+            for substance, emis in sorted(totals.totals.iteritems())
+        )
+
+    def export_grid(self, grid, band, filename):
+        """Export a band of a tiled grid to GeoTIFF, requires GDAL."""
+        return grid_tiles.GridTiles(self.con, grid).export_geotiff(
+            band, filename, epsg=self.epsg()
+        )
+
+    def import_grid(self, grid, filename, band=1, raster_band=1):
+        """Import a GDAL raster band as a tiled grid, requires GDAL."""
+        grid_tiles.import_raster(
+            self.con, grid, filename, band=band, raster_band=raster_band
+        )
+
+    def convert_grids(self, cell_size, grids=None):
+        """Store grid sources as tiled grids, returns converted id's."""
+        return grid_tiles.convert_grid_sources(self.con, cell_size, grids)
+
+    def export_table(self, table, filename):
+        """Write all rows of a table to a csv file, return number of rows.
+
+        {edb} in filename is replaced by the name of the edb, giving one
+        file per edb when run in batch.
+        """
+        if not relation_in_db(self.con, table):
+            raise ValueError('Table %s not found in edb' % table)
+        filename = filename.format(
+            edb=os.path.splitext(os.path.basename(self.filename))[0]
+        )
+        cur = self.con.execute('SELECT * FROM "%s"' % table)
+        nrows = 0
+        with open(filename, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([column[0] for column in cur.description])
+            for row in cur:
+                writer.writerow([csv_value(value) for value in row])
+                nrows += 1
+        return nrows
+
+    def diff(self, other, tables=None):
+        """Compare rows of tables with id column with another edb.
+
+        Returns an OrderedDict {table: TableDiff} with the id's of rows
+        added, removed and changed in other, for tables that differ.
+        """
+        other = other.filename if isinstance(other, Edb) else other
+        if tables is None:
+            tables = [
+                table for table in self.tables()
+                if 'id' in self.columns(table)
+            ]
+        if not os.path.isfile(other):
+            raise ValueError('Edb %s does not exist' % other)
+        con = sqlite3.connect(self.filename)
+        other_con = sqlite3.connect(other)
+        con.execute('ATTACH DATABASE ? AS other', (other,))
+        try:
+            result = OrderedDict()
+            for table in tables:
+                table_diff = diff_table(con, other_con, table)
+                if table_diff is not None:
+                    result[table] = table_diff
+        finally:
+            con.close()
+            other_con.close()
+        return result
+
+    def columns(self, table):
+        return [
+            row[1] for row in self.con.execute('PRAGMA table_info(%s)' % table)
+        ]
+
+
+def csv_value(value):
+    """Encode unicode as utf-8 and blobs (e.g. geometries) as hex."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, buffer):
+        return str(value).encode('hex')
+    return value
+
+
+def diff_table(con, other_con, table):
+    """Diff table in main with the same table in the attached database other.
+
+    other_con is a connection to the attached database, used to compare
+    fingerprints of the tables before comparing rows.
+    Returns a TableDiff, or None if the table content is equal.
+    """
+    main_columns = [
+        row[1] for row in con.execute('PRAGMA main.table_info(%s)' % table)
+    ]
+    other_columns = [
+        row[1] for row in con.execute('PRAGMA other.table_info(%s)' % table)
+    ]
+    if len(other_columns) == 0:
+        raise ValueError('Table %s not found in other edb' % table)
+    if main_columns != other_columns:
+        raise ValueError('Columns of table %s differ' % table)
+    if table_fingerprint(con, table) == table_fingerprint(other_con, table):
+        return None
+
+    def ids(query):
+        return [row[0] for row in con.execute(query % {'t': table})]
+
+    added = ids(
+        'SELECT id FROM other.%(t)s '
+        'WHERE id NOT IN (SELECT id FROM main.%(t)s) ORDER BY id'
+    )
+    removed = ids(
+        'SELECT id FROM main.%(t)s '
+        'WHERE id NOT IN (SELECT id FROM other.%(t)s) ORDER BY id'
+    )
+    changed = ids(
+        'SELECT id FROM ('
+        'SELECT * FROM main.%(t)s EXCEPT SELECT * FROM other.%(t)s) '
+        'WHERE id IN (SELECT id FROM other.%(t)s) ORDER BY id'
+    )
+    if not (added or removed or changed):
+        return None
+    return TableDiff(added, removed, changed)
+
+
+def _batch_task(task):
+    operation, filename, kwargs = task
+    try:
+        with Edb(filename) as edb:
+            return BatchResult(
+                filename, getattr(edb, operation)(**kwargs), None
+            )
+    except Exception:
+        return BatchResult(filename, None, traceback.format_exc())
+
+
+def run_batch(operation, filenames, processes=None, **kwargs):
+    """Run an Edb operation on many edbs, one edb per process.
+
+    Operations that can run in parallel themselves are run in a single
+    process per edb. Yields a BatchResult per edb in order of completion,
+    errors in one edb do not stop the batch.
+    """
+    if operation not in BATCH_OPERATIONS:
+        raise ValueError('Operation %s can not be run in batch' % operation)
+    if operation in ('validate', 'calculate'):
+        # workers of a pool can not start pools of their own
+        kwargs['processes'] = 1
+    tasks = [(operation, filename, kwargs) for filename in filenames]
+    processes = min(processes or multiprocessing.cpu_count(), len(tasks))
+    if processes <= 1:
+        for task in tasks:
+            yield _batch_task(task)
+        return
+
+    emission_calc.set_python_executable()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_batch_task, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
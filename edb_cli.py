@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Command line interface for edb operations, see edb_api.
+
+Run as python -m AirviroOfflineEdb.edb_cli <command> --help for usage.
+Commands given several edbs process them in parallel, one edb per
+process (see --jobs). The exit status is 1 if any edb failed.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.edb_api import Edb, run_batch
+
+
+def parse_composition(text):
+    """Parse vehicle:timevar:fraction into a tuple."""
+    try:
+        vehicle, timevar, fraction = text.split(':')
+        return int(vehicle), int(timevar), float(fraction)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'Invalid composition row %s, expected vehicle:timevar:fraction'
+            % text
+        )
+
+
+def print_result(command, filename, result, as_json=False):
+    if as_json:
+        print(json.dumps({'edb': filename, command: result}))
+        return
+    print('%s:' % filename)
+    if command == 'info':
+        for key in ('size', 'epsg', 'tiled_grids'):
+            print('  %s: %s' % (key, result[key]))
+        for table, nrows in result['tables'].iteritems():
+            print('  %-40s %10i' % (table, nrows))
+    elif command in ('validate', 'calculate'):
+        for table, n in sorted(result.iteritems()):
+            print('  %s: %i' % (table, n))
+    elif command == 'scan':
+        for issue in result:
+            print('  %s %s %s: %s (%s)' % issue)
+    elif command == 'bulk-edit':
+        print('  updated %i roads in %.2f s' % tuple(result))
+    elif command == 'export':
+        print('  exported %i rows' % result)
+    elif command == 'diff':
+        for table, diff in result.iteritems():
+            print('  %s: %i added, %i removed, %i changed' % (
+                table, len(diff.added), len(diff.removed), len(diff.changed)
+            ))
+    else:
+        print('  %s' % (result,))
+
+
+def run_edbs(args, operation, **kwargs):
+    """Run an operation on all edbs of the arguments, return exit status."""
+    status = 0
+    if len(args.edbs) == 1:
+        results = []
+        filename = args.edbs[0]
+        try:
+            with Edb(filename) as edb:
+                results.append((
+                    filename, getattr(edb, operation)(**kwargs), None
+                ))
+        except (ValueError, sqlite3.Error), err:
+            results.append((filename, None, str(err)))
+    else:
+        # run_batch runs one edb per process, see --jobs
+        kwargs.pop('processes', None)
+        results = run_batch(
+            operation, args.edbs, processes=args.jobs, **kwargs
+        )
+
+    for filename, result, error in results:
+        if error is not None:
+            print('%s: %s' % (filename, error), file=sys.stderr)
+            status = 1
+        else:
+            print_result(args.command, filename, result, args.json)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='edb_cli', description='Operations on offline edbs'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of processes, default is the number of cores'
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print results as json lines'
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    info = commands.add_parser('info', help='describe edbs')
+    info.add_argument('edbs', nargs='+', metavar='EDB')
+
+    validate = commands.add_parser(
+        'validate', help='validate and write validation report'
+    )
+    validate.add_argument('edbs', nargs='+', metavar='EDB')
+    validate.add_argument('--table', action='append', dest='tables')
+
+    scan = commands.add_parser('scan', help='quality scan')
+    scan.add_argument('edbs', nargs='+', metavar='EDB')
+
+    bulk = commands.add_parser(
+        'bulk-edit', help='replace the vehicle composition of roads'
+    )
+    bulk.add_argument('edbs', nargs='+', metavar='EDB')
+    bulk.add_argument(
+        '--where', help='sql expression selecting roads, default is all'
+    )
+    bulk.add_argument(
+        '--vehicle', action='append', dest='composition', required=True,
+        type=parse_composition, metavar='VEHICLE:TIMEVAR:FRACTION'
+    )
+
+    calculate = commands.add_parser('calculate', help='calculate emissions')
+    calculate.add_argument('edbs', nargs='+', metavar='EDB')
+    calculate.add_argument(
+        '--source-type', action='append', dest='source_types'
+    )
+    calculate.add_argument(
+        '--substance', action='append', dest='substances', type=int
+    )
+
+    grid = commands.add_parser(
+        'grid', help='import or export tiled grids (requires GDAL)'
+    )
+    grid.add_argument('action', choices=['import', 'export'])
+    grid.add_argument('edb', metavar='EDB')
+    grid.add_argument('grid', type=int, help='id of grid source')
+    grid.add_argument('raster', help='raster file to import or export')
+    grid.add_argument('--band', type=int, default=1)
+
+    diff = commands.add_parser('diff', help='compare rows of two edbs')
+    diff.add_argument('edb', metavar='EDB')
+    diff.add_argument('other', metavar='OTHER_EDB')
+    diff.add_argument('--table', action='append', dest='tables')
+
+    export = commands.add_parser('export', help='export table as csv')
+    export.add_argument('edbs', nargs='+', metavar='EDB')
+    export.add_argument('--table', required=True)
+    export.add_argument(
+        '--output', required=True,
+        help='csv filename, {edb} is replaced by the edb name'
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        return run_edbs(args, 'info')
+    elif args.command == 'validate':
+        return run_edbs(
+            args, 'validate', tables=args.tables, processes=args.jobs
+        )
+    elif args.command == 'scan':
+        return run_edbs(args, 'scan')
+    elif args.command == 'bulk-edit':
+        return run_edbs(
+            args, 'apply_composition',
+            composition=args.composition, where=args.where
+        )
+    elif args.command == 'calculate':
+        return run_edbs(
+            args, 'calculate',
+            source_types=args.source_types, substances=args.substances,
+            processes=args.jobs
+        )
+    elif args.command == 'export':
+        if len(args.edbs) > 1 and '{edb}' not in args.output:
+            parser.error('--output must contain {edb} for several edbs')
+        return run_edbs(
+            args, 'export_table', table=args.table, filename=args.output
+        )
+
+    with Edb(args.edb) as edb:
+        if args.command == 'grid':
+            if args.action == 'export':
+                result = edb.export_grid(args.grid, args.band, args.raster)
+            else:
+                result = edb.import_grid(args.grid, args.raster, args.band)
+            print_result(args.command, args.edb, result, args.json)
+        elif args.command == 'diff':
+            result = edb.diff(args.other, args.tables)
+            if args.json:
+                result = dict(
+                    (table, diff._asdict())
+                    for table, diff in result.iteritems()
+                )
+            print_result(args.command, args.edb, result, args.json)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Calculation of source emissions, optionally in parallel.
+
+The emissions of each source are given by the emission views created by
+pyAirviro (create_emission_views), one view per source type with the
+columns source, substance and emis. The calculation materializes these
+views into the emission output tables. In parallel mode the work is
+partitioned by source type, substance and ranges of source id's and
+distributed over a pool of processes, each reading the edb through its
+own read-only connection.
+
+Grid sources stored as tiles (grid_tiles) are not taken from the view,
+their emission of a substance is the sum of its band, read one tile at a
+time.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.grid_tiles import GridTiles, tiled_grids
+from AirviroOfflineEdb.readonly_edb import connect_readonly
+from AirviroOfflineEdb.sqlite_utils import relation_in_db, transaction
+
+# source tables and the prefix used for their emission views and tables
+SOURCE_TYPES = OrderedDict([
+    ('points', 'point'),
+    ('areas', 'area'),
+    ('grids', 'grid'),
+    ('roads', 'road')
+])
+
+# number of id-ranges per source type and process, using more ranges than
+# processes evens out the load when some sources are slower to calculate
+CHUNKS_PER_PROCESS = 4
+
+# connection of the current worker process, see _init_worker
+_worker_con = None
+
+
+def emission_view(source_type):
+    """Return name of emission view for source type."""
+    return '%s_emission_view' % SOURCE_TYPES[source_type]
+
+
+def emission_table(source_type):
+    """Return name of emission output table for source type."""
+    return '%s_emissions' % SOURCE_TYPES[source_type]
+
+
+def create_emission_table(con, source_type):
+    """Create emission output table for source type if not existing."""
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS %s (
+          source INTEGER NOT NULL,
+          substance INTEGER NOT NULL,
+          emis REAL,
+          PRIMARY KEY (source, substance)
+        )
+        """ % emission_table(source_type)
+    )
+
+
+def id_ranges(con, table, nchunks):
+    """Split id's of table in nchunks ranges with equal number of rows.
+
+    Returns a list of (first, last) tuples with inclusive limits.
+    """
+    ids = [row[0] for row in con.execute(
+        'SELECT id FROM %s ORDER BY id' % table
+    )]
+    if len(ids) == 0:
+        return []
+    size = max(1, -(-len(ids) // max(1, nchunks)))
+    return [
+        (ids[start], ids[min(start + size, len(ids)) - 1])
+        for start in range(0, len(ids), size)
+    ]
+
+
+def source_emissions(con, source_type, first, last, substance=None):
+    """Return emission rows (source, substance, emis) for an id-range."""
+    query = 'SELECT source, substance, emis FROM %s ' % (
+        emission_view(source_type)
+    )
+    query += 'WHERE source BETWEEN ? AND ?'
+    params = [first, last]
+    if substance is not None:
+        query += ' AND substance=?'
+        params.append(substance)
+    return con.execute(query, params).fetchall()
+
+
+def grid_emissions(con, first, last, substance=None):
+    """Return emission rows of grid sources in an id-range.
+
+    The emissions of grid sources stored as tiles are calculated from
+    their tiles, the emissions of other grid sources are read from the
+    emission view.
+    """
+    tiled = [grid for grid in tiled_grids(con) if first <= grid <= last]
+    rows = [
+        row for row in source_emissions(con, 'grids', first, last, substance)
+        if row[0] not in tiled
+    ]
+    for grid in tiled:
+        tiles = GridTiles(con, grid)
+        for band in tiles.bands():
+            if substance is None or band == substance:
+                rows.append((grid, band, tiles.total(band)))
+    return rows
+
+
+def _init_worker(filename):
+    global _worker_con
+    # the edb may be edited while calculating, it is not immutable
+    _worker_con = connect_readonly(filename, immutable=False)
+
+
+def _close_worker():
+    global _worker_con
+    if _worker_con is not None:
+        _worker_con.close()
+        _worker_con = None
+
+
+def _calculate_task(task):
+    source_type, substance, first, last = task
+    if source_type == 'grids':
+        return source_type, grid_emissions(
+            _worker_con, first, last, substance
+        )
+    return source_type, source_emissions(
+        _worker_con, source_type, first, last, substance
+    )
+
+
+def set_python_executable():
+    # Inside QGIS on Windows sys.executable is the QGIS application,
+    # worker processes need to be started using the python interpreter
+    if sys.platform == 'win32':
+        executable = os.path.join(sys.exec_prefix, 'pythonw.exe')
+        if os.path.exists(executable):
+            multiprocessing.set_executable(executable)
+
+
+def create_tasks(con, source_types, substances, processes):
+    """Partition the calculation by source type, id-range and substance."""
+    tasks = []
+    for source_type in source_types:
+        ranges = id_ranges(con, source_type, processes * CHUNKS_PER_PROCESS)
+        for first, last in ranges:
+            for substance in substances:
+                tasks.append((source_type, substance, first, last))
+    return tasks
+
+
+def calculate_emissions(filename, source_types=None, substances=None,
+                        processes=None, progress=None):
+    """Calculate emissions and store them in the emission output tables.
+
+    @param filename: path to edb
+    @param source_types: source types to calculate, default is all source
+    types with an emission view in the edb
+    @param substances: substance id's to calculate, default is all
+    @param processes: number of worker processes, 1 calculates in the
+    current process, default is the number of cores
+    @param progress: optional callable progress(done, total)
+
+    Returns a dict with the number of calculated rows per source type.
+    """
+
+    con = sqlite3.connect(filename)
+    if source_types is None:
+        source_types = [
+            st for st in SOURCE_TYPES if relation_in_db(con, emission_view(st))
+        ]
+    else:
+        for source_type in source_types:
+            if not relation_in_db(con, emission_view(source_type)):
+                raise ValueError(
+                    'No emission view found for %s' % source_type
+                )
+
+    if substances is None:
+        substances = [
+            row[0] for row in con.execute('SELECT id FROM substances')
+        ]
+
+    processes = processes or multiprocessing.cpu_count()
+    tasks = create_tasks(con, source_types, substances, processes)
+
+    # Results are collected in a temporary database, writing to the edb
+    # while the workers are reading would make them wait for locks
+    con.execute("ATTACH DATABASE '' AS calc")
+    for source_type in source_types:
+        con.execute(
+            """
+            CREATE TABLE calc.%s (
+              source INTEGER, substance INTEGER, emis REAL
+            )
+            """ % emission_table(source_type)
+        )
+
+    if processes == 1:
+        _init_worker(filename)
+        results = (_calculate_task(task) for task in tasks)
+        pool = None
+    else:
+        set_python_executable()
+        pool = multiprocessing.Pool(
+            processes, _init_worker, (filename,)
+        )
+        results = pool.imap_unordered(_calculate_task, tasks)
+
+    nrows = dict((source_type, 0) for source_type in source_types)
+    try:
+        for done, (source_type, rows) in enumerate(results, 1):
+            con.executemany(
+                'INSERT INTO calc.%s VALUES (?, ?, ?)' % (
+                    emission_table(source_type)
+                ),
+                rows
+            )
+            nrows[source_type] += len(rows)
+            if progress is not None:
+                progress(done, len(tasks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            _close_worker()
+
+    # merge results into output tables in a single transaction, the
+    # tables are created before, as sqlite3 commits before CREATE TABLE
+    substance_list = ','.join(str(int(s)) for s in substances)
+    for source_type in source_types:
+        create_emission_table(con, source_type)
+    with transaction(con, 'BEGIN IMMEDIATE'):
+        for source_type in source_types:
+            table = emission_table(source_type)
+            con.execute(
+                'DELETE FROM main.%s WHERE substance IN (%s)' % (
+                    table, substance_list
+                )
+            )
+            con.execute(
+                'INSERT INTO main.%s (source, substance, emis) '
+                'SELECT source, substance, emis FROM calc.%s' % (table, table)
+            )
+    con.execute('DETACH DATABASE calc')
+    con.close()
+    return nrows
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Incremental update of calculated emissions when sources are edited.
+
+Instead of recalculating all emissions after an edit, only the edited
+sources are recalculated from the emission views. The emission output
+tables and the running totals per substance and geocode are then patched
+with the difference. The edited sources are read and written with a few
+set-based statements per chunk of source id's, so updating many sources
+at once, e.g. after a bulk edit, does not cost queries per source.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+import time
+from collections import defaultdict
+
+from AirviroOfflineEdb.emission_calc import (
+    SOURCE_TYPES,
+    emission_view,
+    emission_table,
+    create_emission_table
+)
+from AirviroOfflineEdb.readonly_edb import connect_edb, edb_key
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+
+# maximum number of source id's in the IN-list of a statement
+ID_CHUNK_SIZE = 5000
+
+# emission totals per edb, see get_emission_totals
+_emission_totals = {}
+
+
+def get_emission_totals(filename):
+    """Return the shared EmissionTotals instance for an edb."""
+    key = edb_key(filename)
+    if key not in _emission_totals:
+        _emission_totals[key] = EmissionTotals(key[0])
+    return _emission_totals[key]
+
+
+def close_emission_totals(filename=None):
+    """Close the shared EmissionTotals of an edb, or of all edb's."""
+    for key in _emission_totals.keys():
+        if filename is None or key[0] == edb_key(filename)[0]:
+            _emission_totals.pop(key).close()
+
+
+def id_chunks(ids):
+    """Return source id's as comma separated lists of ID_CHUNK_SIZE id's."""
+    ids = sorted(set(int(source_id) for source_id in ids))
+    return [
+        ','.join(str(source_id) for source_id in ids[i:i + ID_CHUNK_SIZE])
+        for i in range(0, len(ids), ID_CHUNK_SIZE)
+    ]
+
+
+def first_code(geocode):
+    """Return first code of a geocode field, or None if not set."""
+    if geocode is None:
+        return None
+    codes = unicode(geocode).split()
+    if len(codes) == 0 or codes[0].lower() == 'none':
+        return None
+    return codes[0]
+
+
+def format_delta(delta, substance_names=None):
+    """Format emission changes as one line per substance."""
+    substance_names = substance_names or {}
+    lines = []
+    for substance in sorted(delta):
+        before, after = delta[substance]
+        if before == after:
+            continue
+        lines.append(
+            '%s: %g -> %g (%+g)' % (
+                substance_names.get(substance, substance),
+                before, after, after - before
+            )
+        )
+    return '\n'.join(lines) or 'No change in emissions'
+
+
+class EmissionTotals(object):
+
+    """Running emission totals of an edb, patched on edit of sources."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.con = connect_edb(filename)
+        self.listeners = []
+        # totals are None until loaded with load_totals
+        self.totals = None
+        self.geocode_totals = None
+        self._snapshots = {}
+        self.last_update_time = None
+        self.substance_names = dict(
+            self.con.execute('SELECT id, name FROM substances').fetchall()
+        )
+        self._has_geocode = {}
+
+    def close(self):
+        self.con.close()
+
+    def add_listener(self, listener):
+        """Add callable listener(source_type, source_ids, delta)."""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def source_types(self):
+        """Source types for which emissions can be calculated."""
+        return [
+            st for st in SOURCE_TYPES
+            if relation_in_db(self.con, emission_view(st))
+        ]
+
+    def has_geocode(self, source_type):
+        if source_type not in self._has_geocode:
+            columns = [
+                row[1] for row in self.con.execute(
+                    'PRAGMA table_info(%s)' % source_type
+                )
+            ]
+            self._has_geocode[source_type] = 'geocode' in columns
+        return self._has_geocode[source_type]
+
+    def load_totals(self):
+        """Aggregate totals from the emission output tables."""
+        self.totals = {}
+        self.geocode_totals = {}
+        for source_type in self.source_types():
+            table = emission_table(source_type)
+            if not relation_in_db(self.con, table):
+                continue
+            if self.has_geocode(source_type):
+                geocode_col = 's.geocode'
+            else:
+                geocode_col = 'NULL'
+            rows = self.con.execute(
+                """
+                SELECT e.substance, {geocode} as geocode, total(e.emis)
+                FROM {table} e
+                JOIN {source_type} s
+                ON e.source = s.id
+                GROUP BY e.substance, {geocode}
+                """.format(
+                    geocode=geocode_col,
+                    table=table,
+                    source_type=source_type
+                )
+            )
+            for substance, geocode, emis in rows:
+                self._add(substance, first_code(geocode), emis)
+
+    def _add(self, substance, code, emis):
+        self.totals[substance] = self.totals.get(substance, 0) + emis
+        key = (substance, code)
+        self.geocode_totals[key] = self.geocode_totals.get(key, 0) + emis
+
+    def _read_states(self, source_type, source_ids):
+        """Return {source: (geocode, stored emissions)} of sources."""
+        geocodes = {}
+        emis = defaultdict(dict)
+        table = emission_table(source_type)
+        has_table = relation_in_db(self.con, table)
+        for id_list in id_chunks(source_ids):
+            if self.has_geocode(source_type):
+                for source_id, geocode in self.con.execute(
+                        'SELECT id, geocode FROM %s WHERE id IN (%s)' % (
+                            source_type, id_list
+                        )):
+                    geocodes[source_id] = first_code(geocode)
+            if has_table:
+                for source_id, substance, value in self.con.execute(
+                        'SELECT source, substance, emis FROM %s '
+                        'WHERE source IN (%s)' % (table, id_list)):
+                    emis[source_id][substance] = value
+        return dict(
+            (source_id, (geocodes.get(source_id), emis.get(source_id, {})))
+            for source_id in source_ids
+        )
+
+    def snapshot(self, source_type, source_ids):
+        """Store state of sources before they are changed.
+
+        Needed for correct geocode totals when the geocode of a source is
+        edited, otherwise the stored emissions are taken as state before.
+        """
+        for source_id, state in self._read_states(
+                source_type, source_ids).iteritems():
+            self._snapshots[(source_type, source_id)] = state
+
+    def update(self, source_type, source_ids):
+        """Recalculate emissions of edited sources and patch totals.
+
+        Returns a dict {substance: (before, after)} summed over the
+        sources, and notifies listeners with the same dict. The time
+        taken is stored in last_update_time.
+        """
+        start = time.time()
+        table = emission_table(source_type)
+        view = emission_view(source_type)
+        delta = {}
+        if not relation_in_db(self.con, view):
+            return delta
+
+        source_ids = list(source_ids)
+        states = self._read_states(source_type, source_ids)
+        new_emis = defaultdict(dict)
+        create_emission_table(self.con, source_type)
+        with self.con:
+            for id_list in id_chunks(source_ids):
+                rows = self.con.execute(
+                    'SELECT source, substance, emis FROM %s '
+                    'WHERE source IN (%s)' % (view, id_list)
+                ).fetchall()
+                self.con.execute(
+                    'DELETE FROM %s WHERE source IN (%s)' % (table, id_list)
+                )
+                self.con.executemany(
+                    'INSERT INTO %s (source, substance, emis) '
+                    'VALUES (?, ?, ?)' % table,
+                    rows
+                )
+                for source_id, substance, value in rows:
+                    new_emis[source_id][substance] = value
+
+        for source_id, (new_code, stored_emis) in states.iteritems():
+            old_code, old_emis = self._snapshots.pop(
+                (source_type, source_id), (new_code, stored_emis)
+            )
+            emis = new_emis.get(source_id, {})
+            for substance in set(old_emis) | set(emis):
+                before = old_emis.get(substance) or 0
+                after = emis.get(substance) or 0
+                old_before, old_after = delta.get(substance, (0, 0))
+                delta[substance] = (old_before + before, old_after + after)
+                if self.totals is not None:
+                    self._add(substance, old_code, -before)
+                    self._add(substance, new_code, after)
+
+        self.last_update_time = time.time() - start
+        for listener in self.listeners:
+            listener(source_type, source_ids, delta)
+        return delta
+
+    def format_delta(self, delta):
+        return format_delta(delta, self.substance_names)
+
+    def format_totals(self):
+        """Format totals as one line per substance."""
+        if self.totals is None:
+            return ''
+        return '\n'.join(
+            '%s: %g' % (self.substance_names.get(subst, subst), emis)
+            for subst, emis in sorted(self.totals.iteritems())
+        )
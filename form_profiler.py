@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Latency profiling of feature form opening.
+
+Opening a form runs a number of phases (see PHASES). When profiling is
+enabled with enable_profiling, each open is recorded as a FormOpenProfile
+with the time of each phase, the number of SQL statements executed by
+the form connections during the phase and counts of populated widgets.
+The total time of the last opens per layer is kept in a rolling
+histogram.
+
+SQL statements are counted with the trace callback of the connections,
+which requires sqlite3 from Python >= 3.3. Without it only the number of
+sqlite virtual machine steps is counted, which is still a measure of the
+amount of SQL work done in a phase.
+
+A single slow open can be profiled with cProfile, see
+FormProfiler.profile_next_slow_open.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+import cProfile
+import os
+import re
+import time
+from collections import deque, namedtuple, OrderedDict
+from contextlib import contextmanager
+
+# phases of opening a form, in order
+PHASES = (
+    'create',
+    'rebind',
+    'load_data',
+    'find_widgets',
+    'init_widgets',
+    'validate',
+    'connect_signals'
+)
+
+# number of opens per layer kept in the histogram
+HISTORY_SIZE = 200
+
+# upper limits of histogram bins in milliseconds, the last bin is open
+LATENCY_BINS = (25, 50, 100, 200, 400, 800, 1600)
+
+# number of sqlite virtual machine instructions per counted step
+VM_STEP_SIZE = 1000
+
+# width of histogram bars in characters
+BAR_WIDTH = 20
+
+PhaseTiming = namedtuple('PhaseTiming', 'name seconds statements vm_steps')
+
+# active profiler, see enable_profiling
+_profiler = None
+
+
+class StatementCounter(object):
+
+    """Count SQL work on connections while used as a context manager.
+
+    statements is None if the connections have no trace callback.
+    """
+
+    def __init__(self, connections):
+        self.connections = [con for con in connections if con is not None]
+        self.traced = all(
+            hasattr(con, 'set_trace_callback') for con in self.connections
+        )
+        self.statements = 0 if self.traced else None
+        self.vm_steps = 0
+
+    def _trace(self, statement):
+        self.statements += 1
+
+    def _progress(self):
+        self.vm_steps += 1
+        return 0
+
+    def __enter__(self):
+        for con in self.connections:
+            if self.traced:
+                con.set_trace_callback(self._trace)
+            con.set_progress_handler(self._progress, VM_STEP_SIZE)
+        return self
+
+    def __exit__(self, *exc_info):
+        for con in self.connections:
+            if self.traced:
+                con.set_trace_callback(None)
+            con.set_progress_handler(None, VM_STEP_SIZE)
+        return False
+
+
+class FormOpenProfile(object):
+
+    """Timing of the phases of a single form open."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.phases = []
+        self.widget_counts = OrderedDict()
+        self.seconds = None
+        self.cprofile_file = None
+
+    @contextmanager
+    def phase(self, name, connections=()):
+        """Time a phase and count SQL work on the given connections."""
+        counter = StatementCounter(connections)
+        start = time.time()
+        try:
+            with counter:
+                yield
+        finally:
+            self.phases.append(PhaseTiming(
+                name, time.time() - start,
+                counter.statements, counter.vm_steps
+            ))
+
+    def set_widget_counts(self, counter):
+        """Set widget counts from counter(), a dict {kind: count}."""
+        self.widget_counts = OrderedDict(sorted(counter().items()))
+
+    def summary(self):
+        """Return a single line summary of the open."""
+        phases = []
+        for phase in self.phases:
+            text = '%s %.0f ms' % (phase.name, phase.seconds * 1000)
+            if phase.statements is not None:
+                text += ' %i sql' % phase.statements
+            elif phase.vm_steps > 0:
+                text += ' %ik vm' % phase.vm_steps
+            phases.append(text)
+        msg = 'Opened %s form in %.0f ms (%s)' % (
+            self.layer, self.seconds * 1000, ', '.join(phases)
+        )
+        if self.widget_counts:
+            msg += ', ' + ', '.join(
+                '%i %s' % (n, kind) for kind, n in
+                self.widget_counts.iteritems()
+            )
+        return msg
+
+
+class NullProfile(object):
+
+    """Profile used when profiling is disabled, records nothing."""
+
+    seconds = None
+    cprofile_file = None
+
+    @contextmanager
+    def phase(self, name, connections=()):
+        yield
+
+    def set_widget_counts(self, counter):
+        pass
+
+
+class FormProfiler(object):
+
+    """Rolling latency histograms of form opens per layer."""
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self.clear()
+        self.cprofile_min_seconds = None
+        self.cprofile_dir = None
+
+    def clear(self):
+        self.history = OrderedDict()
+        self.last = {}
+
+    @property
+    def cprofile_armed(self):
+        return self.cprofile_min_seconds is not None
+
+    def profile_next_slow_open(self, min_seconds=0.0, directory=None):
+        """Run opens under cProfile until one takes at least min_seconds.
+
+        The stats of that open are dumped to a file in directory (default
+        is the current directory), after which cProfile is disarmed.
+        """
+        self.cprofile_min_seconds = min_seconds
+        self.cprofile_dir = directory
+
+    def cancel_cprofile(self):
+        self.cprofile_min_seconds = None
+
+    @contextmanager
+    def open(self, layer):
+        """Record a form open, yields the FormOpenProfile."""
+        profile = FormOpenProfile(layer)
+        cprofiler = None
+        if self.cprofile_armed:
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+        start = time.time()
+        try:
+            yield profile
+        finally:
+            profile.seconds = time.time() - start
+            if cprofiler is not None:
+                cprofiler.disable()
+                if profile.seconds >= self.cprofile_min_seconds:
+                    profile.cprofile_file = self.dump(cprofiler, layer)
+                    self.cancel_cprofile()
+            self.record(profile)
+
+    def dump(self, cprofiler, layer):
+        """Dump cProfile stats of an open, return the filename."""
+        directory = self.cprofile_dir or os.getcwd()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filename = os.path.join(directory, 'form_open_%s_%s.prof' % (
+            re.sub(r'\W', '_', layer), time.strftime('%Y%m%d_%H%M%S')
+        ))
+        cprofiler.dump_stats(filename)
+        return filename
+
+    def record(self, profile):
+        if profile.layer not in self.history:
+            self.history[profile.layer] = deque(maxlen=self.history_size)
+        self.history[profile.layer].append(profile.seconds)
+        self.last[profile.layer] = profile
+
+    def histogram(self, layer):
+        """Return [(bin label, count)] of open times of a layer."""
+        counts = [0] * (len(LATENCY_BINS) + 1)
+        for seconds in self.history.get(layer, ()):
+            ms = seconds * 1000
+            i = 0
+            while i < len(LATENCY_BINS) and ms >= LATENCY_BINS[i]:
+                i += 1
+            counts[i] += 1
+        labels = ['< %i ms' % limit for limit in LATENCY_BINS]
+        labels.append('>= %i ms' % LATENCY_BINS[-1])
+        return zip(labels, counts)
+
+    def percentile(self, layer, p):
+        """Return the p:th percentile of open times of a layer in seconds."""
+        times = sorted(self.history.get(layer, ()))
+        if len(times) == 0:
+            return None
+        return times[min(len(times) - 1, int(p / 100 * len(times)))]
+
+    def format_histogram(self):
+        """Return text with histogram and last open of each layer."""
+        lines = []
+        for layer, times in self.history.iteritems():
+            lines.append('%s: %i opens, median %.0f ms, p95 %.0f ms' % (
+                layer, len(times),
+                self.percentile(layer, 50) * 1000,
+                self.percentile(layer, 95) * 1000
+            ))
+            histogram = self.histogram(layer)
+            max_count = max(count for label, count in histogram)
+            for label, count in histogram:
+                bar = '#' * int(round(BAR_WIDTH * count / max_count))
+                lines.append('%10s %-*s %i' % (label, BAR_WIDTH, bar, count))
+            lines.append(self.last[layer].summary())
+            lines.append('')
+        return '\n'.join(lines)
+
+
+def enable_profiling(enabled=True):
+    """Enable or disable form profiling, return the active profiler."""
+    global _profiler
+    if not enabled:
+        _profiler = None
+    elif _profiler is None:
+        _profiler = FormProfiler()
+    return _profiler
+
+
+def get_profiler():
+    """Return the active profiler, None if profiling is disabled."""
+    return _profiler
+
+
+@contextmanager
+def profile_open(layer):
+    """Profile a form open if profiling is enabled.
+
+    Yields a FormOpenProfile, or a NullProfile when disabled.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield NullProfile()
+    else:
+        with profiler.open(layer) as profile:
+            yield profile
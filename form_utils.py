@@ -8,6 +8,11 @@ from collections import OrderedDict
 from qgis.core import QgsMessageLog
 from PyQt4 import QtGui, QtCore
 
+from AirviroOfflineEdb.form_profiler import profile_open
+from AirviroOfflineEdb.queries import verify_indexes
+from AirviroOfflineEdb.readonly_edb import connect_edb, is_readonly
+from AirviroOfflineEdb.validation_rules import value_checks
+
 try:
     from pysqlite2 import dbapi2 as sqlite3
 except ImportError:
@@ -26,6 +31,11 @@ def make_iterable(value):
 
 def connect_db(filename):
     """Connect to database."""
+    if is_readonly(filename):
+        # no edits, neither foreign keys nor indexes are needed
+        con = connect_edb(filename)
+        con.row_factory = sqlite3.Row
+        return con, con.cursor()
     con = sqlite3.connect(filename)
     # con.enable_load_extension(True)
     # con.execute("select load_extension('libspatialite')")
@@ -33,16 +43,123 @@ def connect_db(filename):
     con.row_factory = sqlite3.Row
     cur = con.cursor()
     cur.execute('PRAGMA foreign_keys = ON')
+    try:
+        verify_indexes(con, filename)
+    except sqlite3.OperationalError, err:
+        QgsMessageLog.logMessage(
+            'Could not create indexes in %s: %s' % (filename, err),
+            'AirviroOfflineEdb',
+            QgsMessageLog.WARNING
+        )
     return con, cur
 
 
-def reconnect(signal, callback):
-    try:
-        signal.disconnect()
-    except:
-        pass
-    signal.connect(callback)
-    
+class ConnectionRegistry(object):
+
+    """Signal connections owned by a form.
+
+    Only connections made through the registry are disconnected, so
+    connections made by QGIS or by other forms on the same signal are
+    left untouched.
+    """
+
+    def __init__(self):
+        self._connections = []
+
+    def __len__(self):
+        return len(self._connections)
+
+    def connect(self, signal, slot):
+        """Connect signal to slot, return the connection."""
+        signal.connect(slot)
+        connection = (signal, slot)
+        self._connections.append(connection)
+        return connection
+
+    def disconnect(self, connection):
+        """Disconnect a connection made by the registry."""
+        self._connections.remove(connection)
+        signal, slot = connection
+        try:
+            signal.disconnect(slot)
+        except (TypeError, RuntimeError):
+            # already disconnected or the sender has been deleted
+            pass
+
+    def disconnect_all(self):
+        """Disconnect all connections made by the registry."""
+        for connection in reversed(self._connections[:]):
+            self.disconnect(connection)
+
+
+# milliseconds without changes before validation is run
+VALIDATION_DELAY = 100
+
+# widget validation states
+VALID = 'valid'
+INVALID = 'invalid'
+WARNING = 'warning'
+
+# forms built per (dialog, layer id), see open_form
+_forms = {}
+
+
+def open_form(form_class, dialog, layer, feature, **kwargs):
+    """Open a feature form, reusing the form built earlier for the dialog.
+
+    When another feature is shown in a dialog, the cached form is rebound
+    to the feature, otherwise a new form is built and cached until the
+    dialog is destroyed.
+    """
+    with profile_open(layer.name()) as profile:
+        form = _open_form(
+            profile, form_class, dialog, layer, feature, **kwargs
+        )
+        profile.set_widget_counts(form.widget_counts)
+    if profile.seconds is not None:
+        QgsMessageLog.logMessage(
+            profile.summary(), 'AirviroOfflineEdb', QgsMessageLog.INFO
+        )
+        if profile.cprofile_file is not None:
+            QgsMessageLog.logMessage(
+                'Profile of form open written to %s' % profile.cprofile_file,
+                'AirviroOfflineEdb',
+                QgsMessageLog.INFO
+            )
+    return form
+
+
+def _open_form(profile, form_class, dialog, layer, feature, **kwargs):
+    key = (id(dialog), layer.id())
+    form = _forms.get(key)
+    if form is not None:
+        with profile.phase('rebind', form.profiled_connections()):
+            rebound = form.rebind(feature)
+        if rebound:
+            with profile.phase('validate', form.profiled_connections()):
+                form.validate()
+            return form
+        form.close()
+    else:
+        dialog.destroyed.connect(lambda *args: close_form(key))
+
+    with profile.phase('create'):
+        form = form_class(dialog, layer, feature, **kwargs)
+    connections = form.profiled_connections()
+    for phase in ('load_data', 'find_widgets', 'init_widgets', 'validate',
+                  'connect_signals'):
+        with profile.phase(phase, connections):
+            getattr(form, phase)()
+    _forms[key] = form
+    return form
+
+
+def close_form(key):
+    """Close a form opened by open_form and remove it from the cache."""
+    form = _forms.pop(key, None)
+    if form is not None:
+        form.close()
+
 
 class ValidationError(Exception):
     
@@ -62,6 +179,53 @@ class ValidationWarning(Exception):
         super(ValidationWarning, self).__init__(message)
 
 
+class ValidationScheduler(QtCore.QObject):
+
+    """Debounced validation of form widgets.
+
+    Requests are collected until no new request has been made for delay
+    milliseconds. Each requested widget, and the widgets depending on it
+    (form.dependencies), is then validated once and the form message is
+    updated from the validation state of all widgets.
+    """
+
+    def __init__(self, form, delay=VALIDATION_DELAY, parent=None):
+        super(ValidationScheduler, self).__init__(parent)
+        self.form = form
+        self.pending = set()
+        self.validate_all = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.run)
+
+    def request(self, name=None, *args):
+        """Request validation of a widget, or of all widgets if None.
+
+        Extra arguments, e.g. the new value from a signal, are ignored.
+        """
+        if name is None or name not in self.form.widgets:
+            self.validate_all = True
+        else:
+            self.pending.add(name)
+            self.pending.update(self.form.dependencies.get(name, ()))
+        self.timer.start()
+
+    def run(self):
+        """Validate requested widgets and update the form message."""
+        if self.validate_all:
+            names = list(self.form.widgets)
+        else:
+            names = [
+                name for name in self.form.widgets if name in self.pending
+            ]
+        self.pending = set()
+        self.validate_all = False
+        for name in names:
+            self.form.widgets[name].validate(silent=True)
+        self.form.show_validation_result()
+
+
 class BaseFeatureForm:
 
     """A container for widgets making form validation more standardized."""
@@ -76,6 +240,11 @@ class BaseFeatureForm:
         self.widgets = OrderedDict()
         self.msg_method = msg_method
         self.msg_widget = msg_widget
+        # widget name: names of widgets to validate when it changes
+        self.dependencies = {}
+        self.scheduler = ValidationScheduler(self, parent=dialog)
+        # connections owned by the form and its widgets
+        self.connections = ConnectionRegistry()
 
         db = self.get_db_file()
         self.con, self.cur = connect_db(db)
@@ -105,20 +274,54 @@ class BaseFeatureForm:
         #     self.dialog.reject
         # )
     
-        reconnect(
+        if self.layer.isReadOnly():
+            # viewing only, attributes can not be edited
+            return
+
+        self.connections.connect(
             self.dialog.attributeChanged,
-            partial(self.validate, self.msg_method, self.msg_widget)
+            self.scheduler.request
         )
             
-        reconnect(
+        self.connections.connect(
             self.layer.editingStarted,
             partial(self.toggle_enabled, True)
         )
-        reconnect(
+        self.connections.connect(
             self.layer.editingStopped,
             partial(self.toggle_enabled, False)
         )
 
+    def close(self):
+        """Disconnect signals, delete the scheduler and close the edb."""
+        self.scheduler.timer.stop()
+        self.connections.disconnect_all()
+        # the scheduler, and its timer, would otherwise live as long as
+        # the dialog, which outlives the forms replaced in it
+        self.scheduler.setParent(None)
+        self.scheduler.deleteLater()
+        self.con.close()
+
+    def profiled_connections(self):
+        """Connections whose SQL statements are counted when profiling."""
+        return [self.con]
+
+    def widget_counts(self):
+        """Return {kind: count} of widgets and items populated in the form."""
+        counts = {'widgets': len(self.widgets)}
+        for form_widget in self.widgets.itervalues():
+            widget = form_widget.widget
+            if isinstance(widget, QtGui.QComboBox):
+                counts['combo items'] = (
+                    counts.get('combo items', 0) + widget.count()
+                )
+            elif isinstance(widget, QtGui.QAbstractItemView) and \
+                    widget.model() is not None:
+                counts['table rows'] = (
+                    counts.get('table rows', 0) + widget.model().rowCount()
+                )
+        return counts
+
     def toggle_enabled(self, enabled=True):
         """Toggle widget status."""
         for name, form_widget in self.widgets.iteritems():
@@ -149,17 +352,23 @@ class BaseFeatureForm:
             on_invalid=on_invalid,
             on_valid=on_valid,
             on_action=on_action,
-            enable_on_edit=enable_on_edit
+            enable_on_edit=enable_on_edit,
+            on_change=partial(self.scheduler.request, name),
+            connections=self.connections
         )
 
     def validate(self, msg_method=None, msg_widget=None, widget_name=None):
         """Validate all widgets in form."""
-        
-        widgets_to_validate = (
-            (name, widget) for name, widget in self.widgets.iteritems()
-            if widget_name is None or
-            name == widget_name
-        )
+
+        for name, widget in self.widgets.iteritems():
+            if widget_name is None or name == widget_name:
+                widget.validate(silent=True)
+
+        self.show_validation_result(msg_method, msg_widget, widget_name)
+
+    def show_validation_result(self, msg_method=None, msg_widget=None,
+                               widget_name=None):
+        """Show message from the last validation state of widgets."""
 
         msg_method = msg_method or self.msg_method
         msg_widget_name = msg_widget or self.msg_widget
@@ -167,13 +376,14 @@ class BaseFeatureForm:
 
         errors = []
         warnings = []
-        for name, widget in widgets_to_validate:
-            try:
-                widget.validate(silent=False)
-            except ValidationError, err:
-                errors.append((name, widget.widget, err.message))
-            except ValidationWarning, err:
-                warnings.append((name, widget.widget, err.message))
+        for name, widget in self.widgets.iteritems():
+            if widget_name is not None and name != widget_name:
+                continue
+            state, msg = widget.state
+            if state == INVALID:
+                errors.append((name, widget.widget, msg))
+            elif state == WARNING:
+                warnings.append((name, widget.widget, msg))
 
         if msg_method == 'label':
             widget = self.widgets[msg_widget_name].widget
@@ -188,29 +398,41 @@ class BaseFeatureForm:
             for name, widget, msg in errors:
                 error_msg += '%s (%s), ' % (name, msg)
             error_msg = error_msg[:-2]
-            msg_widget.setText(error_msg)
-            msg_widget.setStyleSheet('color: red')
+            style = 'color: red'
             show = True
 
         elif warnings != []:
-            warning_msg = "Potential problems in fields: "
+            error_msg = "Potential problems in fields: "
             for name, widget, msg in warnings:
-                warning_msg += '%s(%s) ' % (name, msg)
-            warning_msg = warning_msg[:-2]
-            msg_widget.setText(warning_msg)
-            msg_widget.setStyleSheet('color: yellow')
+                error_msg += '%s(%s) ' % (name, msg)
+            error_msg = error_msg[:-2]
+            style = 'color: yellow'
             show = True
         else:
-            msg_widget.setText('')
+            error_msg = ''
+            style = msg_widget.styleSheet()
+
+        # skip re-rendering if the message has not changed
+        if msg_widget.text() != error_msg or \
+           msg_widget.styleSheet() != style:
+            msg_widget.setText(error_msg)
+            msg_widget.setStyleSheet(style)
 
         if show:
             if msg_method == 'dialog':
                 widget.exec_()
 
+    def load_data(self):
+        pass
+
     @abc.abstractmethod
     def find_widgets(self):
         pass
 
+    def rebind(self, feature):
+        """Bind form to another feature, return False if not supported."""
+        return False
+
     def load_related(self):
         pass
 
@@ -222,7 +444,7 @@ class FormWidget:
 
     def __init__(self, widget, validators=None, init=None,
                  on_invalid=None, on_valid=None, on_action=None,
-                 enable_on_edit=False):
+                 enable_on_edit=False, on_change=None, connections=None):
         self.widget = widget
         self._init = init
         self.enable_on_edit = enable_on_edit
@@ -230,31 +452,33 @@ class FormWidget:
         self._on_action = make_iterable(on_action)
         self._on_invalid = make_iterable(on_invalid)
         self._on_valid = make_iterable(on_valid)
-
-        reconnect(
-            self.widget.textChanged,
-            partial(
-                self.validate,
-                silent=True
+        # (state, message) of last validation, None if not validated
+        self.state = None
+        self.connections = connections or ConnectionRegistry()
+        # connections of on_action callbacks, see disconnect_actions
+        self._action_connections = []
+
+        if hasattr(self.widget, 'textChanged'):
+            self.connections.connect(
+                self.widget.textChanged,
+                on_change or partial(
+                    self.validate,
+                    silent=True
+                )
             )
-        )
         if self._on_action is not None:
             for action in self._on_action:
                 if isinstance(self.widget, QtGui.QComboBox):
-                    reconnect(
-                        self.widget.currentIndexChanged,
-                        action
-                    )
+                    signal = self.widget.currentIndexChanged
                 elif isinstance(self.widget, QtGui.QPushButton):
-                    reconnect(
-                        self.widget.clicked,
-                        action
-                    )
+                    signal = self.widget.clicked
                 elif isinstance(self.widget, QtGui.QLineEdit):
-                    reconnect(
-                        self.widget.textChanged,
-                        action
-                    )
+                    signal = self.widget.textChanged
+                else:
+                    continue
+                self._action_connections.append(
+                    self.connections.connect(signal, action)
+                )
 
     def init(self, edit=False):
         """run init function."""
@@ -264,22 +488,42 @@ class FormWidget:
         if self._init is not None:
             self._init(self.widget)
 
+    def disconnect_actions(self):
+        """Disconnect the on_action callbacks of the widget."""
+        for connection in self._action_connections:
+            self.connections.disconnect(connection)
+        self._action_connections = []
+
     def on_action(self):
         if self._on_action is not None:
             self._on_action(self.widget)
 
     def validate(self, silent=True):
-        """run validation function."""
+        """run validation function.
+
+        Callbacks are only run when the validation state has changed.
+        """
+        error = None
         try:
             for validator in self._validators:
                 validator(self.widget)
-            for on_valid in self._on_valid:
-                on_valid(self.widget, message='')
-        except ValidationError, err:
-            for on_invalid in self._on_invalid:
-                on_invalid(self.widget, message=err.message)
-            if not silent:
-                raise
+            state = (VALID, '')
+        except ValidationError, error:
+            state = (INVALID, error.message)
+        except ValidationWarning, error:
+            state = (WARNING, error.message)
+
+        if state != self.state:
+            self.state = state
+            if state[0] == VALID:
+                for on_valid in self._on_valid:
+                    on_valid(self.widget, message='')
+            elif state[0] == INVALID:
+                for on_invalid in self._on_invalid:
+                    on_invalid(self.widget, message=state[1])
+
+        if error is not None and not silent:
+            raise error
         return True
 
     def toggle_enabled(self, enabled=True):
@@ -298,47 +542,19 @@ def init_default(value, widget):
         widget.setText(value)
 
 
-def validate_in_range(min_value, max_value, widget):
-    value = widget.text()
-    if value == '' or value is None:
-        return
-
-    try:
-        value = float(value)
-    except ValueError:
-        raise ValidationError(
-            'is non-numeric'
-        )
-
-    if value < min_value or value > max_value:
-        raise ValidationError(
-            'outside range %g - %g' % (min_value, max_value)
-        )
-
-
-def validate_is_not_empty(widget):
-    if widget.text() is None or len(widget.text()) == 0:
-        raise ValidationError(
-            'may not be empty'
-        )
-
+def validate_rule(check, widget):
+    """Validate widget text with a compiled rule check."""
+    message = check(widget.text())
+    if message is not None:
+        raise ValidationError(message)
 
-def validate_of_type(type_from_str, widget):
-    value = widget.text()
-    try:
-        type_from_str(value)
-    except ValueError:
-        raise ValidationError(
-            ' should be an %s' % str(type_from_str)
-        )
 
-
-def validate_max_len(length, widget):
-    value = widget.text()
-    if len(value) > length:
-        raise ValidationError(
-            'more than %i characters' % length
-        )
+def rule_validators(table, column):
+    """Return validators for a column defined in validation_rules."""
+    check = value_checks(table).get(column)
+    if check is None:
+        return []
+    return [partial(validate_rule, check)]
 
 
 def set_widget_style(widget, *args, **kwargs):
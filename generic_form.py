@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Feature forms built from the schema of edb tables.
+
+GenericFeatureForm adds widgets, validators and reference combos for all
+fields given by schema_catalog, so any edb table gets a custom form
+without hand-written code. install_generic_form writes the form ui of a
+table and sets it, with formOpen as init function, on the layer.
+"""
+
+import os
+from functools import partial
+
+from qgis.core import QgsDataSourceURI, QgsMessageLog, QgsVectorLayer
+from PyQt4 import QtGui
+
+from AirviroOfflineEdb.form_utils import (
+    BaseFeatureForm,
+    open_form,
+    set_widget_style,
+    validate_rule
+)
+from AirviroOfflineEdb.lookup_cache import get_lookup_cache
+from AirviroOfflineEdb.rsrc_cache import cache_dir, path_digest
+from AirviroOfflineEdb.schema_catalog import (
+    COMBO_SUFFIX,
+    READ_ONLY,
+    REFERENCE,
+    form_fields,
+    form_ui
+)
+from AirviroOfflineEdb.validation_rules import compile_value_check
+
+INVALID_STYLE = "background-color: rgba(255, 107, 107, 150);"
+
+# tables given a generic form when an edb is opened
+GENERIC_FORM_TABLES = ('points', 'areas', 'companies', 'facilities')
+
+# text of reference combo item for no reference
+NO_REFERENCE = '-'
+
+
+def fill_reference_combo(combo, rows):
+    """Replace items of a reference combo with (key, label) rows."""
+    combo.blockSignals(True)
+    combo.clear()
+    combo.addItem(NO_REFERENCE, None)
+    for key, label in rows:
+        combo.addItem(unicode(label), key)
+    combo.blockSignals(False)
+
+
+class GenericFeatureForm(BaseFeatureForm):
+
+    """Form of an edb table, defined by the fields of the table."""
+
+    def __init__(self, dialog, layer, feature, table=None, **kwargs):
+        super(GenericFeatureForm, self).__init__(
+            dialog, layer, feature, **kwargs
+        )
+        self.table = table or QgsDataSourceURI(layer.source()).table()
+
+    def get_lookups(self):
+        return get_lookup_cache(self.get_db_file())
+
+    def profiled_connections(self):
+        return [self.con, self.get_lookups().con]
+
+    def load_data(self):
+        self.fields = form_fields(self.con, self.get_db_file(), self.table)
+        lookups = self.get_lookups()
+        self.references = dict(
+            (field.name, lookups.get(field.lookup))
+            for field in self.fields if field.kind == REFERENCE
+        )
+
+    def find_widgets(self):
+        for field in self.fields:
+            validators = []
+            if field.rule is not None:
+                validators.append(
+                    partial(validate_rule, compile_value_check(field.rule))
+                )
+            self.add_widget(
+                field.name,
+                QtGui.QLineEdit,
+                validators=validators,
+                on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
+                on_valid=[set_widget_style],
+                enable_on_edit=field.kind != READ_ONLY
+            )
+            if field.kind == REFERENCE:
+                self.add_widget(
+                    field.name + COMBO_SUFFIX,
+                    QtGui.QComboBox,
+                    init=partial(self.init_reference_combo, field.name),
+                    on_action=partial(self.reference_selected, field.name),
+                    enable_on_edit=True
+                )
+
+        self.add_widget('form_validation_msg_label', QtGui.QLabel)
+        self.add_widget('buttonBox', QtGui.QDialogButtonBox)
+
+    def init_reference_combo(self, name, combo):
+        """Fill reference combo and hide the line edit holding the key."""
+        self.widgets[name].widget.hide()
+        fill_reference_combo(combo, self.references[name])
+        self.set_reference_combo(name)
+
+    def set_reference_combo(self, name):
+        """Select the combo item of the key in the line edit."""
+        combo = self.widgets[name + COMBO_SUFFIX].widget
+        text = self.widgets[name].widget.text()
+        index = 0
+        for i in range(1, combo.count()):
+            if unicode(combo.itemData(i)) == text:
+                index = i
+                break
+        combo.blockSignals(True)
+        combo.setCurrentIndex(index)
+        combo.blockSignals(False)
+
+    def reference_selected(self, name, index):
+        """Write the key of the selected combo item to the line edit."""
+        combo = self.widgets[name + COMBO_SUFFIX].widget
+        key = combo.itemData(index)
+        self.widgets[name].widget.setText('' if key is None else unicode(key))
+
+    def rebind(self, feature):
+        """Bind form to another feature of the table.
+
+        Returns False if a referenced table has changed since the form was
+        built, the form must then be built again.
+        """
+        lookups = self.get_lookups()
+        for field in self.fields:
+            if field.kind == REFERENCE and \
+               lookups.get(field.lookup) is not self.references[field.name]:
+                return False
+        self.feature = feature
+        for name in self.references:
+            self.set_reference_combo(name)
+        return True
+
+
+def formOpen(dialog, layerid, featureid):
+    open_form(
+        GenericFeatureForm, dialog, layerid, featureid,
+        msg_method='label',
+        msg_widget='form_validation_msg_label'
+    )
+
+
+def form_ui_path(filename, table):
+    """Return path of the generated form ui of a table in an edb."""
+    directory = os.path.join(os.path.dirname(cache_dir()), 'forms')
+    filename = os.path.abspath(filename)
+    edb_name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(directory, '%s-%s-%s.ui' % (
+        edb_name, path_digest(filename)[:8], table
+    ))
+
+
+def install_generic_form(layer, con, filename, table):
+    """Write the form ui of a table and use it as form of the layer."""
+    ui_path = form_ui_path(filename, table)
+    if not os.path.isdir(os.path.dirname(ui_path)):
+        os.makedirs(os.path.dirname(ui_path))
+    with open(ui_path, 'w') as ui_file:
+        ui_file.write(form_ui(table, form_fields(con, filename, table)))
+
+    layer.setEditForm(ui_path)
+    layer.setEditorLayout(QgsVectorLayer.UiFileLayout)
+    layer.setEditFormInit('AirviroOfflineEdb.generic_form.formOpen')
+    QgsMessageLog.logMessage(
+        'Installed generic form for %s' % table,
+        'AirviroOfflineEdb',
+        QgsMessageLog.INFO
+    )
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""Out-of-core storage of grid source rasters as compressed tiles.
+
+The raster of a grid source is stored in the edb as zlib-compressed
+square tiles, one band per substance. Tiles are read and written one at a
+time, so grids far larger than the available memory can be imported,
+summed and exported. Missing tiles are treated as zeros, which makes
+sparse national grids cheap to store.
+
+For random access a grid band is decompressed tile by tile into a memory
+mapped file, and for rendering it is exported to a tiled and compressed
+GeoTIFF with overviews, which GDAL/QGIS reads block-wise.
+
+Grid sources of the edb are converted to tiles with convert_grid_sources,
+after which the emission calculation sums their bands tile by tile.
+
+This module does not depend on QGIS and can be used headless, GDAL is
+only required for raster import and export.
+"""
+
+from __future__ import division
+
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+
+DEFAULT_TILE_SIZE = 256
+COMPRESSION_LEVEL = 6
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]
+
+
+def create_tile_tables(con):
+    """Create tables for tiled grid storage if not existing."""
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS grid_tile_info (
+          grid INTEGER PRIMARY KEY,
+          nrows INTEGER NOT NULL,
+          ncols INTEGER NOT NULL,
+          tile_size INTEGER NOT NULL,
+          x0 REAL NOT NULL,
+          y0 REAL NOT NULL,
+          dx REAL NOT NULL,
+          dy REAL NOT NULL,
+          dtype TEXT NOT NULL
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS grid_tiles (
+          grid INTEGER NOT NULL,
+          band INTEGER NOT NULL,
+          tile_row INTEGER NOT NULL,
+          tile_col INTEGER NOT NULL,
+          data BLOB NOT NULL,
+          PRIMARY KEY (grid, band, tile_row, tile_col)
+        )
+        """
+    )
+
+
+def tiled_grids(con):
+    """Return id's of grids stored as tiles."""
+    if not relation_in_db(con, 'grid_tile_info'):
+        return []
+    return [row[0] for row in con.execute(
+        'SELECT grid FROM grid_tile_info ORDER BY grid'
+    )]
+
+
+class GridTiles(object):
+
+    """Access to a tiled grid source raster.
+
+    x0, y0 is the upper left corner and row 0 is the northern-most row.
+    """
+
+    def __init__(self, con, grid):
+        self.con = con
+        self.grid = grid
+        row = con.execute(
+            """
+            SELECT nrows, ncols, tile_size, x0, y0, dx, dy, dtype
+            FROM grid_tile_info WHERE grid=?
+            """,
+            (grid,)
+        ).fetchone()
+        if row is None:
+            raise ValueError('Grid %s is not stored as tiles' % grid)
+        (self.nrows, self.ncols, self.tile_size,
+         self.x0, self.y0, self.dx, self.dy, dtype) = row
+        self.dtype = np.dtype(str(dtype))
+
+    @classmethod
+    def create(cls, con, grid, nrows, ncols, x0, y0, dx, dy,
+               tile_size=DEFAULT_TILE_SIZE, dtype='float32'):
+        """Create (or replace) tiled storage for a grid."""
+        create_tile_tables(con)
+        with con:
+            con.execute('DELETE FROM grid_tiles WHERE grid=?', (grid,))
+            con.execute(
+                'INSERT OR REPLACE INTO grid_tile_info '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (grid, nrows, ncols, tile_size, x0, y0, dx, dy,
+                 np.dtype(dtype).str)
+            )
+        return cls(con, grid)
+
+    @property
+    def ntile_rows(self):
+        return -(-self.nrows // self.tile_size)
+
+    @property
+    def ntile_cols(self):
+        return -(-self.ncols // self.tile_size)
+
+    def bands(self):
+        return [row[0] for row in self.con.execute(
+            'SELECT DISTINCT band FROM grid_tiles WHERE grid=? ORDER BY band',
+            (self.grid,)
+        )]
+
+    def fingerprint(self, band):
+        """Return a value that changes when the tiles of a band change."""
+        return tuple(self.con.execute(
+            'SELECT count(*), max(rowid), total(length(data)) '
+            'FROM grid_tiles WHERE grid=? AND band=?',
+            (self.grid, band)
+        ).fetchone())
+
+    def tile_shape(self, tile_row, tile_col):
+        nrows = min(self.tile_size, self.nrows - tile_row * self.tile_size)
+        ncols = min(self.tile_size, self.ncols - tile_col * self.tile_size)
+        return nrows, ncols
+
+    def write_tile(self, band, tile_row, tile_col, array):
+        """Compress and store a tile, all-zero tiles are not stored."""
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if array.shape != self.tile_shape(tile_row, tile_col):
+            raise ValueError(
+                'Invalid shape %s of tile (%i, %i)' % (
+                    array.shape, tile_row, tile_col
+                )
+            )
+        key = (self.grid, band, tile_row, tile_col)
+        if not array.any():
+            self.con.execute(
+                'DELETE FROM grid_tiles WHERE grid=? AND band=? '
+                'AND tile_row=? AND tile_col=?',
+                key
+            )
+            return
+        data = zlib.compress(array.tostring(), COMPRESSION_LEVEL)
+        self.con.execute(
+            'INSERT OR REPLACE INTO grid_tiles VALUES (?, ?, ?, ?, ?)',
+            key + (buffer(data),)
+        )
+
+    def read_tile(self, band, tile_row, tile_col):
+        """Return a decompressed tile, zeros if not stored."""
+        row = self.con.execute(
+            'SELECT data FROM grid_tiles WHERE grid=? AND band=? '
+            'AND tile_row=? AND tile_col=?',
+            (self.grid, band, tile_row, tile_col)
+        ).fetchone()
+        shape = self.tile_shape(tile_row, tile_col)
+        if row is None:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.frombuffer(
+            zlib.decompress(bytes(row[0])), dtype=self.dtype
+        ).reshape(shape)
+
+    def iter_tiles(self, band, skip_empty=True):
+        """Iterate over (row_offset, col_offset, tile) of a band.
+
+        Only one tile at a time is kept in memory. Empty tiles are
+        skipped unless skip_empty is False.
+        """
+        if skip_empty:
+            cur = self.con.execute(
+                'SELECT tile_row, tile_col, data FROM grid_tiles '
+                'WHERE grid=? AND band=? ORDER BY tile_row, tile_col',
+                (self.grid, band)
+            )
+            for tile_row, tile_col, data in cur:
+                tile = np.frombuffer(
+                    zlib.decompress(bytes(data)), dtype=self.dtype
+                ).reshape(self.tile_shape(tile_row, tile_col))
+                yield (
+                    tile_row * self.tile_size, tile_col * self.tile_size, tile
+                )
+        else:
+            for tile_row in range(self.ntile_rows):
+                for tile_col in range(self.ntile_cols):
+                    yield (
+                        tile_row * self.tile_size,
+                        tile_col * self.tile_size,
+                        self.read_tile(band, tile_row, tile_col)
+                    )
+
+    def write_array(self, band, array):
+        """Store a (possibly memory mapped) array tile by tile."""
+        if array.shape != (self.nrows, self.ncols):
+            raise ValueError('Invalid shape %s of grid' % (array.shape,))
+        with self.con:
+            for tile_row in range(self.ntile_rows):
+                r0 = tile_row * self.tile_size
+                for tile_col in range(self.ntile_cols):
+                    c0 = tile_col * self.tile_size
+                    self.write_tile(
+                        band, tile_row, tile_col,
+                        array[r0:r0 + self.tile_size, c0:c0 + self.tile_size]
+                    )
+
+    def total(self, band):
+        """Sum of all cells of a band, calculated tile by tile."""
+        return sum(
+            float(tile.sum(dtype=np.float64))
+            for r0, c0, tile in self.iter_tiles(band)
+        )
+
+    def to_memmap(self, band, filename=None):
+        """Decompress band into a memory mapped array.
+
+        The file is created in the temp directory if no filename is given.
+        """
+        if filename is None:
+            fd, filename = tempfile.mkstemp(
+                prefix='grid_%s_%s_' % (self.grid, band), suffix='.dat'
+            )
+            os.close(fd)
+        array = np.memmap(
+            filename, dtype=self.dtype, mode='w+',
+            shape=(self.nrows, self.ncols)
+        )
+        for r0, c0, tile in self.iter_tiles(band):
+            nrows, ncols = tile.shape
+            array[r0:r0 + nrows, c0:c0 + ncols] = tile
+        array.flush()
+        return array
+
+    def geotransform(self):
+        return (self.x0, self.dx, 0, self.y0, 0, -self.dy)
+
+    def export_geotiff(self, band, filename, epsg=None):
+        """Write band to a tiled, compressed GeoTIFF with overviews."""
+        from osgeo import gdal, gdal_array, osr
+
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(
+            filename, self.ncols, self.nrows, 1,
+            gdal_array.NumericTypeCodeToGDALTypeCode(self.dtype.type),
+            [
+                'TILED=YES',
+                'BLOCKXSIZE=%i' % self.tile_size,
+                'BLOCKYSIZE=%i' % self.tile_size,
+                'COMPRESS=DEFLATE',
+                'SPARSE_OK=TRUE',
+                'BIGTIFF=IF_SAFER'
+            ]
+        )
+        dataset.SetGeoTransform(self.geotransform())
+        if epsg is not None:
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(epsg)
+            dataset.SetProjection(srs.ExportToWkt())
+        raster_band = dataset.GetRasterBand(1)
+        raster_band.SetNoDataValue(0)
+        for r0, c0, tile in self.iter_tiles(band):
+            raster_band.WriteArray(tile, c0, r0)
+        raster_band.FlushCache()
+        dataset.BuildOverviews('AVERAGE', OVERVIEW_LEVELS)
+        dataset = None
+        return filename
+
+
+def import_raster(con, grid, filename, band=1, raster_band=1,
+                  tile_size=DEFAULT_TILE_SIZE):
+    """Import a GDAL raster band into tiled storage, tile by tile."""
+    from osgeo import gdal
+
+    dataset = gdal.Open(filename)
+    if dataset is None:
+        raise ValueError('Could not open raster %s' % filename)
+    x0, dx, rot1, y0, rot2, dy = dataset.GetGeoTransform()
+    if rot1 != 0 or rot2 != 0:
+        raise ValueError('Rotated rasters are not supported')
+    source_band = dataset.GetRasterBand(raster_band)
+    array = source_band.ReadAsArray(0, 0, 1, 1)
+    tiles = GridTiles.create(
+        con, grid, dataset.RasterYSize, dataset.RasterXSize,
+        x0, y0, dx, -dy, tile_size=tile_size, dtype=array.dtype
+    )
+    with con:
+        for tile_row in range(tiles.ntile_rows):
+            for tile_col in range(tiles.ntile_cols):
+                nrows, ncols = tiles.tile_shape(tile_row, tile_col)
+                tile = source_band.ReadAsArray(
+                    tile_col * tile_size, tile_row * tile_size, ncols, nrows
+                )
+                tiles.write_tile(band, tile_row, tile_col, tile)
+    return tiles
+
+
+def geometry_extent(blob):
+    """Return (minx, miny, maxx, maxy) of a SpatiaLite geometry blob.
+
+    The extent is read from the header of the blob, so SpatiaLite does not
+    need to be loaded.
+    """
+    blob = bytes(blob)
+    if len(blob) < 39 or blob[0] != b'\x00' or blob[38] != b'\x7c':
+        raise ValueError('Invalid SpatiaLite geometry')
+    endian = '<' if blob[1] == b'\x01' else '>'
+    return struct.unpack(endian + '4d', blob[6:38])
+
+
+def convert_grid_sources(con, cell_size, grids=None,
+                         tile_size=DEFAULT_TILE_SIZE):
+    """Convert grid sources of the edb to tiled storage.
+
+    The raster of each grid source covers the extent of its geometry with
+    square cells of cell_size. The emission of each substance, as given
+    by the grid emission view, is distributed evenly over the cells and
+    stored as the band of that substance. Distributions from other data
+    can then be imported band by band with import_raster.
+
+    @param grids: id's of grid sources to convert, default is all grid
+    sources not already stored as tiles
+    Returns the id's of the converted grid sources.
+    """
+    row = con.execute(
+        "SELECT f_geometry_column FROM geometry_columns "
+        "WHERE lower(f_table_name)='grids'"
+    ).fetchone()
+    if row is None:
+        raise ValueError('No geometry column found for grid sources')
+    geom_col = row[0]
+    if grids is None:
+        tiled = set(tiled_grids(con))
+        grids = [
+            r[0] for r in con.execute('SELECT id FROM grids ORDER BY id')
+            if r[0] not in tiled
+        ]
+    for grid in grids:
+        row = con.execute(
+            'SELECT "%s" FROM grids WHERE id=?' % geom_col, (grid,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            raise ValueError('Grid source %s has no geometry' % grid)
+        minx, miny, maxx, maxy = geometry_extent(row[0])
+        ncols = max(1, int(np.ceil(round((maxx - minx) / cell_size, 6))))
+        nrows = max(1, int(np.ceil(round((maxy - miny) / cell_size, 6))))
+        tiles = GridTiles.create(
+            con, grid, nrows, ncols, minx, maxy, cell_size, cell_size,
+            tile_size=tile_size
+        )
+        emissions = con.execute(
+            'SELECT substance, emis FROM grid_emission_view '
+            'WHERE source=? ORDER BY substance',
+            (grid,)
+        ).fetchall()
+        with con:
+            for substance, emis in emissions:
+                value = (emis or 0) / (nrows * ncols)
+                for tile_row in range(tiles.ntile_rows):
+                    for tile_col in range(tiles.ntile_cols):
+                        tiles.write_tile(
+                            substance, tile_row, tile_col,
+                            np.full(
+                                tiles.tile_shape(tile_row, tile_col),
+                                value, dtype=tiles.dtype
+                            )
+                        )
+    return grids
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Cache of lookup data shared by all forms of an edb.
+
+Lookups are small, rarely changed tables (vehicles, time variations,
+traffic situation definitions etc) that every form needs when opened.
+They are read once per edb and kept until the tables they were read from
+change. Changes made by any connection are detected through
+PRAGMA data_version, after which only lookups whose tables have a new
+content fingerprint are reloaded.
+
+Lookups are registered by name with register_lookup, giving the tables
+the lookup depends on and a loader function called with a connection.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import os
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.readonly_edb import connect_edb, edb_key
+from AirviroOfflineEdb.sqlite_utils import data_version, table_fingerprint
+
+# registered lookups, name: (tables, loader)
+LOOKUPS = {}
+
+# lookup caches per edb, see get_lookup_cache
+_lookup_caches = {}
+
+
+def register_lookup(name, tables, loader):
+    """Register a lookup read by loader(con) from the given tables."""
+    LOOKUPS[name] = (tuple(tables), loader)
+
+
+def register_query_lookup(name, tables, query):
+    """Register a lookup given by the rows of a query."""
+    register_lookup(
+        name, tables, lambda con: con.execute(query).fetchall()
+    )
+
+
+def get_lookup_cache(filename):
+    """Return the shared LookupCache for an edb."""
+    key = edb_key(filename)
+    if key not in _lookup_caches:
+        _lookup_caches[key] = LookupCache(key[0])
+    return _lookup_caches[key]
+
+
+def file_stamp(filename):
+    """Return (mtime, size) of a file, None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class LookupCache(object):
+
+    """Lookup data of an edb, reloaded only when the source tables change."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.con = connect_edb(filename)
+        self.con.row_factory = sqlite3.Row
+        self._values = {}
+        self._fingerprints = {}
+        self._version = None
+
+    def _check(self):
+        """Drop lookups whose tables have changed since they were read."""
+        version = data_version(self.con)
+        if version == self._version:
+            return
+        self._version = version
+
+        table_fingerprints = {}
+        for name in list(self._values):
+            tables, loader = LOOKUPS[name]
+            for table in tables:
+                if table not in table_fingerprints:
+                    table_fingerprints[table] = table_fingerprint(
+                        self.con, table
+                    )
+            fingerprint = tuple(table_fingerprints[t] for t in tables)
+            if fingerprint != self._fingerprints[name]:
+                del self._values[name]
+
+    def get(self, name):
+        """Return value of a registered lookup."""
+        self._check()
+        if name not in self._values:
+            tables, loader = LOOKUPS[name]
+            self._fingerprints[name] = tuple(
+                table_fingerprint(self.con, table) for table in tables
+            )
+            self._values[name] = loader(self.con)
+        return self._values[name]
+
+    def invalidate(self, tables=None):
+        """Drop lookups depending on any of tables, or all lookups."""
+        if tables is None:
+            self._values = {}
+            return
+        tables = set(tables)
+        for name in list(self._values):
+            if tables.intersection(LOOKUPS[name][0]):
+                del self._values[name]
@@ -25,8 +25,8 @@ from PyQt4.QtGui import QAction, QIcon
 # Initialize Qt resources from file resources.py
 import resources
 
-# Import the code for the DockWidget
-from qgis_edb_dockwidget import AirviroOfflineEdbDockWidget
+# The dock widget, and with it pyAirviro and the rest of the plugin, is
+# imported on first run to keep QGIS startup fast
 import os.path
 
 
@@ -203,6 +203,10 @@ class AirviroOfflineEdb:
         # remove the toolbar
         del self.toolbar
 
+        if self.dockwidget is not None:
+            self.dockwidget.close_working_copy()
+            self.dockwidget.close_emission_totals()
+
     # -------------------------------------------------------------------------
 
     def run(self):
@@ -217,6 +221,7 @@ class AirviroOfflineEdb:
             #    first run of plugin
             #    removed on close (see self.onClosePlugin method)
             if self.dockwidget is None:
+                from qgis_edb_dockwidget import AirviroOfflineEdbDockWidget
                 # Create the dockwidget (after translation) and keep reference
                 self.dockwidget = AirviroOfflineEdbDockWidget()
 
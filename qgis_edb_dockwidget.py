@@ -24,16 +24,27 @@
 from __future__ import unicode_literals
 from __future__ import division
 
+import glob
+import hashlib
 import os
+import time
+from functools import partial
 
 # import qgis first to ensure sip.api is set for QString and QVariant
 from qgis.core import (
+    QGis,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
+    QgsGeometry,
+    QgsRasterLayer,
     QgsVectorLayer,
     QgsProject,
     QgsDataSourceURI,
     QgsMapLayerRegistry,
     QgsMapLayer,
     QgsRelation,
+    QgsVectorJoinInfo,
     QgsCoordinateReferenceSystem,
     QgsMessageLog
 )
@@ -42,8 +53,8 @@ from qgis.gui import QgsMessageBar
 from qgis.utils import iface
 
 from PyQt4 import uic
-from PyQt4.QtCore import pyqtSignal
-from PyQt4.QtGui import QFileDialog, QDockWidget
+from PyQt4.QtCore import pyqtSignal, QTimer, QVariant
+from PyQt4.QtGui import QFileDialog, QDockWidget, QApplication
 
 # from pyAirviro.edb.edb import Edb, SerialEdb, is_serial_edb
 from pyAirviro.edb.sqliteapi import (
@@ -59,9 +70,50 @@ from pyAirviro.edb.sqliteapi import (
     table_in_db
 )
 
+from AirviroOfflineEdb import emission_calc, quality_scan, validation_runner
+from AirviroOfflineEdb import form_profiler
+from AirviroOfflineEdb.emission_totals import (
+    close_emission_totals,
+    get_emission_totals
+)
+from AirviroOfflineEdb.form_utils import connect_db
+from AirviroOfflineEdb.generic_form import (
+    GENERIC_FORM_TABLES,
+    install_generic_form
+)
+from AirviroOfflineEdb.grid_tiles import GridTiles, tiled_grids
+from AirviroOfflineEdb.readonly_edb import readonly_access, set_readonly
+from AirviroOfflineEdb.rsrc_cache import cache_dir, path_digest
+from AirviroOfflineEdb.working_copy import (
+    WorkingCopy,
+    WriteBackConflict,
+    source_filename
+)
+
 
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
-    os.path.dirname(__file__), 'qgis_edb_dockwidget_base.ui'))
+try:
+    # compiled by pyuic4, see make compile
+    from AirviroOfflineEdb.ui_qgis_edb_dockwidget_base import (
+        Ui_AirviroOfflineEdbDockWidgetBase as FORM_CLASS
+    )
+except ImportError:
+    FORM_CLASS, _ = uic.loadUiType(os.path.join(
+        os.path.dirname(__file__), 'qgis_edb_dockwidget_base.ui'))
+
+# milliseconds between write-backs of a working copy
+WRITE_BACK_INTERVAL = 120000
+
+
+def remove_stale_exports(grid_dir, grid, band, filename):
+    """Remove exports of a grid band other than filename."""
+    pattern = os.path.join(grid_dir, 'grid_%s_%s_*.tif*' % (grid, band))
+    for stale in glob.glob(pattern):
+        if not stale.startswith(filename):
+            try:
+                os.remove(stale)
+            except OSError:
+                # e.g. still opened by another QGIS instance
+                pass
 
 
 class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
@@ -92,11 +144,48 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
             self.open_db
         )
 
+        self.calc_emis_btn.clicked.connect(
+            self.calculate_emissions
+        )
+
+        self.scan_edb_btn.clicked.connect(
+            self.scan_edb
+        )
+
+        self.validate_edb_btn.clicked.connect(
+            self.validate_edb
+        )
+
+        self.profile_forms_checkbox.toggled.connect(
+            self.toggle_form_profiling
+        )
+        self.cprofile_checkbox.toggled.connect(
+            self.toggle_cprofile
+        )
+        self.profile_refresh_btn.clicked.connect(
+            self.show_form_profile
+        )
+        self.profile_clear_btn.clicked.connect(
+            self.clear_form_profile
+        )
+        self.cprofile_checkbox.setEnabled(False)
+
+        self.save_edb_btn.clicked.connect(
+            self.write_back
+        )
+        self.write_back_timer = QTimer(self)
+        self.write_back_timer.setInterval(WRITE_BACK_INTERVAL)
+        self.write_back_timer.timeout.connect(self.write_back)
+
         self.db_uri = QgsDataSourceURI()
         self.con = None
         self.cur = None
         self.epsg = None
+        self.readonly = False
         self.layers = {}
+        self.edb_group = None
+        self.emission_totals = None
+        self.working_copy = None
 
     def select_save_db_filename(self):
         filename = QFileDialog.getSaveFileName(
@@ -125,9 +214,30 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
             QgsMessageLog.INFO
         )
 
-        self.db_uri.setDatabase(edb_filename)
-        self.con, self.cur = connect(str(self.db_uri.database()))
+        self.close_working_copy()
+        self.readonly = self.open_readonly_checkbox.isChecked()
+        if self.working_copy_checkbox.isChecked() and not self.readonly:
+            if not self.open_working_copy(str(edb_filename)):
+                return
+            self.db_uri.setDatabase(self.working_copy.path)
+        else:
+            self.db_uri.setDatabase(edb_filename)
+        set_readonly(str(self.db_uri.database()), self.readonly)
+        if self.readonly:
+            self.con, self.cur = connect_db(str(self.db_uri.database()))
+            QgsMessageLog.logMessage(
+                "Opened edb read-only: %s" % readonly_access(
+                    str(self.db_uri.database())
+                ),
+                'AirviroOfflineEdb',
+                QgsMessageLog.INFO
+            )
+        else:
+            self.con, self.cur = connect(str(self.db_uri.database()))
         self.epsg = get_epsg(self.con)
+        # emissions and validation reports are written to the edb
+        self.calc_emis_btn.setEnabled(not self.readonly)
+        self.validate_edb_btn.setEnabled(not self.readonly)
 
         root = QgsProject.instance().layerTreeRoot()
 
@@ -142,6 +252,7 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
             QgsMessageLog.INFO
         )
         edb_group = root.addGroup(edb_name)
+        self.edb_group = edb_group
 
         point_group = edb_group.addGroup('Point sources')
         area_group = edb_group.addGroup('Area sources')
@@ -196,6 +307,8 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
             )
             if not layer.isValid():
                 raise ValueError(edb_filename)
+            if self.readonly:
+                layer.setReadOnly(True)
             map_layer = QgsMapLayerRegistry.instance().addMapLayer(
                 layer, False
             )
@@ -230,7 +343,7 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
                 group = road_vehicle_group
             elif 'roadtype' in table:
                 group = roadtype_group
-            elif table == 'facilties':
+            elif table == 'facilities':
                 group = facility_group
             elif 'facility' in table:
                 group = facility_support_group
@@ -246,6 +359,117 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
             group.addLayer(map_layer)
             self.layers[table] = map_layer.id()
 
+        if not self.readonly:
+            # relations are only used by the relation widgets when editing
+            self.add_relations()
+
+        if self.working_copy is not None:
+            for layer_id in self.layers.itervalues():
+                QgsMapLayerRegistry.instance().mapLayer(
+                    layer_id
+                ).editingStopped.connect(self.write_back)
+            self.write_back_timer.start()
+
+        for table in GENERIC_FORM_TABLES:
+            if table in self.layers:
+                install_generic_form(
+                    QgsMapLayerRegistry.instance().mapLayer(
+                        self.layers[table]
+                    ),
+                    self.con,
+                    str(self.db_uri.database()),
+                    table
+                )
+
+        self.add_grid_rasters(grid_group)
+
+        self.init_emission_totals()
+
+    def open_working_copy(self, edb_filename):
+        """Open a working copy of the edb, return False on conflict.
+
+        Changes left in the copy by a crashed session are written back
+        first.
+        """
+        self.working_copy = WorkingCopy(
+            edb_filename,
+            os.path.join(os.path.dirname(cache_dir()), 'working_copies'),
+            connect=lambda filename: connect(filename)[0]
+        )
+        try:
+            npending = self.working_copy.open()
+        except ValueError, err:
+            self.working_copy = None
+            iface.messageBar().pushMessage(
+                "Error",
+                unicode(err),
+                level=QgsMessageBar.CRITICAL
+            )
+            return False
+        QgsMessageLog.logMessage(
+            "Editing working copy %s" % self.working_copy.path,
+            'AirviroOfflineEdb',
+            QgsMessageLog.INFO
+        )
+        if npending > 0:
+            QgsMessageLog.logMessage(
+                "Recovered %i changes from working copy" % npending,
+                'AirviroOfflineEdb',
+                QgsMessageLog.WARNING
+            )
+            self.write_back()
+        self.save_edb_btn.setEnabled(True)
+        return True
+
+    def write_back(self, *args):
+        """Write changes of the working copy back to the edb."""
+        if self.working_copy is None:
+            return
+        start = time.time()
+        try:
+            nrows = self.working_copy.write_back()
+        except WriteBackConflict, err:
+            # writing back would overwrite the changes of others, which
+            # must be resolved by the user
+            self.write_back_timer.stop()
+            iface.messageBar().pushMessage(
+                "Error",
+                "%s, changes are kept in the working copy" % err,
+                level=QgsMessageBar.CRITICAL
+            )
+            return
+        except Exception, err:
+            # e.g. edb locked by another user, changes are kept in the
+            # working copy until the next write-back
+            iface.messageBar().pushMessage(
+                "Warning",
+                "Could not write back changes: %s" % err,
+                level=QgsMessageBar.WARNING,
+                duration=5
+            )
+            return
+        if nrows > 0:
+            QgsMessageLog.logMessage(
+                "Wrote back %i changed rows in %.2f s" % (
+                    nrows, time.time() - start
+                ),
+                'AirviroOfflineEdb',
+                QgsMessageLog.INFO
+            )
+
+    def close_working_copy(self):
+        """Write back and close the working copy, if any."""
+        if self.working_copy is None:
+            return
+        self.write_back_timer.stop()
+        self.write_back()
+        close_emission_totals(self.working_copy.path)
+        self.working_copy.close(write_back=False)
+        self.working_copy = None
+        self.save_edb_btn.setEnabled(False)
+
+    def add_relations(self):
+        """Add relations between layers for the foreign keys of the edb."""
         for table in TABLES:
             foreign_keys = get_foreign_keys(self.con, table)
             referencing_layer = self.layers[table]
@@ -273,6 +497,375 @@ class AirviroOfflineEdbDockWidget(QDockWidget, FORM_CLASS):
                     )
                 QgsProject.instance().relationManager().addRelation(rel)
 
+    def grid_dir(self):
+        """Return directory of the GeoTIFF exports of grid sources.
+
+        The exports are written next to the edb, or to the local cache
+        of the plugin when the edb is opened read-only, e.g. from a
+        read-only network share.
+        """
+        edb_filename = source_filename(str(self.db_uri.database()))
+        if not self.readonly:
+            return os.path.splitext(edb_filename)[0] + '_grids'
+        edb_filename = os.path.abspath(edb_filename)
+        return os.path.join(
+            os.path.dirname(cache_dir()), 'grids', '%s-%s' % (
+                os.path.splitext(os.path.basename(edb_filename))[0],
+                path_digest(edb_filename)[:8]
+            )
+        )
+
+    def add_grid_rasters(self, group):
+        """Add raster layers for grid sources stored as tiles.
+
+        Each band is exported to a tiled GeoTIFF with overviews in
+        grid_dir, which is only rewritten when the tiles have changed.
+        Exports of earlier versions of the tiles are then removed.
+        QGIS then reads only the blocks that are visible.
+        """
+        grid_dir = self.grid_dir()
+        for grid in tiled_grids(self.con):
+            tiles = GridTiles(self.con, grid)
+            for band in tiles.bands():
+                checksum = hashlib.md5(
+                    repr(tiles.fingerprint(band))
+                ).hexdigest()[:8]
+                filename = os.path.join(
+                    grid_dir, 'grid_%s_%s_%s.tif' % (grid, band, checksum)
+                )
+                if not os.path.exists(filename):
+                    if not os.path.exists(grid_dir):
+                        os.makedirs(grid_dir)
+                    tiles.export_geotiff(band, filename, self.epsg)
+                    remove_stale_exports(grid_dir, grid, band, filename)
+                layer = QgsRasterLayer(
+                    filename, 'grid %s band %s' % (grid, band)
+                )
+                if not layer.isValid():
+                    raise ValueError(filename)
+                QgsMapLayerRegistry.instance().addMapLayer(layer, False)
+                group.addLayer(layer)
+
+    def close_emission_totals(self):
+        """Close the connections of the emission totals of all edb's."""
+        if self.emission_totals is not None:
+            self.emission_totals.remove_listener(self.show_emission_delta)
+            self.emission_totals = None
+        close_emission_totals()
+
+    def init_emission_totals(self):
+        """Load emission totals and update them when sources are edited."""
+        if self.emission_totals is not None:
+            self.emission_totals.remove_listener(self.show_emission_delta)
+        self.emission_totals = get_emission_totals(
+            str(self.db_uri.database())
+        )
+        self.emission_totals.load_totals()
+        self.emission_totals.add_listener(self.show_emission_delta)
+        self.emis_totals_label.setText(self.emission_totals.format_totals())
+        if self.readonly:
+            return
+
+        registry = QgsMapLayerRegistry.instance()
+        for source_type in emission_calc.SOURCE_TYPES:
+            if source_type not in self.layers:
+                continue
+            layer = registry.mapLayer(self.layers[source_type])
+            layer.beforeCommitChanges.connect(
+                partial(self.snapshot_edited_sources, layer, source_type)
+            )
+            layer.committedFeaturesAdded.connect(
+                partial(self.update_added_sources, source_type)
+            )
+            layer.committedFeaturesRemoved.connect(
+                partial(self.update_changed_sources, source_type)
+            )
+            layer.committedAttributeValuesChanges.connect(
+                partial(self.update_changed_sources, source_type)
+            )
+            layer.committedGeometriesChanges.connect(
+                partial(self.update_changed_sources, source_type)
+            )
+
+    def snapshot_edited_sources(self, layer, source_type):
+        """Store emissions of sources before edits are committed."""
+        edit_buffer = layer.editBuffer()
+        if edit_buffer is None:
+            return
+        source_ids = set(edit_buffer.changedAttributeValues().keys())
+        source_ids.update(edit_buffer.changedGeometries().keys())
+        source_ids.update(edit_buffer.deletedFeatureIds())
+        self.emission_totals.snapshot(source_type, source_ids)
+
+    def update_added_sources(self, source_type, layer_id, features):
+        self.emission_totals.update(
+            source_type, [feature.id() for feature in features]
+        )
+
+    def update_changed_sources(self, source_type, layer_id, changes):
+        # changes is either a set of feature id's or a dict with
+        # feature id's as keys
+        self.emission_totals.update(source_type, list(changes))
+
+    def show_emission_delta(self, source_type, source_ids, delta):
+        if len(source_ids) == 1:
+            title = 'Last edit: %s %s' % (source_type, list(source_ids)[0])
+        else:
+            title = 'Last edit: %i %s' % (len(source_ids), source_type)
+        title += ' (updated in %.0f ms)' % (
+            1000 * self.emission_totals.last_update_time
+        )
+        self.emis_delta_title_label.setText(title)
+        self.emis_delta_label.setText(self.emission_totals.format_delta(delta))
+        self.emis_totals_label.setText(self.emission_totals.format_totals())
+
+    def processes(self):
+        """Number of processes for calculation and validation.
+
+        Both use the parallel processing settings of the Emissions tab,
+        None means all cores.
+        """
+        if self.parallel_checkbox.isChecked():
+            return self.processes_spinbox.value() or None
+        return 1
+
+    def calculate_emissions(self):
+        """Calculate emissions for all sources of the opened edb."""
+        if self.con is None:
+            iface.messageBar().pushMessage(
+                "Warning",
+                "No edb opened",
+                level=QgsMessageBar.WARNING,
+                duration=3
+            )
+            return
+
+        processes = self.processes()
+
+        def progress(done, total):
+            self.calc_progressbar.setMaximum(total)
+            self.calc_progressbar.setValue(done)
+            QApplication.processEvents()
+
+        self.calc_emis_btn.setEnabled(False)
+        self.calc_progressbar.setValue(0)
+        start = time.time()
+        try:
+            nrows = emission_calc.calculate_emissions(
+                str(self.db_uri.database()),
+                processes=processes,
+                progress=progress
+            )
+        finally:
+            self.calc_emis_btn.setEnabled(True)
+
+        msg = 'Calculated %i emission rows in %.1f s' % (
+            sum(nrows.values()), time.time() - start
+        )
+        self.calc_status_label.setText(msg)
+        self.emission_totals.load_totals()
+        self.emis_totals_label.setText(self.emission_totals.format_totals())
+        QgsMessageLog.logMessage(
+            msg,
+            'AirviroOfflineEdb',
+            QgsMessageLog.INFO
+        )
+
+    def scan_edb(self):
+        """Scan edb for invalid data and add the issues as layers."""
+        if self.con is None:
+            iface.messageBar().pushMessage(
+                "Warning",
+                "No edb opened",
+                level=QgsMessageBar.WARNING,
+                duration=3
+            )
+            return
+
+        start = time.time()
+        issues = quality_scan.scan_edb(self.con)
+        msg = 'Found %i issues in %.1f s' % (len(issues), time.time() - start)
+        self.scan_status_label.setText(msg)
+        QgsMessageLog.logMessage(msg, 'AirviroOfflineEdb', QgsMessageLog.INFO)
+
+        issues_by_table = {}
+        for issue in issues:
+            issues_by_table.setdefault(issue.table, []).append(issue)
+
+        group = self.edb_group.findGroup('Quality scan')
+        if group is None:
+            group = self.edb_group.insertGroup(0, 'Quality scan')
+        for table, table_issues in issues_by_table.iteritems():
+            layer = self.create_issue_layer(table, table_issues)
+            QgsMapLayerRegistry.instance().addMapLayer(layer, False)
+            group.addLayer(layer)
+
+    def validate_edb(self):
+        """Validate all features and join the result to the layers."""
+        if self.con is None:
+            iface.messageBar().pushMessage(
+                "Warning",
+                "No edb opened",
+                level=QgsMessageBar.WARNING,
+                duration=3
+            )
+            return
+
+        processes = self.processes()
+
+        def progress(done, total):
+            self.scan_status_label.setText(
+                'Validating %i of %i parts' % (done, total)
+            )
+            QApplication.processEvents()
+
+        self.validate_edb_btn.setEnabled(False)
+        start = time.time()
+        try:
+            nissues = validation_runner.run_validation(
+                str(self.db_uri.database()),
+                processes=processes,
+                progress=progress
+            )
+        finally:
+            self.validate_edb_btn.setEnabled(True)
+
+        msg = 'Found %i invalid values in %.1f s' % (
+            sum(nissues.values()), time.time() - start
+        )
+        self.scan_status_label.setText(msg)
+        QgsMessageLog.logMessage(msg, 'AirviroOfflineEdb', QgsMessageLog.INFO)
+
+        group = self.edb_group.findGroup('Quality scan')
+        if group is None:
+            group = self.edb_group.insertGroup(0, 'Quality scan')
+        for table in nissues:
+            if table in self.layers:
+                self.join_validation_layer(table, group)
+
+    def join_validation_layer(self, table, group):
+        """Load the validation summary of a table and join it to its layer.
+
+        The summary table is recreated by each validation, a previously
+        loaded summary layer is replaced.
+        """
+        registry = QgsMapLayerRegistry.instance()
+        target_layer = registry.mapLayer(self.layers[table])
+        summary = validation_runner.summary_table(table)
+        if summary in self.layers:
+            target_layer.removeJoin(self.layers[summary])
+            registry.removeMapLayer(self.layers[summary])
+
+        self.db_uri.setDataSource('', summary, '')
+        layer = QgsVectorLayer(self.db_uri.uri(), summary, 'spatialite')
+        if not layer.isValid():
+            raise ValueError(summary)
+        registry.addMapLayer(layer, False)
+        group.addLayer(layer)
+        self.layers[summary] = layer.id()
+
+        join = QgsVectorJoinInfo()
+        join.joinLayerId = layer.id()
+        join.joinFieldName = 'id'
+        join.targetFieldName = 'id'
+        join.memoryCache = True
+        target_layer.addJoin(join)
+
+    def create_issue_layer(self, table, issues):
+        """Create memory layer with issues and geometries of sources."""
+        source_layer = None
+        if table in self.layers:
+            source_layer = QgsMapLayerRegistry.instance().mapLayer(
+                self.layers[table]
+            )
+
+        geometry_type = 'None'
+        if source_layer is not None and source_layer.hasGeometryType():
+            geometry_type = {
+                QGis.Point: 'Point',
+                QGis.Line: 'LineString',
+                QGis.Polygon: 'Polygon'
+            }[source_layer.geometryType()]
+
+        layer = QgsVectorLayer(
+            '%s?crs=epsg:%i' % (geometry_type, self.epsg),
+            '%s issues' % table,
+            'memory'
+        )
+        provider = layer.dataProvider()
+        provider.addAttributes([
+            QgsField('source', QVariant.Int),
+            QgsField('column', QVariant.String),
+            QgsField('issue', QVariant.String),
+            QgsField('value', QVariant.String)
+        ])
+        layer.updateFields()
+
+        geometries = {}
+        if geometry_type != 'None':
+            request = QgsFeatureRequest().setFilterFids(
+                list(set(issue.source for issue in issues))
+            )
+            for source_feature in source_layer.getFeatures(request):
+                geometries[source_feature.id()] = QgsGeometry(
+                    source_feature.geometry()
+                )
+
+        features = []
+        for issue in issues:
+            feature = QgsFeature(layer.pendingFields())
+            feature.setAttributes([
+                issue.source, issue.column, issue.issue, unicode(issue.value)
+            ])
+            if issue.source in geometries:
+                feature.setGeometry(QgsGeometry(geometries[issue.source]))
+            features.append(feature)
+        provider.addFeatures(features)
+        layer.updateExtents()
+        return layer
+
+    def toggle_form_profiling(self, enabled):
+        """Enable or disable profiling of form opening."""
+        form_profiler.enable_profiling(enabled)
+        self.cprofile_checkbox.setEnabled(enabled)
+        if enabled:
+            self.toggle_cprofile(self.cprofile_checkbox.isChecked())
+        self.show_form_profile()
+
+    def toggle_cprofile(self, enabled):
+        """Arm or cancel cProfile of the next slow form open."""
+        profiler = form_profiler.get_profiler()
+        if profiler is None:
+            return
+        if enabled:
+            profiler.profile_next_slow_open(
+                self.cprofile_min_spinbox.value() / 1000,
+                os.path.join(os.path.dirname(cache_dir()), 'profiles')
+            )
+        else:
+            profiler.cancel_cprofile()
+
+    def show_form_profile(self):
+        """Show latency histograms of form opening."""
+        profiler = form_profiler.get_profiler()
+        if profiler is None:
+            self.profile_histogram_label.setText('Profiling disabled')
+            return
+        # the armed cProfile is cancelled after a slow open has been dumped
+        self.cprofile_checkbox.blockSignals(True)
+        self.cprofile_checkbox.setChecked(profiler.cprofile_armed)
+        self.cprofile_checkbox.blockSignals(False)
+        self.profile_histogram_label.setText(
+            profiler.format_histogram() or 'No forms opened'
+        )
+
+    def clear_form_profile(self):
+        profiler = form_profiler.get_profiler()
+        if profiler is not None:
+            profiler.clear()
+        self.show_form_profile()
+
     def closeEvent(self, event):
+        self.write_back()
         self.closingPlugin.emit()
         event.accept()
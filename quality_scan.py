@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Batch quality scan of emission and activity data in an edb.
+
+Source tables are checked against the validation rules of the edit
+forms (see validation_rules), and numeric columns are loaded into arrays
+and checked in one pass for statistical outliers. Roads are checked for
+traffic vehicle fractions not summing to 100% and sources for missing or
+undefined time variations.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+
+from AirviroOfflineEdb.emission_calc import SOURCE_TYPES
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+from AirviroOfflineEdb.validation_rules import (
+    RULES,
+    TRAFFIC_SUM_TOLERANCE,
+    check_table,
+    traffic_sum_message
+)
+
+NUMERIC_TYPES = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUMERIC')
+
+# modified z-score above which a value is considered an outlier
+# (Iglewicz and Hoaglin)
+OUTLIER_THRESHOLD = 3.5
+
+Issue = namedtuple('Issue', 'table source column issue value')
+
+
+def numeric_columns(con, table):
+    """Return numeric columns of table, excluding id and foreign keys."""
+    foreign = set(
+        row[3] for row in con.execute('PRAGMA foreign_key_list(%s)' % table)
+    )
+    columns = []
+    for row in con.execute('PRAGMA table_info(%s)' % table):
+        name, decl_type = row[1], (row[2] or '').upper()
+        if name == 'id' or name in foreign:
+            continue
+        if any(t in decl_type for t in NUMERIC_TYPES):
+            columns.append(name)
+    return columns
+
+
+def to_float(value):
+    """Return value as float, nan for NULL and non-numeric values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def load_columns(con, table, columns):
+    """Load id's and columns of a table into arrays.
+
+    NULL and non-numeric values, e.g. text in a numeric column, are
+    loaded as nan. Returns (ids, data, non_numeric), where non_numeric
+    is a mask of the values that were not NULL but not numeric either.
+    """
+    rows = con.execute(
+        'SELECT id, %s FROM %s ORDER BY id' % (
+            ', '.join('"%s"' % col for col in columns), table
+        )
+    ).fetchall()
+    ids = np.array([row[0] for row in rows], dtype=int)
+    data = np.array(
+        [[to_float(value) for value in row[1:]] for row in rows],
+        dtype=float
+    ).reshape(-1, len(columns))
+    non_numeric = np.array(
+        [[value is not None for value in row[1:]] for row in rows],
+        dtype=bool
+    ).reshape(-1, len(columns)) & np.isnan(data)
+    return ids, data, non_numeric
+
+
+def outlier_mask(values):
+    """Return mask of outliers using the modified z-score."""
+    finite = np.isfinite(values)
+    mask = np.zeros(values.shape, dtype=bool)
+    if finite.sum() < 3:
+        return mask
+    median = np.median(values[finite])
+    mad = np.median(np.abs(values[finite] - median))
+    if mad == 0:
+        return mask
+    z = 0.6745 * (values[finite] - median) / mad
+    mask[finite] = np.abs(z) > OUTLIER_THRESHOLD
+    return mask
+
+
+def scan_table(con, table, rules=None):
+    """Scan a table for rule violations and numeric outliers."""
+    issues = [
+        Issue(table, source, column, message, value)
+        for source, column, message, value in check_table(con, table, rules)
+    ]
+    columns = numeric_columns(con, table)
+    if len(columns) == 0:
+        return issues
+    ids, data, non_numeric = load_columns(con, table, columns)
+
+    # values violating a rule are already reported
+    reported = set((issue.source, issue.column) for issue in issues)
+    for col_index, column in enumerate(columns):
+        values = data[:, col_index]
+        for i in np.flatnonzero(non_numeric[:, col_index]):
+            if (int(ids[i]), column) not in reported:
+                issues.append(Issue(
+                    table, int(ids[i]), column, 'non-numeric value',
+                    None
+                ))
+        for i in np.flatnonzero(outlier_mask(values)):
+            if (int(ids[i]), column) not in reported:
+                issues.append(Issue(
+                    table, int(ids[i]), column, 'statistical outlier',
+                    float(values[i])
+                ))
+    return issues
+
+
+def scan_traffic_fractions(con):
+    """Find roads where traffic vehicle fractions do not sum to 100%.
+
+    Roads without vehicle rows have the sum 0 and are reported.
+    """
+    if not relation_in_db(con, 'roads') or \
+       not relation_in_db(con, 'road_vehicle_link'):
+        return []
+    rows = con.execute(
+        """
+        SELECT r.id, rvl.fraction, rv.istraffic
+        FROM roads r
+        LEFT JOIN road_vehicle_link rvl
+        ON rvl.road = r.id
+        LEFT JOIN road_vehicles rv
+        ON rvl.vehicle = rv.id
+        """
+    ).fetchall()
+    if len(rows) == 0:
+        return []
+    data = np.array(
+        [[to_float(value) for value in row] for row in rows], dtype=float
+    )
+    data[np.isnan(data)] = 0
+    roads = data[:, 0].astype(int)
+    road_ids, road_index = np.unique(roads, return_inverse=True)
+    traffic = np.bincount(
+        road_index, weights=data[:, 1] * (data[:, 2] != 0)
+    )
+    invalid = np.abs(traffic - 100.0) > TRAFFIC_SUM_TOLERANCE
+    return [
+        Issue(
+            'roads', int(road_ids[i]), 'vehicles',
+            traffic_sum_message(float(traffic[i])), float(traffic[i])
+        )
+        for i in np.flatnonzero(invalid)
+    ]
+
+
+def scan_timevars(con):
+    """Find sources with missing or undefined time variations.
+
+    All columns referring to a time variation table are checked, in
+    source tables as well as in tables linked to sources.
+    """
+    issues = []
+    tables = [
+        row[0] for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        )
+    ]
+    for table in tables:
+        foreign_keys = con.execute(
+            'PRAGMA foreign_key_list(%s)' % table
+        ).fetchall()
+        timevar_keys = [
+            (row[3], row[2], row[4]) for row in foreign_keys
+            if 'timevar' in row[2]
+        ]
+        if len(timevar_keys) == 0:
+            continue
+
+        # column used to report the source
+        if table in SOURCE_TYPES:
+            source_table, source_col = table, 'id'
+        else:
+            source_keys = [
+                (row[2], row[3]) for row in foreign_keys
+                if row[2] in SOURCE_TYPES
+            ]
+            if len(source_keys) == 0:
+                continue
+            source_table, source_col = source_keys[0]
+
+        for column, ref_table, ref_column in timevar_keys:
+            rows = con.execute(
+                """
+                SELECT t.{source_col}, t.{column}
+                FROM {table} t
+                LEFT JOIN {ref_table} tv
+                ON t.{column} = tv.{ref_column}
+                WHERE tv.{ref_column} IS NULL
+                """.format(
+                    source_col=source_col,
+                    column=column,
+                    table=table,
+                    ref_table=ref_table,
+                    ref_column=ref_column or 'id'
+                )
+            ).fetchall()
+            for source, value in rows:
+                if value is None:
+                    issue = 'time variation missing'
+                else:
+                    issue = 'time variation %s not defined' % value
+                issues.append(Issue(
+                    source_table, source, '%s.%s' % (table, column),
+                    issue, value
+                ))
+    return issues
+
+
+def scan_edb(con, rules=None):
+    """Scan all source tables of an edb, returns a list of Issues."""
+    rules = rules or RULES
+    issues = []
+    for table in SOURCE_TYPES:
+        if relation_in_db(con, table):
+            issues += scan_table(con, table, rules.get(table, []))
+    issues += scan_traffic_fractions(con)
+    issues += scan_timevars(con)
+    return issues
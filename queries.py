@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Named, parameterized statements used by the feature forms.
+
+Statements are constant strings with named parameters, so sqlite3 reuses
+the prepared statement from its statement cache instead of compiling a
+new statement for every road. The indexes the statements depend on are
+declared in REQUIRED_INDEXES and verified, or created, once per edb when
+a form connects. If the indexes can not be created, e.g. because the edb
+is locked by another user, this is not tried again in the session.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import os
+import re
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+
+QUERIES = {
+    'road_vehicles_on_road': """
+        SELECT
+          rv.name as name,
+          rvl.vehicle as vehicle,
+          rvl.timevar as timevar,
+          rv.isheavy as isheavy,
+          rv.istraffic as istraffic,
+          rvl.fraction as fraction
+        FROM road_vehicle_link rvl
+        JOIN road_vehicles rv
+        ON rvl.vehicle = rv.id
+        WHERE rvl.road = :road
+        """,
+    'insert_road_vehicle': """
+        INSERT INTO road_vehicle_link (road, vehicle, timevar, fraction)
+        VALUES (:road, :vehicle, :timevar, :fraction)
+        """,
+    'update_road_vehicle': """
+        UPDATE road_vehicle_link SET timevar = :timevar, fraction = :fraction
+        WHERE road = :road AND vehicle = :vehicle
+        """,
+    'delete_road_vehicle': """
+        DELETE FROM road_vehicle_link WHERE road = :road AND vehicle = :vehicle
+        """,
+}
+
+
+def situation_columns(con):
+    """Return the situation<N> columns of table traffic_situations."""
+    columns = [
+        row[1] for row in con.execute('PRAGMA table_info(traffic_situations)')
+        if re.match(r'situation\d+$', row[1])
+    ]
+    return sorted(columns, key=lambda col: int(col[len('situation'):]))
+
+
+# indexes needed by the statements, (name, table, columns), where columns
+# can also be a function returning the columns given a connection
+REQUIRED_INDEXES = [
+    ('road_vehicle_link_road_idx', 'road_vehicle_link', ['road', 'vehicle']),
+    ('road_vehicle_link_vehicle_idx', 'road_vehicle_link', ['vehicle']),
+    ('traffic_situations_situation_idx', 'traffic_situations',
+     situation_columns),
+]
+
+# milliseconds to wait for a locked edb when creating indexes
+INDEX_BUSY_TIMEOUT = 200
+
+# edb's for which the indexes have been verified
+_verified = set()
+
+# edb's in which the indexes could not be created
+_failed = set()
+
+
+def execute(con, name, **params):
+    """Execute a named statement."""
+    return con.execute(QUERIES[name], params)
+
+
+def index_columns(con, table):
+    """Return the column lists of all indexes on a table."""
+    indexes = []
+    for row in con.execute('PRAGMA index_list(%s)' % table).fetchall():
+        indexes.append([
+            info[2] for info in
+            con.execute('PRAGMA index_info("%s")' % row[1]).fetchall()
+        ])
+    return indexes
+
+
+def has_index(con, table, columns):
+    """Return True if an index starting with the given columns exists."""
+    for indexed in index_columns(con, table):
+        if indexed[:len(columns)] == list(columns):
+            return True
+    return False
+
+
+def missing_indexes(con):
+    """Return (name, table, columns) of required indexes not in the edb."""
+    missing = []
+    for name, table, columns in REQUIRED_INDEXES:
+        if not relation_in_db(con, table):
+            continue
+        if callable(columns):
+            columns = columns(con)
+        if columns and not has_index(con, table, columns):
+            missing.append((name, table, columns))
+    return missing
+
+
+def create_indexes(con, indexes, busy_timeout=None):
+    """Create indexes given as (name, table, columns).
+
+    If busy_timeout is given, waits at most busy_timeout milliseconds for
+    a locked edb instead of the timeout of the connection.
+    """
+    if busy_timeout is not None:
+        timeout = con.execute('PRAGMA busy_timeout').fetchone()[0]
+        con.execute('PRAGMA busy_timeout = %i' % busy_timeout)
+    try:
+        with con:
+            for name, table, columns in indexes:
+                con.execute(
+                    'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                        name, table, ', '.join(columns)
+                    )
+                )
+    finally:
+        if busy_timeout is not None:
+            con.execute('PRAGMA busy_timeout = %i' % timeout)
+
+
+def verify_indexes(con, filename, create=True):
+    """Verify (and create) required indexes once per edb.
+
+    Returns the indexes that are still missing, raises
+    sqlite3.OperationalError if they could not be created. Creation is
+    only tried once per edb and session, later calls return the missing
+    indexes without waiting for the edb to be unlocked again.
+    """
+    filename = os.path.abspath(filename)
+    if filename in _verified:
+        return []
+    missing = missing_indexes(con)
+    if missing and create and filename not in _failed:
+        try:
+            create_indexes(con, missing, INDEX_BUSY_TIMEOUT)
+        except sqlite3.OperationalError:
+            _failed.add(filename)
+            raise
+        missing = []
+    if not missing:
+        _verified.add(filename)
+    return missing
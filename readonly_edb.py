@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Read-only connections for viewing edb's.
+
+An edb opened for viewing only is registered with set_readonly. All
+connections the plugin opens to it through connect_edb are then
+read-only:
+
+- when sqlite interprets uri filenames, the edb is opened with a uri
+  with mode=ro and cache=shared, and with immutable=1 unless
+  disabled. An immutable database is read without any file locks or
+  change detection, so several QGIS instances can read the same edb on a
+  network share without lock contention. The edb must then not be
+  modified while it is viewed.
+- PRAGMA query_only is set, so no statement can modify the edb even if
+  uri filenames are not supported. The edb is then read with the usual
+  shared locks, see readonly_access.
+- the edb is memory mapped (PRAGMA mmap_size) and read with a larger page
+  cache.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import os
+import urllib
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+# bytes of the edb to memory map in read-only connections
+MMAP_SIZE = 256 * 1024 * 1024
+
+# size of the page cache of read-only connections (negative means kiB)
+CACHE_SIZE = -64000
+
+# edb's opened read-only, abspath: immutable
+_readonly = {}
+
+# True if sqlite interprets uri filenames, see uri_filenames
+_uri_filenames = None
+
+
+def set_readonly(filename, readonly=True, immutable=True):
+    """Register an edb as opened for viewing only, or for editing."""
+    filename = os.path.abspath(filename)
+    if readonly:
+        _readonly[filename] = immutable
+    else:
+        _readonly.pop(filename, None)
+
+
+def is_readonly(filename):
+    return os.path.abspath(filename) in _readonly
+
+
+def uri_filenames():
+    """Return True if sqlite interprets uri filenames.
+
+    The sqlite3 module does not pass SQLITE_OPEN_URI when opening a
+    database, uri filenames are therefore only supported by libraries
+    compiled with SQLITE_USE_URI.
+    """
+    global _uri_filenames
+    if _uri_filenames is None:
+        con = sqlite3.connect(':memory:')
+        _uri_filenames = any(
+            row[0].startswith('USE_URI')
+            for row in con.execute('PRAGMA compile_options')
+        )
+        con.close()
+    return _uri_filenames
+
+
+def readonly_uri(filename, immutable=True):
+    """Return uri to open an edb read-only in the shared cache."""
+    uri = 'file:%s?mode=ro&cache=shared' % urllib.pathname2url(
+        os.path.abspath(filename)
+    )
+    if immutable:
+        uri += '&immutable=1'
+    return uri
+
+
+def readonly_access(filename):
+    """Return description of how an edb registered read-only is read."""
+    immutable = _readonly.get(os.path.abspath(filename), True)
+    if not uri_filenames():
+        return (
+            'PRAGMA query_only, sqlite is not compiled with SQLITE_USE_URI '
+            'so the edb is read with shared locks'
+        )
+    if immutable:
+        return 'immutable uri, the edb is read without locks'
+    return 'uri with mode=ro, the edb is read with shared locks'
+
+
+def connect_readonly(filename, immutable=True):
+    """Open a connection that can not modify the edb."""
+    if not os.path.isfile(filename):
+        # sqlite would otherwise create an empty database
+        raise ValueError('Edb %s does not exist' % filename)
+    if uri_filenames():
+        con = sqlite3.connect(readonly_uri(filename, immutable))
+    else:
+        con = sqlite3.connect(filename)
+    con.execute('PRAGMA query_only = ON')
+    con.execute('PRAGMA mmap_size = %i' % MMAP_SIZE)
+    con.execute('PRAGMA cache_size = %i' % CACHE_SIZE)
+    return con
+
+
+def edb_key(filename):
+    """Return key of objects shared per edb, e.g. lookup caches.
+
+    The key differs between viewing and editing, so objects holding a
+    read-only connection are not used when the edb is opened for editing.
+    """
+    filename = os.path.abspath(filename)
+    return filename, filename in _readonly
+
+
+def connect_edb(filename):
+    """Connect to an edb, read-only if registered with set_readonly."""
+    filename = os.path.abspath(filename)
+    if filename in _readonly:
+        return connect_readonly(filename, _readonly[filename])
+    return sqlite3.connect(filename)
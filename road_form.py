@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from qgis.core import QgsMessageLog
+from qgis.core import QgsFeatureRequest, QgsMessageLog
 from PyQt4 import QtCore, QtGui
+import time
 from functools import partial
 from os import path
 
@@ -9,47 +10,72 @@ from AirviroOfflineEdb.form_utils import (
     BaseFeatureForm,
     set_widget_style,
     init_default,
-    validate_in_range,
-    validate_is_not_empty,
-    validate_of_type,
-    validate_max_len,
-    ValidationError,
-    reconnect
+    open_form,
+    rule_validators,
+    ValidationError
 )
 
-from pyAirviro.edb.sqliteapi import (
-    insert_sql,
-    NO_TRAFFIC_SITUATION_COLS
-)
+from pyAirviro.edb.sqliteapi import NO_TRAFFIC_SITUATION_COLS
 
-from pyAirviro.edb.rsrc import Rsrc
+from AirviroOfflineEdb.bulk_edit import apply_composition
+from AirviroOfflineEdb.emission_totals import get_emission_totals
+from AirviroOfflineEdb.lookup_cache import (
+    get_lookup_cache,
+    register_query_lookup
+)
+from AirviroOfflineEdb.queries import execute
+from AirviroOfflineEdb.road_vehicles import (
+    save_road_vehicles,
+    vehicle_rows
+)
+from AirviroOfflineEdb.rsrc_cache import load_rsrc
+from AirviroOfflineEdb.validation_rules import (
+    TRAFFIC_SUM_TOLERANCE,
+    duplicate_vehicle_message,
+    traffic_sum_message,
+    unknown_vehicle_message
+)
+from AirviroOfflineEdb.working_copy import source_filename
+from AirviroOfflineEdb.vehicle_table import (
+    VehicleDelegate,
+    VehicleTableModel,
+    VEHICLE_COL,
+    TIMEVAR_COL,
+    FRACTION_COL,
+    ISHEAVY_COL,
+    ISTRAFFIC_COL
+)
+# registers the traffic_situations lookup
+import AirviroOfflineEdb.traffic_situations  # noqa
 
 INVALID_STYLE = "background-color: rgba(255, 107, 107, 150);"
 VALID_STYLE = ''
-INACTIVE_COLOR = QtGui.QColor(100, 100, 100)
 INVALID_TAB_COLOR = QtGui.QColor(255, 0, 0)
 
-TIMEVAR_COL = 1
-VEHICLE_COL = 0
-FRACTION_COL = 2
-ISHEAVY_COL = 3
-ISTRAFFIC_COL = 4
 MAX_NO_CODES = 6
 MAX_CODE_LEVELS = 8
 
+register_query_lookup(
+    'road_timevars', ['road_timevars'], 'SELECT id, name FROM road_timevars'
+)
+register_query_lookup(
+    'road_vehicles',
+    ['road_vehicles'],
+    'SELECT id, name, isheavy, istraffic FROM road_vehicles'
+)
+register_query_lookup(
+    'traffic_situation_columns',
+    ['traffic_situation_columns'],
+    'SELECT * FROM traffic_situation_columns ORDER BY id'
+)
 
-def is_list(val_type, nvalues, widget):
-    value_string = widget.text()
-    try:
-        values = map(val_type, value_string.split(' '))
-    except:
-        raise ValidationError('value is not a list of integers')
-
-    if nvalues is not None:
-        if len(values) != nvalues:
-            raise ValidationError('should be %i values in list' % nvalues)
 
-    return values
+def fill_code_combo(combo, items):
+    """Replace items of a code combo with '.' (no code) and (code, label)."""
+    combo.clear()
+    combo.addItem('.', 'None')
+    for code, label in items:
+        combo.addItem(label, code)
 
 
 class RoadEditForm(BaseFeatureForm):
@@ -69,30 +95,17 @@ class RoadEditForm(BaseFeatureForm):
         for combo_ind in range(1, len(self.traffic_situation_cols) + 1):
             combo = self.widgets['ts_combo_%i' % combo_ind].widget
             ts_indices.append(combo.itemData(combo.currentIndex()))
-            
-        # build SQL where-clause for filtering on traffic sit. column id's
-        filters = "WHERE situation1=%i" % ts_indices[0]
-        for col_ind, ts_ind in enumerate(ts_indices[1:], 2):
-            filters += ' AND situation%i=%i' % (col_ind, ts_ind)
-
-        ts_id = self.con.execute(
-            """
-            SELECT * FROM traffic_situations
-            %s
-            """ % filters
-        ).next()['id']
 
-        self.widgets['traffic_situation'].widget.setText(str(ts_id))
+        ts_id = self.traffic_situations.situation_id(ts_indices)
+        if ts_id is not None:
+            self.widgets['traffic_situation'].widget.setText(str(ts_id))
 
     def find_widgets(self):
 
         self.add_widget(
             'corrfactor',
             QtGui.QLineEdit,
-            validators=[
-                validate_is_not_empty,
-                partial(validate_in_range, 0, 5.0)
-            ],
+            validators=rule_validators('roads', 'corrfactor'),
             init=partial(init_default, '1.0'),
             on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
             on_valid=[set_widget_style]
@@ -101,10 +114,7 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'name',
             QtGui.QLineEdit,
-            validators=[
-                validate_is_not_empty,
-                partial(validate_max_len, 47)
-            ],
+            validators=rule_validators('roads', 'name'),
             on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
             on_valid=[set_widget_style]
         )
@@ -112,11 +122,7 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'vehicles',
             QtGui.QLineEdit,
-            validators=[
-                validate_is_not_empty,
-                partial(validate_in_range, 0, 200000),
-                partial(validate_of_type, int)
-            ],
+            validators=rule_validators('roads', 'vehicles'),
             init=partial(init_default, '0'),
             on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
             on_valid=[set_widget_style]
@@ -160,10 +166,7 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'nolanes',
             QtGui.QLineEdit,
-            validators=[
-                partial(validate_in_range, 1, 8),
-                partial(validate_of_type, int)
-            ],
+            validators=rule_validators('roads', 'nolanes'),
             init=partial(init_default, '2'),
             on_invalid=[
                 partial(set_widget_style, style=INVALID_STYLE)
@@ -175,10 +178,7 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'width',
             QtGui.QLineEdit,
-            validators=[
-                partial(validate_in_range, 3, 60),
-                partial(validate_of_type, float)
-            ],
+            validators=rule_validators('roads', 'width'),
             on_invalid=[
                 partial(set_widget_style, style=INVALID_STYLE)
             ],
@@ -188,10 +188,7 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'disthouses',
             QtGui.QLineEdit,
-            validators=[
-                partial(validate_in_range, 3, 1000),
-                partial(validate_of_type, float)
-            ],
+            validators=rule_validators('roads', 'disthouses'),
             on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
             on_valid=[set_widget_style]
         )
@@ -199,16 +196,14 @@ class RoadEditForm(BaseFeatureForm):
         self.add_widget(
             'height',
             QtGui.QLineEdit,
-            validators=[
-                partial(is_list, int, None)
-            ],
+            validators=rule_validators('roads', 'height'),
             on_invalid=[partial(set_widget_style, style=INVALID_STYLE)],
             on_valid=[set_widget_style]
         )
 
         self.add_widget(
             'vehicle_table',
-            QtGui.QTableWidget,
+            QtGui.QTableView,
             validators=[
                 self.validate_vehicle_table
             ],
@@ -317,10 +312,33 @@ class RoadEditForm(BaseFeatureForm):
             enable_on_edit=True
         )
 
+        self.add_widget(
+            'emission_delta_label',
+            QtGui.QLabel,
+            init=partial(init_default, '')
+        )
+
+        self.add_widget('bulk_expression_edit', QtGui.QLineEdit)
+
+        self.add_widget(
+            'apply_vehicles_btn',
+            QtGui.QPushButton,
+            on_action=self.apply_vehicles_btn_clicked,
+            enable_on_edit=True
+        )
+
+        self.add_widget(
+            'bulk_status_label',
+            QtGui.QLabel,
+            init=partial(init_default, '')
+        )
+
     def show_validation_msg(self, widget, *args, **kwargs):
         msg = kwargs.get('message', '')
         label = self.widgets['validation_msg_label'].widget
-        label.setText(msg)
+        # only re-render when the outcome of the validation changes
+        if label.text() != msg:
+            label.setText(msg)
 
     def init_widgets(self):
         super(RoadEditForm, self).init_widgets()
@@ -332,55 +350,79 @@ class RoadEditForm(BaseFeatureForm):
             'AirviroOfflineEdb',
             QgsMessageLog.INFO
         )
-        table = self.widgets['vehicle_table'].widget
-        table.blockSignals(True)
-        table.clearContents()
-        while table.rowCount() > 0:
-            table.removeRow(0)
-        table.blockSignals(False)
-
         self.read_on_road_vehicles()
-        self.init_table(table)
+        self.vehicle_model.set_rows(self.on_road_vehicles)
 
     @QtCore.pyqtSlot()
     def save_vehicles_btn_clicked(self, *args, **kwargs):
-        table = self.widgets['vehicle_table'].widget
+        try:
+            # e.g. with duplicate rows only one row per vehicle would be
+            # saved, the validation message is shown in the form
+            self.widgets['vehicle_table'].validate(silent=False)
+        except ValidationError:
+            return
 
-        with self.con:
-            self.con.execute(
-                """
-                DELETE FROM road_vehicle_link
-                WHERE road=%i
-                """ % self.feature.id()
-            )
-        
-        sql_rows = []
-        for row in range(table.rowCount()):
-            tvar_combo = table.cellWidget(row, TIMEVAR_COL)
-            sql_rows.append(
-                (
-                    """
-                    INSERT INTO road_vehicle_link
-                    (road, vehicle, timevar, fraction)
-                    VALUES (:road,:veh,:tvar,:frac)
-                    """,
-                    {
-                        'road': self.feature.id(),
-                        'veh': table.item(
-                            row, VEHICLE_COL).data(QtCore.Qt.UserRole),
-                        'tvar': tvar_combo.itemData(tvar_combo.currentIndex()),
-                        'frac': float(table.item(row, FRACTION_COL).text())
-                    }
-                )
+        emission_totals = get_emission_totals(self.get_db_file())
+        emission_totals.snapshot('roads', [self.feature.id()])
+
+        try:
+            save_road_vehicles(
+                self.con,
+                self.feature.id(),
+                vehicle_rows(self.on_road_vehicles),
+                self.vehicle_model.vehicle_rows()
             )
-        insert_sql(
-            self.cur,
-            sql_rows,
-            'inserting vehicles on road %s' % self.feature.id()
+        except ValueError, err:
+            self.show_validation_msg(None, message=unicode(err))
+            return
+        self.read_on_road_vehicles()
+
+        delta = emission_totals.update('roads', [self.feature.id()])
+        self.widgets['emission_delta_label'].widget.setText(
+            emission_totals.format_delta(delta)
         )
-        self.con.commit()
 
-        
+    def selected_road_ids(self):
+        """Return id's of roads matching filter expression or selection."""
+        expression = self.widgets['bulk_expression_edit'].widget.text()
+        if len(expression.strip()) == 0:
+            return list(self.layer.selectedFeaturesIds())
+        request = QgsFeatureRequest().setFilterExpression(expression)
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([])
+        return [feature.id() for feature in self.layer.getFeatures(request)]
+
+    @QtCore.pyqtSlot()
+    def apply_vehicles_btn_clicked(self, *args, **kwargs):
+        """Apply vehicle composition in table to selected roads."""
+        status_label = self.widgets['bulk_status_label'].widget
+        road_ids = self.selected_road_ids()
+        if len(road_ids) == 0:
+            status_label.setText('No roads selected')
+            return
+
+        start = time.time()
+        emission_totals = get_emission_totals(self.get_db_file())
+        emission_totals.snapshot('roads', road_ids)
+        try:
+            nroads, seconds = apply_composition(
+                self.con, road_ids, self.vehicle_model.vehicle_rows()
+            )
+        except ValueError, err:
+            status_label.setText(unicode(err))
+            return
+        self.read_on_road_vehicles()
+
+        delta = emission_totals.update('roads', road_ids)
+        self.widgets['emission_delta_label'].widget.setText(
+            emission_totals.format_delta(delta)
+        )
+        status_label.setText(
+            'Applied to %i roads in %.2f s (emissions updated in %.2f s)' % (
+                nroads, time.time() - start,
+                emission_totals.last_update_time
+            )
+        )
 
     # def set_tab_text_color(self, widget, *args, **kwargs):
     #     color = kwargs.get('color', QtGui.QColor(255, 255, 255))
@@ -388,108 +430,50 @@ class RoadEditForm(BaseFeatureForm):
     #     tab_widget = self.widgets['tabs'].widget
     #     tab_widget.setTabTextColor(tab_index, color)
 
-    @QtCore.pyqtSlot(QtGui.QTableWidgetItem)
-    def validate_cell_item(self):
-        self.widgets['vehicle_table'].validate()
+    def validate_cell_item(self, *args):
+        self.scheduler.request('vehicle_table')
 
     @QtCore.pyqtSlot()
     def add_vehicle_btn_clicked(self, *args, **kwargs):
         combo = self.widgets['new_vehicle_combo'].widget
-        vehicle_name = combo.itemText(combo.currentIndex())
-        vehicle_id = combo.itemData(combo.currentIndex())
-        self.add_vehicle_to_table(vehicle_id, vehicle_name)
+        self.vehicle_model.add_row(combo.itemData(combo.currentIndex()))
 
     @QtCore.pyqtSlot()
     def delete_vehicle_btn_clicked(self, *args, **kwargs):
         table = self.widgets['vehicle_table'].widget
-        rows = table.selectionModel().selectedRows()
-        for r in rows:
-            table.removeRow(r.row())
-
-    def validate_vehicle_table(self, *args, **kwargs):
-        QgsMessageLog.logMessage(
-            'validate vehicle table',
-            'AirviroOfflineEdb',
-            QgsMessageLog.INFO
+        self.vehicle_model.remove_rows(
+            [index.row() for index in table.selectionModel().selectedRows()]
         )
 
-        table = self.widgets['vehicle_table'].widget
-
-        if table.rowCount() == 0:
+    def validate_vehicle_table(self, *args, **kwargs):
+        sums = self.vehicle_model.sums
+        if sums.nrows == 0:
             return True
 
-        frac = 0
-        istraffic = 1
-        isheavy = 1
-        vehicles = set()
-        tot_traf = 0
-        tot_vehicles = 0
-        heavy_traf_proc = 0
-        light_traf_proc = 0
-        heavy_nontraf_proc = 0
-        light_nontraf_proc = 0
-        for row in range(table.rowCount()):
-            item = table.item(row, VEHICLE_COL)
-
-            # If validation is run before table is filled, items does not exist
-            if item is not None:
-                veh_id = item.data(QtCore.Qt.UserRole)
-                veh_name = item.text()
-                if veh_id in vehicles:
-                    raise ValidationError(
-                        'has duplicate rows for vehicle %s in table' % veh_name
-                    )
-                else:
-                    vehicles.add(veh_id)
-
-            item = table.item(row, FRACTION_COL)
-            if item is not None:
-                frac = float(item.text())
-            
-            item = table.item(row, ISTRAFFIC_COL)
-            if item is not None:
-                istraffic = item.data(QtCore.Qt.UserRole)
-
-            item = table.item(row, ISHEAVY_COL)
-            if item is not None:
-                isheavy = item.data(QtCore.Qt.UserRole)
-
-            tot_vehicles += frac
+        duplicates = sums.duplicates()
+        if len(duplicates) > 0:
+            raise ValidationError(duplicate_vehicle_message(
+                self.vehicle_model.vehicle_meta(duplicates[0])[0]
+            ))
 
-            if istraffic:
-                tot_traf += frac
+        unknown = self.vehicle_model.unknown_vehicles()
+        if len(unknown) > 0:
+            raise ValidationError(unknown_vehicle_message(unknown[0]))
 
-            if isheavy and istraffic:
-                heavy_traf_proc += frac
-            elif istraffic:
-                light_traf_proc += frac
-            elif isheavy:
-                heavy_nontraf_proc += frac
-            else:
-                light_nontraf_proc += frac
-    
-        diff = tot_traf - 100.0
-        if abs(diff) > 0.01:
-            raise ValidationError(
-                'has sum of all traffic vehicle ' +
-                '{f} != 100 [%]'.format(f=tot_traf)
-            )
+        tot_traf = sums.traffic
+        if abs(tot_traf - 100.0) > TRAFFIC_SUM_TOLERANCE:
+            raise ValidationError(traffic_sum_message(tot_traf))
 
     def init_ts_combo(self, widget):
         ndims = len(self.traffic_situation_cols)
-        ts_indices = self.widgets['traffic_situation'].widget.ts_indices
 
         for i in range(ndims + 1, NO_TRAFFIC_SITUATION_COLS + 1):
             self.widgets['ts_combo_%i' % i].widget.hide()
             self.widgets['ts_combo_%i_label' % i].widget.hide()
         
         # disconnect not used combos
-        try:
-            self.widgets[
-                'ts_combo_%i' % ndims
-            ].widget.currentIndexChanged.disconnect()
-        except TypeError:
-            pass
+        if ndims > 0:
+            self.widgets['ts_combo_%i' % ndims].disconnect_actions()
 
         # Set combo labels
         for i, label in enumerate(self.traffic_situation_cols, 1):
@@ -503,45 +487,36 @@ class RoadEditForm(BaseFeatureForm):
                 'Dimensions of traffic situations not defined'
             )
         
-        # query to find all labels of dimension 1 of traffic situations
-        # for which there are emission factors defined
-
-        query = """
-        SELECT tsc.id as id, tsc.label as label
-        FROM
-        (
-            SELECT DISTINCT situation1
-            FROM traffic_situations as ts
-        ) as ts_filtered
-        JOIN traffic_situation_col1 tsc
-        ON ts_filtered.situation1=tsc.id
-        """
-
-        rows = self.con.execute(query).fetchall()
-
         # populate first traffic situation combo
         # block signals during initialization
         widget.blockSignals(True)
-        for row in rows:
-            widget.addItem(row['label'], row['id'])
+        for index, label in self.traffic_situations.children():
+            widget.addItem(label, index)
+        widget.blockSignals(False)
+
+        self.set_ts_combo(widget)
+
+    def set_ts_combo(self, widget):
+        """Set first traffic situation combo to the situation of the road."""
+        ts_indices = self.widgets['traffic_situation'].widget.ts_indices
 
         # first set to -1, to make sure currentIndexChanged signal is emitted
         # this will trigger initialization of the other combos
+        widget.blockSignals(True)
         widget.setCurrentIndex(-1)
         widget.blockSignals(False)
         # Each combo filtering is triggered by the previous combo index change
-        
+
         if ts_indices is not None:
             ts_ind = ts_indices[0]
             combo_ind = widget.findData(ts_ind)
             widget.setCurrentIndex(combo_ind)
+        else:
+            # clear filtered combos left from a previous road
+            for i in range(2, NO_TRAFFIC_SITUATION_COLS + 1):
+                self.widgets['ts_combo_%i' % i].widget.clear()
+
 
-        # for combo_ind in range(1, ndims + 1):
-        #     combo = self.widgets['ts_combo_%i' % combo_ind].widget
-        #     if ts_indices is not None:
-        #         ts_ind = ts_indices[combo_ind - 1]
-        #         combo.setCurrentIndex(combo.findData(ts_ind))
-    
     def filter_ts_combo(self, combo_index, *args):
         """Filter specified combo based on previous combo values """
         combo = self.widgets['ts_combo_%i' % combo_index].widget
@@ -568,36 +543,11 @@ class RoadEditForm(BaseFeatureForm):
                     parent_combo.itemData(0)
                 )
         
-        # build SQL where-clause for filtering on traffic sit. column id's
-        if parent_indices == []:
-            filters = ''
-        else:
-            filters = "WHERE ts.situation1=%i" % parent_indices[0]
-            for col_ind, ts_ind in enumerate(parent_indices[1:], 2):
-                filters += ' AND ts.situation%i=%i' % (col_ind, ts_ind)
-
-        # Build query to get existing traffic situations
-        query = """
-        SELECT tsc.id as id, tsc.label as label
-        FROM
-        (
-            SELECT DISTINCT situation{current_col}
-            FROM traffic_situations as ts
-            {filters}
-        ) as ts_filtered
-        JOIN traffic_situation_col{current_col} tsc
-        ON ts_filtered.situation{current_col}=tsc.id
-        """.format(
-            current_col=len(parent_indices) + 1,
-            filters=filters
-        )
-        rows = self.con.execute(query).fetchall()
-
         # populate combo
         combo.blockSignals(True)
         combo.clear()
-        for row in rows:
-            combo.addItem(row['label'], row['id'])
+        for index, label in self.traffic_situations.children(parent_indices):
+            combo.addItem(label, index)
         combo.blockSignals(False)
 
         data_index = combo.findData(current_data)
@@ -617,20 +567,9 @@ class RoadEditForm(BaseFeatureForm):
         vals = widget.objectName().split('_')
         code_index = int(vals[-2])
 
-        # get current geocodes from geocode field of road
-        current_gc = self.widgets['geocode'].widget.text().strip().split()
-        
         # number of codetrees defined in edb.rsrc
         ncodes = len(getattr(self, code_type))
 
-        # get geocode at current code index if specified for road
-        try:
-            gc = current_gc[code_index - 1]
-            if gc.lower() == 'none':
-                gc = None
-        except IndexError:
-            gc = None
-
         # get codetree and it's depth, if code index of combo is larger
         # than is defined in edb.rsrc, the combo label is hidden
         if code_index <= ncodes:
@@ -656,23 +595,42 @@ class RoadEditForm(BaseFeatureForm):
         # disconnect cascading of non used levels
         self.widgets[
             'gc_combo_%i_%i' % (code_index, nlevels)
-        ].widget.currentIndexChanged.disconnect()
+        ].disconnect_actions()
 
         # Set combo label
         self.widgets['%s_label_%i' % (code_type, code_index)].widget.setText(
             codetree.name
         )
         
-        # populate first traffic situation combo
+        # populate first code combo
         # block signals during initialization
         widget.blockSignals(True)
+        fill_code_combo(widget, codetree.children())
+        widget.blockSignals(False)
 
-        widget.addItem('.', 'None')
-        for node in codetree.root.findall('*'):
-            widget.addItem(' '.join([node.tag, node.attrib['name']]), node.tag)
+        self.set_code_combo(code_type, widget)
+
+    def set_code_combo(self, code_type, widget):
+        """Set first code combo to the code of the road."""
+        vals = widget.objectName().split('_')
+        code_index = int(vals[-2])
+        if code_index > len(getattr(self, code_type)):
+            return
+
+        # get current geocodes from geocode field of road
+        current_gc = self.widgets['geocode'].widget.text().strip().split()
+
+        # get geocode at current code index if specified for road
+        try:
+            gc = current_gc[code_index - 1]
+            if gc.lower() == 'none':
+                gc = None
+        except IndexError:
+            gc = None
 
         # first set to -1, to make sure currentIndexChanged signal is emitted
         # this will trigger initialization of the other combos
+        widget.blockSignals(True)
         widget.setCurrentIndex(-1)
         widget.blockSignals(False)
         # Each combo filtering is triggered by the previous combo index change
@@ -729,14 +687,7 @@ class RoadEditForm(BaseFeatureForm):
 
         # populate combo
         combo.blockSignals(True)
-        combo.clear()
-        combo.addItem('.', 'None')
-        if '.' not in parent_codes:
-            for node in codetree.root.findall("/".join(parent_codes) + '/*'):
-                combo.addItem(
-                    ' '.join([node.tag, node.attrib['name']]),
-                    node.tag
-                )
+        fill_code_combo(combo, codetree.children(parent_codes))
 
         if current_data is not None:
             data_index = combo.findData(current_data)
@@ -745,41 +696,56 @@ class RoadEditForm(BaseFeatureForm):
         combo.blockSignals(False)
         combo.setCurrentIndex(data_index)
 
+    def rebind(self, feature):
+        """Bind form to another road, keeping widgets and signals.
+
+        Returns False if lookups or code trees have changed since the form
+        was built, the form must then be built again.
+        """
+        lookups = self.get_lookups()
+        if lookups.get('road_vehicles') is not self.vehicles or \
+           lookups.get('road_timevars') is not self.timevars or \
+           lookups.get('traffic_situations') is not self.traffic_situations:
+            return False
+        if load_rsrc(self.rsrc_path()).gc is not self.gc:
+            return False
+
+        self.feature = feature
+        self.read_on_road_vehicles()
+        self.vehicle_model.set_rows(self.on_road_vehicles)
+
+        self.init_traffic_situation(self.widgets['traffic_situation'].widget)
+        self.set_ts_combo(self.widgets['ts_combo_1'].widget)
+        for code_index in range(1, MAX_NO_CODES + 1):
+            self.set_code_combo(
+                'gc', self.widgets['gc_combo_%i_1' % code_index].widget
+            )
+
+        for name in ('emission_delta_label', 'bulk_status_label'):
+            self.widgets[name].widget.setText('')
+        return True
+
+    def get_lookups(self):
+        return get_lookup_cache(self.get_db_file())
+
+    def profiled_connections(self):
+        return [self.con, self.get_lookups().con]
+
     def read_traffic_situations(self):
-        rows = self.con.execute(
-            "SELECT * FROM traffic_situation_columns"
-        ).fetchall()
-        rows.sort(key=lambda r: r['id'])
+        rows = self.get_lookups().get('traffic_situation_columns')
         self.traffic_situation_cols = [row['label'] for row in rows]
+        self.traffic_situations = self.get_lookups().get('traffic_situations')
 
     def read_on_road_vehicles(self):
-        query = """
-        SELECT
-          rv.name as name,
-          rvl.vehicle as vehicle,
-          rvl.timevar as timevar,
-          rv.isheavy as isheavy,
-          rv.istraffic as istraffic,
-          rvl.fraction as fraction
-        FROM (
-           SELECT *
-           FROM road_vehicle_link
-           WHERE road = %i
-        ) rvl
-        JOIN road_vehicles rv
-        ON rvl.vehicle = rv.id
-        """ % self.feature.id()
-        self.on_road_vehicles = self.con.execute(query).fetchall()
+        self.on_road_vehicles = execute(
+            self.con, 'road_vehicles_on_road', road=self.feature.id()
+        ).fetchall()
 
     def read_vehicles(self):
-        self.vehicles = self.con.execute(
-            "SELECT id, name FROM road_vehicles"
-        ).fetchall()
+        self.vehicles = self.get_lookups().get('road_vehicles')
 
     def read_timevars(self):
-        self.timevars = self.con.execute(
-            "SELECT id, name FROM road_timevars"
-        ).fetchall()
+        self.timevars = self.get_lookups().get('road_timevars')
 
     def init_combo(self, rows, widget):
         for row in rows:
@@ -791,20 +757,10 @@ class RoadEditForm(BaseFeatureForm):
         """get traffic situation indices from ts id (or None if new road)."""
         ts = widget.text()
         widget.ts_indices = None
-        if len(ts) > 0 and ts is not None:
-            ts = int(ts)
-            
-            ts_indices = self.con.execute(
-                """
-                SELECT * FROM traffic_situations
-                WHERE id=%i
-                """ % ts
-            ).next()
-            index_list = [ts_indices['id']]
-            for i in range(1, NO_TRAFFIC_SITUATION_COLS + 1):
-                if ts_indices['situation%i' % i] is not None:
-                    index_list.append(ts_indices['situation%i' % i])
-            widget.ts_indices = index_list
+        if ts is not None and len(ts) > 0:
+            indices = self.traffic_situations.indices(int(ts))
+            if indices is not None:
+                widget.ts_indices = list(indices)
 
         widget.hide()
 
@@ -829,72 +785,14 @@ class RoadEditForm(BaseFeatureForm):
             self.widgets['traffic_situation'].widget.setText(None)
 
 
-    def add_vehicle_to_table(self, vehicle_id, vehicle_name, tvar_id=None,
-                             fraction=0.0, isheavy=0, istraffic=1):
-        QgsMessageLog.logMessage(
-            'add vehicle',
-            'AirviroOfflineEdb',
-            QgsMessageLog.INFO
-        )
-
-        table = self.widgets['vehicle_table'].widget
-        table.blockSignals(True)
-
-        table_row = table.rowCount()
-        table.insertRow(table_row)
-
-        tvar_id = tvar_id or self.timevars[0]['id']
-        tvar_combo = QtGui.QComboBox()
-        for tvar in self.timevars:
-            tvar_combo.addItem(tvar['name'], tvar['id'])
-        tvar_row_index = tvar_combo.findData(tvar_id)
-        tvar_combo.setCurrentIndex(tvar_row_index)
-        table.setCellWidget(table_row, 1, tvar_combo)
-
-        item = QtGui.QTableWidgetItem(vehicle_name)
-        item.setData(QtCore.Qt.UserRole, vehicle_id)
-        item.setFlags(QtCore.Qt.ItemIsEditable | QtCore.Qt.ItemIsSelectable)
-        table.setItem(table_row, VEHICLE_COL, item)
-
-        item = QtGui.QTableWidgetItem(unicode(fraction))
-        table.setItem(
-            table_row, FRACTION_COL, item
-        )
-
-        if isheavy:
-            isheavy_text = 'Heavy'
-        else:
-            isheavy_text = 'Light'
-        item = QtGui.QTableWidgetItem(isheavy_text)
-        item.setTextColor(INACTIVE_COLOR)
-        item.setData(QtCore.Qt.UserRole, isheavy)
-        item.setFlags(QtCore.Qt.ItemIsEditable | QtCore.Qt.ItemIsSelectable)
-        table.setItem(table_row, ISHEAVY_COL, item)
-        
-        if istraffic:
-            istraffic_text = 'yes'
-        else:
-            istraffic_text = 'no'
-
-        item = QtGui.QTableWidgetItem(istraffic_text)
-        item.setFlags(QtCore.Qt.ItemIsEditable | QtCore.Qt.ItemIsSelectable)
-        item.setTextColor(INACTIVE_COLOR)
-        item.setData(QtCore.Qt.UserRole, istraffic)
-        table.setItem(table_row, ISTRAFFIC_COL, item)
-        self.widgets['vehicle_table'].validate(silent=True)
-        table.blockSignals(False)
-
     def init_table(self, table):
-        QgsMessageLog.logMessage(
-            'init table',
-            'AirviroOfflineEdb',
-            QgsMessageLog.INFO
+        self.vehicle_model = VehicleTableModel(
+            self.vehicles, self.timevars, table
         )
-        # clear table
-        table.clearContents()
-        while table.rowCount() > 0:
-            table.removeRow(0)
-        
+        self.vehicle_model.set_rows(self.on_road_vehicles)
+        table.setModel(self.vehicle_model)
+        table.setItemDelegate(VehicleDelegate(table))
+
         # set column width
         table_width = table.width()
         table.setColumnWidth(VEHICLE_COL, 0.3 * table_width)
@@ -903,49 +801,22 @@ class RoadEditForm(BaseFeatureForm):
         table.setColumnWidth(ISHEAVY_COL, 0.125 * table_width)
         table.setColumnWidth(ISTRAFFIC_COL, 0.123 * table_width)
 
-        # add rows
-        for ind, row in enumerate(self.on_road_vehicles):
-            self.add_vehicle_to_table(
-                row['vehicle'],
-                row['name'],
-                tvar_id=row['timevar'],
-                fraction=row['fraction'],
-                isheavy=row['isheavy'],
-                istraffic=row['istraffic']
-            )
-
-        reconnect(table.itemChanged, self.validate_cell_item)
-
-    @QtCore.pyqtSlot(int)
-    def set_vehicle_meta(self, value):
-        # combo = qApp.focusWidget()
-        combo = self.sender()
-
-        veh_id = combo.itemData(combo.currentIndex())
-        isheavy, istraffic = self.con.execute(
-            'SELECT isheavy, istraffic from road_vehicles WHERE id=%i' % veh_id
-        ).next()
-
-        if isheavy:
-            isheavy = 'H'
-        else:
-            isheavy = 'L'
-
-        table = self.widgets['vehicle_table'].widget
-        table_index = table.indexAt(combo.parent().pos())
-        table.setItem(
-            table_index.row(), 3, QtGui.QTableWidgetItem(isheavy)
-        )
-        table.setItem(
-            table_index.row(), 4, QtGui.QTableWidgetItem(unicode(istraffic))
+        for signal in (
+                self.vehicle_model.dataChanged,
+                self.vehicle_model.rowsInserted,
+                self.vehicle_model.rowsRemoved,
+                self.vehicle_model.modelReset):
+            self.connections.connect(signal, self.validate_cell_item)
+
+    def rsrc_path(self):
+        """Return path of edb.rsrc, next to the original edb."""
+        return path.join(
+            path.dirname(source_filename(self.get_db_file())),
+            'edb.rsrc'
         )
 
     def read_rsrc(self):
-        rsrc_path = path.join(
-            path.dirname(self.get_db_file()),
-            'edb.rsrc'
-        )
-        rsrc = Rsrc(rsrc_path)
+        rsrc = load_rsrc(self.rsrc_path())
 
         self.gc = rsrc.gc
         
@@ -957,13 +828,8 @@ def formOpen(dialog, layerid, featureid):
         QgsMessageLog.INFO
     )
 
-    form = RoadEditForm(
-        dialog, layerid, featureid,
+    open_form(
+        RoadEditForm, dialog, layerid, featureid,
         msg_method='label',
         msg_widget='form_validation_msg_label'
     )
-    form.load_data()
-    form.find_widgets()
-    form.init_widgets()
-    form.validate()
-    form.connect_signals()
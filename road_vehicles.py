@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Saving of the vehicle composition of roads.
+
+The vehicle composition of a road is the set of rows in road_vehicle_link
+for the road, one row per vehicle with timevar and fraction. When saving,
+the edited rows are compared with the rows as loaded, and only the
+differences are written in a single transaction.
+
+While editing, VehicleSums keeps the fraction sums per heavy/traffic
+class and the count of each vehicle up to date, so the composition can be
+validated without walking all rows.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from collections import Counter, defaultdict, namedtuple
+
+from AirviroOfflineEdb.queries import QUERIES
+
+VehicleRow = namedtuple('VehicleRow', ['vehicle', 'timevar', 'fraction'])
+
+VehicleDiff = namedtuple('VehicleDiff', ['insert', 'update', 'delete'])
+
+
+class VehicleSums(object):
+
+    """Running fraction sums and vehicle counts of a vehicle composition."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # fraction sums per (isheavy, istraffic)
+        self.sums = defaultdict(float)
+        self.counts = Counter()
+        self.nrows = 0
+        self._nduplicated = 0
+
+    def add(self, vehicle, isheavy, istraffic, fraction):
+        self.sums[(bool(isheavy), bool(istraffic))] += fraction
+        self.counts[vehicle] += 1
+        if self.counts[vehicle] == 2:
+            self._nduplicated += 1
+        self.nrows += 1
+
+    def remove(self, vehicle, isheavy, istraffic, fraction):
+        self.sums[(bool(isheavy), bool(istraffic))] -= fraction
+        self.counts[vehicle] -= 1
+        if self.counts[vehicle] == 1:
+            self._nduplicated -= 1
+        elif self.counts[vehicle] == 0:
+            del self.counts[vehicle]
+        self.nrows -= 1
+
+    def change_fraction(self, isheavy, istraffic, old, new):
+        self.sums[(bool(isheavy), bool(istraffic))] += new - old
+
+    @property
+    def traffic(self):
+        """Sum of fractions of traffic vehicles."""
+        return self.sums[(False, True)] + self.sums[(True, True)]
+
+    @property
+    def heavy_traffic(self):
+        return self.sums[(True, True)]
+
+    @property
+    def light_traffic(self):
+        return self.sums[(False, True)]
+
+    def duplicates(self):
+        """Return vehicles with more than one row."""
+        if self._nduplicated == 0:
+            return []
+        return [vehicle for vehicle, n in self.counts.iteritems() if n > 1]
+
+
+def vehicle_rows(rows):
+    """Convert rows with vehicle, timevar and fraction to VehicleRows."""
+    return [
+        VehicleRow(row['vehicle'], row['timevar'], row['fraction'])
+        for row in rows
+    ]
+
+
+def diff_vehicle_rows(loaded, edited):
+    """Return VehicleDiff of rows to insert, update and delete.
+
+    Vehicles with several rows in loaded are deleted and inserted again.
+    Raises ValueError if a vehicle has several rows in edited, as only one
+    of them could be saved.
+    """
+    counts = Counter(row.vehicle for row in edited)
+    duplicates = sorted(
+        vehicle for vehicle, n in counts.iteritems() if n > 1
+    )
+    if len(duplicates) > 0:
+        raise ValueError('Duplicate rows for vehicle %s' % duplicates[0])
+
+    loaded_by_vehicle = {}
+    duplicates = set()
+    for row in loaded:
+        if row.vehicle in loaded_by_vehicle:
+            duplicates.add(row.vehicle)
+        loaded_by_vehicle[row.vehicle] = row
+    edited_by_vehicle = dict((row.vehicle, row) for row in edited)
+
+    insert = []
+    update = []
+    for row in edited:
+        old = loaded_by_vehicle.get(row.vehicle)
+        if old is None or row.vehicle in duplicates:
+            insert.append(row)
+        elif (old.timevar, old.fraction) != (row.timevar, row.fraction):
+            update.append(row)
+
+    delete = [
+        vehicle for vehicle in loaded_by_vehicle
+        if vehicle not in edited_by_vehicle or vehicle in duplicates
+    ]
+    return VehicleDiff(insert, update, delete)
+
+
+def save_vehicle_diff(con, road, diff):
+    """Write differences of the vehicle composition in one transaction."""
+    with con:
+        con.executemany(
+            QUERIES['delete_road_vehicle'],
+            [{'road': road, 'vehicle': vehicle} for vehicle in diff.delete]
+        )
+        con.executemany(
+            QUERIES['update_road_vehicle'],
+            [dict(row._asdict(), road=road) for row in diff.update]
+        )
+        con.executemany(
+            QUERIES['insert_road_vehicle'],
+            [dict(row._asdict(), road=road) for row in diff.insert]
+        )
+
+
+def save_road_vehicles(con, road, loaded, edited):
+    """Save edited vehicle rows of a road, return the applied VehicleDiff."""
+    diff = diff_vehicle_rows(loaded, edited)
+    if diff.insert or diff.update or diff.delete:
+        save_vehicle_diff(con, road, diff)
+    return diff
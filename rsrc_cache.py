@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Cache of code trees parsed from edb.rsrc files.
+
+Parsing an edb.rsrc with large code trees is slow, so the parsed code
+trees are kept in memory for all forms, and a compact serialized copy is
+stored on disk, keyed by path, modification time and size of the rsrc
+file. The rsrc file is only parsed again when it has changed.
+
+Only the code trees are cached, as nested (code, name, children) tuples
+that are turned back into element trees on load. When a code tree is
+loaded, an index from the path of parent codes to the child codes and
+their labels is built, so code combos are filled without searching the
+tree.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+import xml.etree.cElementTree as ET
+
+from AirviroOfflineEdb.lookup_cache import file_stamp
+
+# increase when the serialized format changes
+FORMAT_VERSION = 1
+
+# code tree attributes of pyAirviro Rsrc that are cached
+CODE_TREE_ATTRIBUTES = ('gc', 'ac')
+
+# parsed rsrc files, path: (stamp, CachedRsrc)
+_rsrc_cache = {}
+
+
+def cache_dir():
+    """Directory for serialized rsrc files."""
+    base = (
+        os.environ.get('LOCALAPPDATA') or
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache')
+    )
+    return os.path.join(base, 'AirviroOfflineEdb', 'rsrc')
+
+
+def path_digest(path):
+    """Return sha1 hex digest of a path, also of unicode non-ascii paths."""
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return hashlib.sha1(path).hexdigest()
+
+
+def cache_filename(path, stamp):
+    """Cache file for an rsrc, name is <hash of path>-<hash of stamp>."""
+    return os.path.join(
+        cache_dir(),
+        '%s-%s.pickle' % (
+            path_digest(path)[:16],
+            hashlib.sha1(repr(stamp)).hexdigest()[:16]
+        )
+    )
+
+
+def node_to_tuple(node):
+    return (
+        node.tag,
+        node.attrib.get('name'),
+        tuple(node_to_tuple(child) for child in node)
+    )
+
+
+def tuple_to_node(data, parent=None):
+    tag, name, children = data
+    if parent is None:
+        node = ET.Element(tag)
+    else:
+        node = ET.SubElement(parent, tag)
+    if name is not None:
+        node.set('name', name)
+    for child in children:
+        tuple_to_node(child, node)
+    return node
+
+
+class CodeTree(object):
+
+    """Code tree restored from cache, with the interface of pyAirviro."""
+
+    def __init__(self, name, depth, root):
+        self.name = name
+        self.root = root
+        self._depth = depth
+        self._children = {}
+        self._index(root, ())
+
+    def _index(self, node, path):
+        items = []
+        for child in node:
+            items.append(
+                (child.tag, ' '.join([child.tag, child.attrib['name']]))
+            )
+            self._index(child, path + (child.tag,))
+        self._children[path] = items
+
+    def depth(self):
+        return self._depth
+
+    def children(self, path=()):
+        """Return (code, label) of the children of a path of codes."""
+        return self._children.get(tuple(path), [])
+
+    def to_tuple(self):
+        return (self.name, self._depth, node_to_tuple(self.root))
+
+    @classmethod
+    def from_tuple(cls, data):
+        name, depth, root = data
+        return cls(name, depth, tuple_to_node(root))
+
+
+class CachedRsrc(object):
+
+    """Code trees of an edb.rsrc, e.g. rsrc.gc for geocodes."""
+
+    def __init__(self, code_trees):
+        for attribute in CODE_TREE_ATTRIBUTES:
+            setattr(self, attribute, code_trees.get(attribute, []))
+
+    @classmethod
+    def from_rsrc(cls, rsrc):
+        code_trees = {}
+        for attribute in CODE_TREE_ATTRIBUTES:
+            code_trees[attribute] = [
+                CodeTree(tree.name, tree.depth(), tree.root)
+                for tree in getattr(rsrc, attribute, None) or []
+            ]
+        return cls(code_trees)
+
+    def serialize(self):
+        return pickle.dumps(
+            {
+                'version': FORMAT_VERSION,
+                'code_trees': dict(
+                    (attribute, [
+                        tree.to_tuple() for tree in getattr(self, attribute)
+                    ])
+                    for attribute in CODE_TREE_ATTRIBUTES
+                )
+            },
+            pickle.HIGHEST_PROTOCOL
+        )
+
+    @classmethod
+    def deserialize(cls, data):
+        data = pickle.loads(data)
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError('Unknown format of cached rsrc')
+        return cls(dict(
+            (attribute, [CodeTree.from_tuple(tree) for tree in trees])
+            for attribute, trees in data['code_trees'].iteritems()
+        ))
+
+
+def _parse_rsrc(path):
+    from pyAirviro.edb.rsrc import Rsrc
+    return Rsrc(path)
+
+
+def _read_cache_file(filename):
+    try:
+        with open(filename, 'rb') as cache_file:
+            return CachedRsrc.deserialize(cache_file.read())
+    except (IOError, EOFError, ValueError, KeyError,
+            pickle.UnpicklingError):
+        return None
+
+
+def _write_cache_file(filename, rsrc):
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = filename + '.%i.tmp' % os.getpid()
+        with open(tmp_filename, 'wb') as cache_file:
+            cache_file.write(rsrc.serialize())
+        # remove cache files of earlier versions of the rsrc
+        prefix = os.path.basename(filename).split('-')[0]
+        for old_filename in os.listdir(directory):
+            if old_filename.startswith(prefix + '-') and \
+               old_filename.endswith('.pickle'):
+                os.remove(os.path.join(directory, old_filename))
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        # the cache is only an optimization
+        pass
+
+
+def load_rsrc(path, parse=_parse_rsrc):
+    """Return code trees of an rsrc file, from cache if unchanged."""
+    path = os.path.abspath(path)
+    stamp = file_stamp(path)
+    if stamp is None:
+        raise ValueError('Rsrc file %s not found' % path)
+
+    cached = _rsrc_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    filename = cache_filename(path, stamp)
+    rsrc = _read_cache_file(filename)
+    if rsrc is None:
+        rsrc = CachedRsrc.from_rsrc(parse(path))
+        _write_cache_file(filename, rsrc)
+
+    _rsrc_cache[path] = (stamp, rsrc)
+    return rsrc
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Form definitions derived from the schema of edb tables.
+
+The columns of a table, their declared types, not-null constraints and
+foreign keys are read from the sqlite catalog. From these a FormField is
+derived per column, giving
+
+- the kind of widget: a line edit, a read-only id or a combo of the
+  rows of a referenced table,
+- the validation rule, taken from validation_rules.RULES if defined
+  there, otherwise derived from the declared type and constraints, and
+- for foreign keys, the name of a shared lookup with (key, label) of the
+  referenced rows, registered in the lookup cache.
+
+The definition is read once per edb and table. form_ui renders it as a
+Qt Designer form for QGIS, with one widget named as each field.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import os
+import re
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+from AirviroOfflineEdb.lookup_cache import register_query_lookup
+from AirviroOfflineEdb.validation_rules import RULES, Rule
+
+# widget kinds of form fields
+LINE_EDIT = 'line edit'
+READ_ONLY = 'read only'
+REFERENCE = 'reference'
+
+# declared types of spatialite geometry columns, edited on the map
+GEOMETRY_TYPES = (
+    'GEOMETRY', 'POINT', 'LINESTRING', 'POLYGON',
+    'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON', 'GEOMETRYCOLLECTION'
+)
+
+# columns used as label of referenced rows, in order of preference
+LABEL_COLUMNS = ('name', 'label', 'code')
+
+# suffix of the object name of reference combos
+COMBO_SUFFIX = '_combo'
+
+
+class FormField(namedtuple(
+        'FormField', 'name kind rule references lookup')):
+
+    """Field of a generic form.
+
+    references is (table, column) for foreign keys, lookup the name of
+    the lookup with (key, label) rows of the referenced table.
+    """
+
+
+# form fields per edb and table, see form_fields
+_form_fields = {}
+
+
+def column_rule(column, declared_type, notnull, default):
+    """Derive a validation Rule from the declaration of a column."""
+    declared_type = (declared_type or '').upper()
+    required = bool(notnull) and default is None
+    if 'INT' in declared_type:
+        return Rule(column, int, required=required)
+    if any(t in declared_type for t in ('REAL', 'FLOA', 'DOUB', 'NUM')):
+        return Rule(column, float, required=required)
+    match = re.search(r'CHAR\s*\(\s*(\d+)\s*\)', declared_type)
+    max_len = int(match.group(1)) if match else None
+    return Rule(column, unicode, required=required, max_len=max_len)
+
+
+def label_column(con, table):
+    """Return the column used to label rows of a referenced table."""
+    columns = [row[1] for row in con.execute('PRAGMA table_info(%s)' % table)]
+    for column in LABEL_COLUMNS:
+        if column in columns:
+            return column
+    return None
+
+
+def reference_lookup(con, table, column):
+    """Register and return name of the lookup of a referenced table.
+
+    The lookup has rows (key, label) ordered by label.
+    """
+    name = 'references:%s.%s' % (table, column)
+    label = label_column(con, table) or column
+    register_query_lookup(
+        name,
+        [table],
+        'SELECT "%s", "%s" FROM %s ORDER BY "%s", "%s"' % (
+            column, label, table, label, column
+        )
+    )
+    return name
+
+
+def read_form_fields(con, table):
+    """Read form fields of a table from the sqlite catalog."""
+    foreign_keys = {}
+    for row in con.execute('PRAGMA foreign_key_list(%s)' % table):
+        # id, seq, table, from, to, ...
+        foreign_keys[row[3]] = (row[2], row[4])
+    rules = dict((rule.column, rule) for rule in RULES.get(table, []))
+
+    fields = []
+    for cid, name, declared_type, notnull, default, pk in con.execute(
+            'PRAGMA table_info(%s)' % table):
+        if (declared_type or '').upper() in GEOMETRY_TYPES:
+            continue
+        rule = rules.get(name) or column_rule(
+            name, declared_type, notnull, default
+        )
+        if pk:
+            fields.append(FormField(name, READ_ONLY, None, None, None))
+        elif name in foreign_keys:
+            ref_table, ref_column = foreign_keys[name]
+            if ref_column is None:
+                ref_column = 'id'
+            fields.append(FormField(
+                name, REFERENCE, rule, (ref_table, ref_column),
+                reference_lookup(con, ref_table, ref_column)
+            ))
+        else:
+            fields.append(FormField(name, LINE_EDIT, rule, None, None))
+    return fields
+
+
+def form_fields(con, filename, table):
+    """Return form fields of a table, read once per edb."""
+    key = (os.path.abspath(filename), table)
+    if key not in _form_fields:
+        _form_fields[key] = read_form_fields(con, table)
+    return _form_fields[key]
+
+
+def _property(name, value_xml):
+    return '<property name="%s">%s</property>' % (name, value_xml)
+
+
+def _string(text):
+    return '<string>%s</string>' % escape(text)
+
+
+def _widget(widget_class, name, *properties):
+    return '<widget class="%s" name="%s">%s</widget>' % (
+        widget_class, name, ''.join(properties)
+    )
+
+
+def form_ui(table, fields):
+    """Return Qt Designer xml of a form for the fields of a table.
+
+    Each field is a QLineEdit named as the field, which QGIS binds to the
+    attribute. Reference fields also get a QComboBox named
+    <field>_combo, kept in sync with the line edit by the form.
+    """
+    rows = []
+    for row, field in enumerate(fields):
+        label = _widget(
+            'QLabel', '%s_label' % field.name,
+            _property('text', _string(field.name))
+        )
+        if field.kind == REFERENCE:
+            editor = (
+                '<layout class="QHBoxLayout" name="%s_layout">'
+                '<item>%s</item><item>%s</item></layout>' % (
+                    field.name,
+                    _widget('QComboBox', field.name + COMBO_SUFFIX),
+                    _widget('QLineEdit', field.name)
+                )
+            )
+        elif field.kind == READ_ONLY:
+            editor = _widget(
+                'QLineEdit', field.name,
+                _property('readOnly', '<bool>true</bool>')
+            )
+        else:
+            editor = _widget('QLineEdit', field.name)
+        rows.append(
+            '<item row="%i" column="0">%s</item>'
+            '<item row="%i" column="1">%s</item>' % (row, label, row, editor)
+        )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<ui version="4.0"><class>%(cls)s</class>'
+        '<widget class="QDialog" name="%(cls)s">'
+        '%(title)s'
+        '<layout class="QVBoxLayout" name="main_layout">'
+        '<item><layout class="QFormLayout" name="fields_layout">'
+        '%(rows)s</layout></item>'
+        '<item>%(msg)s</item>'
+        '<item>%(buttons)s</item>'
+        '</layout></widget><resources/><connections/></ui>'
+    ) % {
+        'cls': '%s_form' % table,
+        'title': _property('windowTitle', _string(table)),
+        'rows': ''.join(rows),
+        'msg': _widget(
+            'QLabel', 'form_validation_msg_label',
+            _property('wordWrap', '<bool>true</bool>')
+        ),
+        'buttons': _widget(
+            'QDialogButtonBox', 'buttonBox',
+            _property(
+                'standardButtons',
+                '<set>QDialogButtonBox::Cancel|QDialogButtonBox::Ok</set>'
+            )
+        )
+    }
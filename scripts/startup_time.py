@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure the time the plugin adds to QGIS startup.
+
+QGIS imports the plugin package and the module of the plugin class at
+startup (classFactory), the dock widget module is imported on first run.
+Each import is timed in a fresh python process, after importing qgis.core
+and PyQt4 which QGIS has already loaded at that point.
+
+Compare two versions of the plugin by giving a plugin directory of each,
+e.g. a git worktree of an older commit:
+
+    source scripts/run-env-linux.sh /path/to/qgis
+    python scripts/startup_time.py ~/old/plugins ~/.qgis2/python/plugins
+"""
+
+import argparse
+import subprocess
+import sys
+
+STATEMENT = """
+import sys, time
+sys.path.insert(0, %(plugins_dir)r)
+from qgis.core import QgsApplication
+from PyQt4 import QtCore, QtGui
+start = time.time()
+import %(module)s
+print(time.time() - start)
+"""
+
+# module imported at startup and on first run of the plugin
+PHASES = [
+    ('startup', 'AirviroOfflineEdb.qgis_edb'),
+    ('first run', 'AirviroOfflineEdb.qgis_edb_dockwidget')
+]
+
+
+def import_time(plugins_dir, module):
+    """Return seconds to import module in a fresh python process."""
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        STATEMENT % {'plugins_dir': plugins_dir, 'module': module}
+    ])
+    return float(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'plugins_dirs', nargs='+', metavar='PLUGINS_DIR',
+        help='directory with the AirviroOfflineEdb plugin package'
+    )
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help='number of measurements per import (default 5)'
+    )
+    args = parser.parse_args()
+
+    for plugins_dir in args.plugins_dirs:
+        print(plugins_dir)
+        for phase, module in PHASES:
+            times = [
+                import_time(plugins_dir, module) for i in range(args.repeat)
+            ]
+            print('  %-10s %8.1f ms (median of %i)' % (
+                phase, median(times) * 1000, args.repeat
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Helpers for sqlite connections to edb's, without QGIS dependencies."""
+
+import zlib
+from contextlib import contextmanager
+
+
+def relation_in_db(con, name):
+    """Return True if a table or view with given name exists."""
+    row = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') "
+        "AND name=?",
+        (name,)
+    ).fetchone()
+    return row is not None
+
+
+@contextmanager
+def transaction(con, begin='BEGIN'):
+    """Run the statements of a with-block in a single transaction.
+
+    The sqlite3 module commits an open transaction before any statement
+    other than INSERT, UPDATE, DELETE and REPLACE, e.g. before CREATE
+    TABLE. Here the transaction is begun and ended explicitly instead, so
+    it is committed, or rolled back on errors, as a whole.
+    """
+    con.commit()
+    isolation_level = con.isolation_level
+    con.isolation_level = None
+    try:
+        con.execute(begin)
+        try:
+            yield con
+        except:
+            con.execute('ROLLBACK')
+            raise
+        con.execute('COMMIT')
+    finally:
+        con.isolation_level = isolation_level
+
+
+def data_version(con):
+    """Return a value that changes whenever the database is modified.
+
+    PRAGMA data_version only changes for commits made by other
+    connections, the number of changes made by this connection is
+    therefore included.
+    """
+    return (
+        con.execute('PRAGMA data_version').fetchone()[0],
+        con.total_changes
+    )
+
+
+def _row_checksum(rowid, value):
+    return zlib.crc32(repr((rowid, value)))
+
+
+def table_fingerprint(con, table):
+    """Return a checksum of the content of a table.
+
+    The fingerprint consists of the row count, the largest rowid and a
+    per column sum of checksums of (rowid, value), which changes for
+    practically all inserts, updates and deletes. None is returned for a
+    table that does not exist.
+    """
+    if not relation_in_db(con, table):
+        return None
+    con.create_function('_row_checksum', 2, _row_checksum)
+    columns = [row[1] for row in con.execute('PRAGMA table_info(%s)' % table)]
+    aggregates = ['count(*)', 'max(rowid)']
+    for col in columns:
+        aggregates.append('total(_row_checksum(rowid, "%s"))' % col)
+    return tuple(con.execute(
+        'SELECT %s FROM %s' % (', '.join(aggregates), table)
+    ).fetchone())
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""Bulk edit test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import unittest
+
+from AirviroOfflineEdb.bulk_edit import apply_composition
+from test_quality_scan import create_road_edb
+
+
+class BulkEditTest(unittest.TestCase):
+    """Test bulk editing of vehicle compositions."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_road_edb()
+
+    def test_apply_composition(self):
+        """Test that composition replaces rows of given roads only."""
+        composition = [(1, 1, 80.0), (2, 1, 20.0), (3, 1, 3.0)]
+        nroads, seconds = apply_composition(self.con, [1, 2, 2], composition)
+        self.assertEqual(nroads, 2)
+        rows = self.con.execute(
+            'SELECT road, vehicle, timevar, fraction FROM road_vehicle_link '
+            'ORDER BY road, vehicle'
+        ).fetchall()
+        self.assertEqual(
+            rows,
+            [(1,) + row for row in composition] +
+            [(2,) + row for row in composition] +
+            [(5, 1, 9, 100.0)]
+        )
+
+    def test_invalid_composition(self):
+        """Test that nothing is written for an invalid composition."""
+        for composition in (
+                [(1, 1, 80.0)],
+                [(1, 1, 80.0), (1, 1, 20.0)],
+                [(1, 2, 100.0)]):
+            self.assertRaises(
+                ValueError, apply_composition, self.con, [1], composition
+            )
+        self.assertEqual(
+            self.con.execute(
+                'SELECT count(*) FROM road_vehicle_link WHERE road=1'
+            ).fetchone()[0],
+            3
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(BulkEditTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,150 @@
+# coding=utf-8
+"""Headless edb api and command line test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb import edb_cli
+from AirviroOfflineEdb.edb_api import Edb, run_batch
+from test_emission_calc import create_test_edb
+from test_quality_scan import create_road_edb
+
+
+class EdbApiTest(unittest.TestCase):
+    """Test the headless edb api."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        mem_con = create_road_edb()
+        for name in ('edb1', 'edb2'):
+            filename = os.path.join(self.tmpdir, name + '.sqlite')
+            con = sqlite3.connect(filename)
+            con.executescript('\n'.join(mem_con.iterdump()))
+            con.close()
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_info(self):
+        """Test description of an edb."""
+        with Edb(self.filenames[0]) as edb:
+            info = edb.info()
+        self.assertEqual(info['tables']['roads'], 20)
+        self.assertEqual(info['sources'], {'roads': 20})
+        self.assertRaises(ValueError, Edb, os.path.join(self.tmpdir, 'no.db'))
+
+    def test_diff(self):
+        """Test diff of rows in two edbs."""
+        con = sqlite3.connect(self.filenames[1])
+        con.execute('DELETE FROM road_vehicle_link WHERE road = 5')
+        con.execute('UPDATE roads SET vehicles = 10 WHERE id = 2')
+        con.execute('DELETE FROM roads WHERE id = 20')
+        con.commit()
+        con.close()
+
+        with Edb(self.filenames[0]) as edb:
+            self.assertEqual(edb.diff(self.filenames[0]), {})
+            diff = edb.diff(self.filenames[1], ['roads', 'road_vehicles'])
+        self.assertEqual(diff.keys(), ['roads'])
+        self.assertEqual(diff['roads'].added, [])
+        self.assertEqual(diff['roads'].removed, [20])
+        self.assertEqual(diff['roads'].changed, [2])
+
+    def test_export_table(self):
+        """Test export of a table as csv, one file per edb."""
+        pattern = os.path.join(self.tmpdir, '{edb}-road_vehicles.csv')
+        with Edb(self.filenames[0]) as edb:
+            self.assertEqual(edb.export_table('road_vehicles', pattern), 3)
+            self.assertRaises(
+                ValueError, edb.export_table, 'no_table', pattern
+            )
+        with open(os.path.join(self.tmpdir, 'edb1-road_vehicles.csv')) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], '1')
+
+    def test_run_batch(self):
+        """Test operations on many edbs, in one and several processes."""
+        for processes in (1, 2):
+            results = sorted(run_batch(
+                'apply_composition', self.filenames, processes,
+                composition=[(1, 1, 100)], where='id <= 2'
+            ))
+            self.assertEqual(
+                [result.filename for result in results], self.filenames
+            )
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertEqual(result.result[0], 2)
+
+        results = list(run_batch(
+            'export_table', self.filenames, 1,
+            table='no_table', filename='out.csv'
+        ))
+        self.assertTrue(all(result.error for result in results))
+        self.assertRaises(
+            ValueError, list, run_batch('diff', self.filenames)
+        )
+
+    def test_cli(self):
+        """Test command line export of several edbs."""
+        output = os.path.join(self.tmpdir, '{edb}.csv')
+        status = edb_cli.main([
+            '-j', '2', 'export', '--table', 'roads', '--output', output
+        ] + self.filenames)
+        self.assertEqual(status, 0)
+        for name in ('edb1', 'edb2'):
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.tmpdir, name + '.csv'))
+            )
+        status = edb_cli.main(
+            ['export', '--table', 'no_table', '--output', output,
+             self.filenames[0]]
+        )
+        self.assertEqual(status, 1)
+
+    def test_cli_parallel(self):
+        """Test command line validation and calculation of several edbs."""
+        status = edb_cli.main(['-j', '2', 'validate'] + self.filenames)
+        self.assertEqual(status, 0)
+
+        filenames = []
+        for name in ('calc1', 'calc2'):
+            filename = os.path.join(self.tmpdir, name + '.sqlite')
+            create_test_edb(filename)
+            filenames.append(filename)
+        for jobs in ('1', '2'):
+            status = edb_cli.main(['-j', jobs, 'calculate'] + filenames)
+            self.assertEqual(status, 0)
+        for filename in filenames:
+            con = sqlite3.connect(filename)
+            self.assertEqual(
+                con.execute('SELECT count(*) FROM road_emissions').fetchone(),
+                (100,)
+            )
+            con.close()
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(EdbApiTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,135 @@
+# coding=utf-8
+"""Emission calculation test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from AirviroOfflineEdb import emission_calc
+from AirviroOfflineEdb.grid_tiles import GridTiles
+
+
+def create_test_edb(filename, nroads=50):
+    con = sqlite3.connect(filename)
+    con.executescript(
+        """
+        CREATE TABLE substances (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE roads (id INTEGER PRIMARY KEY, vehicles INTEGER);
+        CREATE TABLE road_ef (substance INTEGER, ef REAL);
+        CREATE VIEW road_emission_view AS
+        SELECT r.id as source, ef.substance as substance,
+          r.vehicles * ef.ef as emis
+        FROM roads r CROSS JOIN road_ef ef;
+        """
+    )
+    con.executemany(
+        'INSERT INTO substances VALUES (?, ?)', [(3, 'NOx'), (25, 'CO')]
+    )
+    con.executemany('INSERT INTO road_ef VALUES (?, ?)', [(3, 0.5), (25, 2)])
+    con.executemany(
+        'INSERT INTO roads VALUES (?, ?)',
+        [(i, i * 100) for i in range(1, nroads + 1)]
+    )
+    con.commit()
+    con.close()
+
+
+class EmissionCalcTest(unittest.TestCase):
+    """Test emission calculation."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        create_test_edb(self.filename)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def read_emissions(self):
+        con = sqlite3.connect(self.filename)
+        rows = con.execute(
+            'SELECT source, substance, emis FROM road_emissions '
+            'ORDER BY source, substance'
+        ).fetchall()
+        con.close()
+        return rows
+
+    def test_id_ranges(self):
+        """Test that id-ranges cover all sources."""
+        con = sqlite3.connect(self.filename)
+        ranges = emission_calc.id_ranges(con, 'roads', 8)
+        self.assertEqual(ranges[0][0], 1)
+        self.assertEqual(ranges[-1][1], 50)
+        self.assertEqual(len(ranges), 8)
+        for (first1, last1), (first2, last2) in zip(ranges, ranges[1:]):
+            self.assertLess(last1, first2)
+
+    def test_serial_calculation(self):
+        """Test calculation in current process."""
+        nrows = emission_calc.calculate_emissions(self.filename, processes=1)
+        self.assertEqual(nrows, {'roads': 100})
+        # the connection used for the calculation is closed
+        self.assertIsNone(emission_calc._worker_con)
+        rows = self.read_emissions()
+        self.assertEqual(rows[0], (1, 3, 50.0))
+        self.assertEqual(rows[-1], (50, 25, 10000.0))
+
+    def test_parallel_calculation(self):
+        """Test that parallel calculation gives same result as serial."""
+        emission_calc.calculate_emissions(self.filename, processes=1)
+        serial_rows = self.read_emissions()
+        emission_calc.calculate_emissions(self.filename, processes=3)
+        self.assertEqual(self.read_emissions(), serial_rows)
+
+    def test_tiled_grids(self):
+        """Test that emissions of tiled grid sources are summed from tiles."""
+        con = sqlite3.connect(self.filename)
+        con.executescript(
+            """
+            CREATE TABLE grids (id INTEGER PRIMARY KEY, emis REAL);
+            INSERT INTO grids VALUES (1, 10.0);
+            INSERT INTO grids VALUES (2, 20.0);
+            CREATE VIEW grid_emission_view AS
+            SELECT id as source, 3 as substance, emis FROM grids;
+            """
+        )
+        array = np.zeros((40, 30), dtype=np.float32)
+        array[35:, 20:] = 0.5
+        GridTiles.create(
+            con, 2, 40, 30, 0.0, 4000.0, 100.0, 100.0, tile_size=16
+        ).write_array(25, array)
+        con.close()
+        nrows = emission_calc.calculate_emissions(
+            self.filename, ['grids'], processes=1
+        )
+        self.assertEqual(nrows, {'grids': 2})
+        con = sqlite3.connect(self.filename)
+        rows = con.execute(
+            'SELECT source, substance, emis FROM grid_emissions '
+            'ORDER BY source, substance'
+        ).fetchall()
+        con.close()
+        self.assertEqual(rows, [(1, 3, 10.0), (2, 25, 25.0)])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(EmissionCalcTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Incremental emission update test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb import emission_calc, emission_totals
+from AirviroOfflineEdb.emission_totals import EmissionTotals
+
+from test_emission_calc import create_test_edb
+
+
+class EmissionTotalsTest(unittest.TestCase):
+    """Test incremental update of emissions."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        create_test_edb(self.filename, nroads=10)
+        emission_calc.calculate_emissions(self.filename, processes=1)
+        self.totals = EmissionTotals(self.filename)
+        self.totals.load_totals()
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.totals.con.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_totals(self):
+        """Test totals aggregated from output tables."""
+        self.assertAlmostEqual(self.totals.totals[3], 0.5 * 100 * 55)
+        self.assertAlmostEqual(self.totals.totals[25], 2 * 100 * 55)
+
+    def test_update(self):
+        """Test that an edited road patches totals and output table."""
+        con = sqlite3.connect(self.filename)
+        with con:
+            con.execute('UPDATE roads SET vehicles=2000 WHERE id=5')
+
+        received = []
+        self.totals.add_listener(
+            lambda *args: received.append(args)
+        )
+        delta = self.totals.update('roads', [5])
+        self.assertEqual(delta[3], (250.0, 1000.0))
+        self.assertAlmostEqual(
+            self.totals.totals[3], 0.5 * 100 * 55 + 750
+        )
+        self.assertEqual(received, [('roads', [5], delta)])
+
+        emis = con.execute(
+            'SELECT emis FROM road_emissions WHERE source=5 AND substance=3'
+        ).fetchone()[0]
+        self.assertEqual(emis, 1000.0)
+        con.close()
+
+    def test_update_many(self):
+        """Test set-based update of sources in several chunks."""
+        con = sqlite3.connect(self.filename)
+        with con:
+            con.execute('UPDATE roads SET vehicles=vehicles + 100')
+        con.close()
+
+        chunk_size = emission_totals.ID_CHUNK_SIZE
+        emission_totals.ID_CHUNK_SIZE = 3
+        try:
+            delta = self.totals.update('roads', range(1, 11))
+        finally:
+            emission_totals.ID_CHUNK_SIZE = chunk_size
+        self.assertEqual(delta[3], (0.5 * 100 * 55, 0.5 * 100 * 65))
+        self.assertIsNotNone(self.totals.last_update_time)
+
+        totals = self.totals.totals
+        self.totals.load_totals()
+        self.assertAlmostEqual(totals[3], self.totals.totals[3])
+        self.assertAlmostEqual(totals[25], self.totals.totals[25])
+
+    def test_close_emission_totals(self):
+        """Test that shared totals are closed and removed."""
+        totals = emission_totals.get_emission_totals(self.filename)
+        self.assertIs(
+            emission_totals.get_emission_totals(self.filename), totals
+        )
+        emission_totals.close_emission_totals(self.filename)
+        self.assertRaises(
+            sqlite3.ProgrammingError, totals.con.execute, 'SELECT 1'
+        )
+        self.assertIsNot(
+            emission_totals.get_emission_totals(self.filename), totals
+        )
+        emission_totals.close_emission_totals()
+        self.assertEqual(emission_totals._emission_totals, {})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(EmissionTotalsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
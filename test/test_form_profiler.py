@@ -0,0 +1,108 @@
+# coding=utf-8
+"""Form open profiler test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb import form_profiler
+from test_quality_scan import create_road_edb
+
+
+class FormProfilerTest(unittest.TestCase):
+    """Test form open profiling."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_road_edb()
+        self.profiler = form_profiler.FormProfiler()
+
+    def tearDown(self):
+        """Runs after each test."""
+        form_profiler.enable_profiling(False)
+
+    def test_phases(self):
+        """Test that phases are timed and SQL work is counted."""
+        with self.profiler.open('roads') as profile:
+            with profile.phase('load_data', [self.con]):
+                for i in range(50):
+                    self.con.execute(
+                        'SELECT count(*) FROM roads r1 CROSS JOIN roads r2'
+                    ).fetchall()
+            with profile.phase('find_widgets'):
+                pass
+            profile.set_widget_counts(lambda: {'widgets': 3})
+        self.assertEqual(
+            [phase.name for phase in profile.phases],
+            ['load_data', 'find_widgets']
+        )
+        load_data = profile.phases[0]
+        if hasattr(self.con, 'set_trace_callback'):
+            self.assertEqual(load_data.statements, 50)
+        else:
+            self.assertIsNone(load_data.statements)
+        self.assertGreater(load_data.vm_steps, 0)
+        self.assertIn('3 widgets', profile.summary())
+
+    def test_histogram(self):
+        """Test rolling histogram of open times."""
+        profiler = form_profiler.FormProfiler(history_size=3)
+        for seconds in (0.01, 0.03, 0.03, 5.0):
+            profile = form_profiler.FormOpenProfile('roads')
+            profile.seconds = seconds
+            profiler.record(profile)
+        histogram = dict(profiler.histogram('roads'))
+        self.assertEqual(histogram['< 25 ms'], 0)
+        self.assertEqual(histogram['< 50 ms'], 2)
+        self.assertEqual(histogram['>= 1600 ms'], 1)
+        self.assertEqual(profiler.percentile('roads', 50), 0.03)
+        self.assertIn('roads: 3 opens', profiler.format_histogram())
+
+    def test_cprofile_slow_open(self):
+        """Test that only a slow open is dumped, then cProfile is disarmed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.profiler.profile_next_slow_open(3600, tmpdir)
+            with self.profiler.open('roads') as profile:
+                pass
+            self.assertIsNone(profile.cprofile_file)
+            self.assertTrue(self.profiler.cprofile_armed)
+
+            self.profiler.profile_next_slow_open(0, tmpdir)
+            with self.profiler.open('roads') as profile:
+                pass
+            self.assertTrue(os.path.exists(profile.cprofile_file))
+            self.assertFalse(self.profiler.cprofile_armed)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_disabled(self):
+        """Test that nothing is recorded when profiling is disabled."""
+        with form_profiler.profile_open('roads') as profile:
+            with profile.phase('create', [self.con]):
+                pass
+        self.assertIsNone(profile.seconds)
+
+        profiler = form_profiler.enable_profiling()
+        with form_profiler.profile_open('roads') as profile:
+            pass
+        self.assertEqual(len(profiler.history['roads']), 1)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(FormProfilerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
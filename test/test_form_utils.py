@@ -0,0 +1,129 @@
+# coding=utf-8
+"""Form utilities test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from PyQt4 import QtCore, QtGui
+
+from AirviroOfflineEdb.form_utils import (
+    BaseFeatureForm, ConnectionRegistry, ValidationScheduler
+)
+
+from utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class Sender(QtCore.QObject):
+
+    changed = QtCore.pyqtSignal(int)
+
+
+class ConnectionRegistryTest(unittest.TestCase):
+    """Test signal connection registry."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.sender = Sender()
+        self.received = []
+
+    def test_disconnect_all(self):
+        """Test that only connections of the registry are removed."""
+        self.sender.changed.connect(self.received.append)
+        registry = ConnectionRegistry()
+        registry.connect(self.sender.changed, self.received.append)
+        self.sender.changed.emit(1)
+        self.assertEqual(self.received, [1, 1])
+
+        registry.disconnect_all()
+        self.assertEqual(len(registry), 0)
+        self.sender.changed.emit(2)
+        self.assertEqual(self.received, [1, 1, 2])
+
+    def test_no_accumulation(self):
+        """Test that handlers run once per event after forms are closed."""
+        for i in range(5):
+            registry = ConnectionRegistry()
+            registry.connect(self.sender.changed, self.received.append)
+            self.sender.changed.emit(i)
+            registry.disconnect_all()
+        self.assertEqual(self.received, range(5))
+
+    def test_disconnect(self):
+        """Test disconnecting a single connection."""
+        registry = ConnectionRegistry()
+        connection = registry.connect(
+            self.sender.changed, self.received.append
+        )
+        registry.disconnect(connection)
+        # disconnecting a disconnected signal is ignored
+        registry.connect(self.sender.changed, lambda value: None)
+        self.sender.changed.disconnect()
+        registry.disconnect_all()
+        self.sender.changed.emit(1)
+        self.assertEqual(self.received, [])
+
+
+class FakeLayer(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def source(self):
+        return "dbname='%s' table=\"roads\"" % self.filename
+
+
+class EmptyForm(BaseFeatureForm):
+
+    def find_widgets(self):
+        pass
+
+
+class BaseFeatureFormTest(unittest.TestCase):
+    """Test closing of feature forms."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        sqlite3.connect(self.filename).close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_close(self):
+        """Test that a closed form releases its connection and timer."""
+        dialog = QtGui.QDialog()
+        for i in range(3):
+            form = EmptyForm(dialog, FakeLayer(self.filename), None)
+            form.close()
+            self.assertRaises(
+                sqlite3.ProgrammingError, form.con.execute, 'SELECT 1'
+            )
+        self.assertEqual(dialog.findChildren(ValidationScheduler), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ConnectionRegistryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
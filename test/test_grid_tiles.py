@@ -0,0 +1,119 @@
+# coding=utf-8
+"""Tiled grid storage test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import sqlite3
+import struct
+import unittest
+
+import numpy as np
+
+from AirviroOfflineEdb.grid_tiles import (
+    GridTiles,
+    convert_grid_sources,
+    tiled_grids
+)
+
+
+def polygon_blob(minx, miny, maxx, maxy, srid=3006):
+    """Return SpatiaLite blob of a rectangle."""
+    coords = [
+        (minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy), (minx, miny)
+    ]
+    blob = struct.pack('<BBi4dB', 0, 1, srid, minx, miny, maxx, maxy, 0x7c)
+    blob += struct.pack('<iii', 3, 1, len(coords))
+    for x, y in coords:
+        blob += struct.pack('<2d', x, y)
+    return buffer(blob + struct.pack('<B', 0xfe))
+
+
+def create_grid_sources(con):
+    """Create grid sources with emissions as in an edb."""
+    con.executescript(
+        """
+        CREATE TABLE geometry_columns (
+          f_table_name TEXT, f_geometry_column TEXT, srid INTEGER
+        );
+        INSERT INTO geometry_columns VALUES ('grids', 'geom', 3006);
+        CREATE TABLE grids (id INTEGER PRIMARY KEY, geom BLOB);
+        CREATE TABLE grid_emission_view (
+          source INTEGER, substance INTEGER, emis REAL
+        );
+        """
+    )
+    con.executemany(
+        'INSERT INTO grids VALUES (?, ?)',
+        [
+            (2, polygon_blob(1000.0, 2000.0, 5000.0, 4050.0)),
+            (5, polygon_blob(0.0, 0.0, 100.0, 100.0))
+        ]
+    )
+    con.executemany(
+        'INSERT INTO grid_emission_view VALUES (?, ?, ?)',
+        [(2, 3, 120.0), (2, 25, 7.5), (5, 3, 1.0)]
+    )
+    con.commit()
+
+
+class GridTilesTest(unittest.TestCase):
+    """Test tiled grid storage."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = sqlite3.connect(':memory:')
+        self.array = np.zeros((70, 45), dtype=np.float32)
+        self.array[5:10, 3:40] = 2.5
+        self.array[65, 44] = 7
+        self.tiles = GridTiles.create(
+            self.con, 1, 70, 45, 1000.0, 2000.0, 100.0, 100.0, tile_size=16
+        )
+        self.tiles.write_array(3, self.array)
+
+    def test_sparse_storage(self):
+        """Test that empty tiles are not stored."""
+        self.assertEqual(tiled_grids(self.con), [1])
+        self.assertEqual(self.tiles.bands(), [3])
+        ntiles = self.con.execute('SELECT count(*) FROM grid_tiles').fetchone()
+        self.assertEqual(ntiles[0], 4)
+
+    def test_read(self):
+        """Test that tiles read back into the original array."""
+        np.testing.assert_array_equal(
+            self.tiles.read_tile(3, 4, 2), self.array[64:70, 32:45]
+        )
+        self.assertAlmostEqual(self.tiles.total(3), self.array.sum())
+        array = self.tiles.to_memmap(3)
+        np.testing.assert_array_equal(array, self.array)
+        os.remove(array.filename)
+
+    def test_convert_grid_sources(self):
+        """Test that grid sources are converted to tiles keeping totals."""
+        create_grid_sources(self.con)
+        self.assertEqual(convert_grid_sources(self.con, 100.0), [2, 5])
+        self.assertEqual(tiled_grids(self.con), [1, 2, 5])
+        tiles = GridTiles(self.con, 2)
+        self.assertEqual((tiles.nrows, tiles.ncols), (21, 40))
+        self.assertEqual((tiles.x0, tiles.y0), (1000.0, 4050.0))
+        self.assertEqual(tiles.bands(), [3, 25])
+        self.assertAlmostEqual(tiles.total(3), 120.0, places=3)
+        self.assertAlmostEqual(tiles.total(25), 7.5, places=4)
+        self.assertEqual(GridTiles(self.con, 5).nrows, 1)
+        # grid sources already stored as tiles are not converted again
+        self.assertEqual(convert_grid_sources(self.con, 100.0), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GridTilesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
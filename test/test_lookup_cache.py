@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Lookup cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb.lookup_cache import LookupCache, register_query_lookup
+
+register_query_lookup(
+    'test_vehicles', ['road_vehicles'], 'SELECT id, name FROM road_vehicles'
+)
+
+
+class LookupCacheTest(unittest.TestCase):
+    """Test invalidation of cached lookups."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        self.con = sqlite3.connect(self.filename)
+        self.con.executescript(
+            """
+            CREATE TABLE road_vehicles (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE roads (id INTEGER PRIMARY KEY, name TEXT);
+            INSERT INTO road_vehicles VALUES (1, 'car');
+            """
+        )
+        self.cache = LookupCache(self.filename)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.cache.con.close()
+        self.con.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_unrelated_change(self):
+        """Test that lookup is kept when other tables change."""
+        rows = self.cache.get('test_vehicles')
+        with self.con:
+            self.con.execute("INSERT INTO roads VALUES (1, 'road')")
+        self.assertIs(self.cache.get('test_vehicles'), rows)
+
+    def test_table_change(self):
+        """Test that lookup is reloaded when its table changes."""
+        rows = self.cache.get('test_vehicles')
+        with self.con:
+            self.con.execute("UPDATE road_vehicles SET name='bus'")
+        rows = self.cache.get('test_vehicles')
+        self.assertEqual(rows[0]['name'], 'bus')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LookupCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
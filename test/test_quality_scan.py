@@ -0,0 +1,130 @@
+# coding=utf-8
+"""Quality scan test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import sqlite3
+import unittest
+
+from AirviroOfflineEdb import quality_scan
+
+
+def create_road_edb():
+    con = sqlite3.connect(':memory:')
+    con.executescript(
+        """
+        CREATE TABLE road_timevars (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE road_vehicles (
+          id INTEGER PRIMARY KEY, name TEXT, isheavy INTEGER,
+          istraffic INTEGER
+        );
+        CREATE TABLE roads (
+          id INTEGER PRIMARY KEY, name TEXT, vehicles INTEGER,
+          corrfactor REAL, nolanes INTEGER
+        );
+        CREATE TABLE road_vehicle_link (
+          road INTEGER REFERENCES roads(id),
+          vehicle INTEGER REFERENCES road_vehicles(id),
+          timevar INTEGER REFERENCES road_timevars(id),
+          fraction REAL
+        );
+        INSERT INTO road_timevars VALUES (1, 'STANDARD');
+        INSERT INTO road_vehicles VALUES (1, 'car', 0, 1);
+        INSERT INTO road_vehicles VALUES (2, 'truck', 1, 1);
+        INSERT INTO road_vehicles VALUES (3, 'bus', 1, 0);
+        """
+    )
+    con.executemany(
+        'INSERT INTO roads VALUES (?, ?, ?, ?, ?)',
+        [(i, 'road', 1000 + i, 1.0, 2) for i in range(1, 21)]
+    )
+    con.execute('UPDATE roads SET vehicles=150000 WHERE id=3')
+    con.execute('UPDATE roads SET corrfactor=7 WHERE id=4')
+    con.executemany(
+        'INSERT INTO road_vehicle_link VALUES (?, ?, ?, ?)',
+        [
+            (1, 1, 1, 90), (1, 2, 1, 10), (1, 3, 1, 5),
+            (2, 1, 1, 90), (2, 2, None, 5),
+            (5, 1, 9, 100)
+        ]
+    )
+    return con
+
+
+class QualityScanTest(unittest.TestCase):
+    """Test batch quality scan."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_road_edb()
+
+    def test_scan_table(self):
+        """Test rule violations and outliers."""
+        issues = quality_scan.scan_table(self.con, 'roads')
+        found = set((i.source, i.column, i.issue) for i in issues)
+        self.assertEqual(
+            found,
+            set([
+                (3, 'vehicles', 'statistical outlier'),
+                (4, 'corrfactor', 'outside range 0 - 5')
+            ])
+        )
+
+    def test_scan_non_numeric(self):
+        """Test that text in a numeric column is reported, not fatal."""
+        self.con.execute("UPDATE roads SET corrfactor='abc' WHERE id=5")
+        issues = [
+            i for i in quality_scan.scan_table(self.con, 'roads')
+            if i.source == 5
+        ]
+        self.assertEqual(len(issues), 1)
+        self.assertEqual(issues[0].column, 'corrfactor')
+
+        issues = quality_scan.scan_table(self.con, 'roads', rules=[])
+        self.assertIn(
+            (5, 'corrfactor', 'non-numeric value'),
+            set((i.source, i.column, i.issue) for i in issues)
+        )
+        self.assertIn(
+            ('roads', 5, 'corrfactor'),
+            set((i.table, i.source, i.column)
+                for i in quality_scan.scan_edb(self.con))
+        )
+
+    def test_scan_traffic_fractions(self):
+        """Test that non-traffic vehicles are excluded from sum."""
+        # no vehicles on road 3
+        self.con.executemany(
+            'INSERT INTO road_vehicle_link VALUES (?, ?, ?, ?)',
+            [(road, 1, 1, 100) for road in [4] + range(6, 21)]
+        )
+        issues = quality_scan.scan_traffic_fractions(self.con)
+        self.assertEqual(
+            [(i.source, i.value) for i in issues], [(2, 95.0), (3, 0.0)]
+        )
+        self.assertEqual(
+            issues[0].issue, 'has sum of all traffic vehicle 95.0 != 100 [%]'
+        )
+
+    def test_scan_timevars(self):
+        """Test missing and undefined timevars."""
+        issues = quality_scan.scan_timevars(self.con)
+        self.assertEqual(
+            sorted((i.table, i.source, i.value) for i in issues),
+            [('roads', 2, None), ('roads', 5, 9)]
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(QualityScanTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,94 @@
+# coding=utf-8
+"""Queries test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb import queries
+from test_quality_scan import create_road_edb
+
+
+class QueriesTest(unittest.TestCase):
+    """Test named statements and required indexes."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_road_edb()
+        queries._verified.clear()
+        queries._failed.clear()
+
+    def test_verify_indexes(self):
+        """Test that missing indexes are found and created."""
+        missing = queries.missing_indexes(self.con)
+        self.assertEqual(
+            [name for name, table, columns in missing],
+            ['road_vehicle_link_road_idx', 'road_vehicle_link_vehicle_idx']
+        )
+        self.assertEqual(
+            queries.verify_indexes(self.con, 'test.sqlite', create=False),
+            missing
+        )
+        self.assertEqual(queries.verify_indexes(self.con, 'test.sqlite'), [])
+        self.assertEqual(queries.missing_indexes(self.con), [])
+        plan = self.con.execute(
+            'EXPLAIN QUERY PLAN ' + queries.QUERIES['road_vehicles_on_road'],
+            {'road': 1}
+        ).fetchall()
+        self.assertIn('road_vehicle_link_road_idx', ' '.join(
+            unicode(row[-1]) for row in plan
+        ))
+
+    def test_verify_indexes_locked(self):
+        """Test that indexes are not created again in a locked edb."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'edb.sqlite')
+            con = sqlite3.connect(filename)
+            con.executescript(';'.join(self.con.iterdump()))
+            lock_con = sqlite3.connect(filename)
+            lock_con.isolation_level = None
+            lock_con.execute('BEGIN IMMEDIATE')
+            self.assertRaises(
+                sqlite3.OperationalError,
+                queries.verify_indexes, con, filename
+            )
+            self.assertEqual(len(queries.verify_indexes(con, filename)), 2)
+            self.assertEqual(
+                con.execute('PRAGMA busy_timeout').fetchone()[0], 5000
+            )
+            lock_con.execute('ROLLBACK')
+            lock_con.close()
+            con.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_execute(self):
+        """Test execution of named statement."""
+        rows = queries.execute(
+            self.con, 'road_vehicles_on_road', road=1
+        ).fetchall()
+        self.assertEqual(sorted(row[1] for row in rows), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(QueriesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
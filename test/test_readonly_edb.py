@@ -0,0 +1,103 @@
+# coding=utf-8
+"""Read-only edb connection test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb import readonly_edb
+from AirviroOfflineEdb.lookup_cache import get_lookup_cache
+from test_quality_scan import create_road_edb
+
+
+class ReadonlyEdbTest(unittest.TestCase):
+    """Test read-only connections to edb's."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        con = sqlite3.connect(self.filename)
+        con.executescript('\n'.join(create_road_edb().iterdump()))
+        con.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        readonly_edb.set_readonly(self.filename, False)
+        shutil.rmtree(self.tmpdir)
+
+    def test_connect_readonly(self):
+        """Test that read-only connections can read but not write."""
+        for immutable in (True, False):
+            con = readonly_edb.connect_readonly(self.filename, immutable)
+            self.assertEqual(
+                con.execute('SELECT count(*) FROM roads').fetchone()[0], 20
+            )
+            self.assertEqual(
+                con.execute('PRAGMA mmap_size').fetchone()[0],
+                readonly_edb.MMAP_SIZE
+            )
+            self.assertRaises(
+                sqlite3.OperationalError,
+                con.execute, 'DELETE FROM roads'
+            )
+            con.close()
+        self.assertRaises(
+            ValueError, readonly_edb.connect_readonly,
+            os.path.join(self.tmpdir, 'missing.sqlite')
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, 'missing.sqlite'))
+        )
+
+    def test_set_readonly(self):
+        """Test that shared objects are separate for viewing and editing."""
+        cache = get_lookup_cache(self.filename)
+        self.assertEqual(
+            cache.con.execute('PRAGMA query_only').fetchone()[0], 0
+        )
+
+        readonly_edb.set_readonly(self.filename)
+        self.assertTrue(readonly_edb.is_readonly(self.filename))
+        readonly_cache = get_lookup_cache(self.filename)
+        self.assertIsNot(readonly_cache, cache)
+        self.assertRaises(
+            sqlite3.OperationalError,
+            readonly_cache.con.execute, 'DELETE FROM roads'
+        )
+
+        readonly_edb.set_readonly(self.filename, False)
+        self.assertFalse(readonly_edb.is_readonly(self.filename))
+        self.assertIs(get_lookup_cache(self.filename), cache)
+
+    def test_readonly_access(self):
+        """Test description of the read-only access path taken."""
+        readonly_edb.set_readonly(self.filename, immutable=False)
+        access = readonly_edb.readonly_access(self.filename)
+        if readonly_edb.uri_filenames():
+            self.assertTrue(access.startswith('uri with mode=ro'))
+            readonly_edb.set_readonly(self.filename)
+            self.assertIn(
+                'without locks', readonly_edb.readonly_access(self.filename)
+            )
+        else:
+            self.assertIn('SQLITE_USE_URI', access)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ReadonlyEdbTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Road vehicles test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import sqlite3
+import unittest
+
+from AirviroOfflineEdb.queries import execute
+from AirviroOfflineEdb.road_vehicles import (
+    VehicleRow,
+    VehicleSums,
+    diff_vehicle_rows,
+    save_road_vehicles,
+    vehicle_rows
+)
+from test_quality_scan import create_road_edb
+
+
+class RoadVehiclesTest(unittest.TestCase):
+    """Test diff-based saving of road vehicles."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_road_edb()
+        self.con.row_factory = sqlite3.Row
+
+    def load(self, road):
+        return vehicle_rows(
+            execute(self.con, 'road_vehicles_on_road', road=road)
+        )
+
+    def test_diff(self):
+        """Test that only changed rows are written."""
+        loaded = [VehicleRow(1, 1, 90.0), VehicleRow(2, 1, 10.0)]
+        edited = [VehicleRow(1, 1, 90.0), VehicleRow(3, 1, 10.0)]
+        diff = diff_vehicle_rows(loaded, edited)
+        self.assertEqual(diff.insert, [VehicleRow(3, 1, 10.0)])
+        self.assertEqual(diff.update, [])
+        self.assertEqual(diff.delete, [2])
+
+    def test_duplicates(self):
+        """Test that duplicate loaded rows are replaced."""
+        loaded = [VehicleRow(1, 1, 50.0), VehicleRow(1, 1, 50.0)]
+        edited = [VehicleRow(1, 1, 100.0)]
+        diff = diff_vehicle_rows(loaded, edited)
+        self.assertEqual(diff.insert, edited)
+        self.assertEqual(diff.delete, [1])
+
+    def test_edited_duplicates(self):
+        """Test that a vehicle with several edited rows is not saved."""
+        loaded = self.load(1)
+        edited = [
+            VehicleRow(1, 1, 80.0), VehicleRow(2, 1, 10.0),
+            VehicleRow(2, 1, 10.0)
+        ]
+        self.assertRaises(
+            ValueError, save_road_vehicles, self.con, 1, loaded, edited
+        )
+        self.assertEqual(self.load(1), loaded)
+
+    def test_save(self):
+        """Test saving of edited rows."""
+        loaded = self.load(1)
+        edited = [
+            VehicleRow(1, 1, 80.0), VehicleRow(2, 1, 10.0),
+            VehicleRow(3, None, 5.0)
+        ]
+        diff = save_road_vehicles(self.con, 1, loaded, edited)
+        self.assertEqual(len(diff.update), 2)
+        self.assertEqual(sorted(self.load(1)), sorted(edited))
+
+    def test_sums(self):
+        """Test running sums and duplicate counts."""
+        sums = VehicleSums()
+        sums.add(1, 0, 1, 90.0)
+        sums.add(2, 1, 1, 10.0)
+        sums.add(3, 1, 0, 5.0)
+        self.assertAlmostEqual(sums.traffic, 100.0)
+        sums.change_fraction(0, 1, 90.0, 80.0)
+        self.assertAlmostEqual(sums.light_traffic, 80.0)
+        sums.add(2, 1, 1, 10.0)
+        self.assertEqual(sums.duplicates(), [2])
+        sums.remove(2, 1, 1, 10.0)
+        self.assertEqual(sums.duplicates(), [])
+        self.assertAlmostEqual(sums.traffic, 90.0)
+        self.assertEqual(sums.nrows, 3)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RoadVehiclesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Rsrc cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.cElementTree as ET
+
+from AirviroOfflineEdb import rsrc_cache
+
+
+class FakeCodeTree(object):
+
+    def __init__(self):
+        self.name = 'Municipalities'
+        self.root = ET.Element('root')
+        county = ET.SubElement(self.root, '14', name='County')
+        ET.SubElement(county, '80', name='City')
+
+    def depth(self):
+        return 2
+
+
+class FakeRsrc(object):
+
+    def __init__(self, path):
+        self.gc = [FakeCodeTree()]
+
+
+class RsrcCacheTest(unittest.TestCase):
+    """Test caching of parsed rsrc files."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ.pop('LOCALAPPDATA', None)
+        os.environ['XDG_CACHE_HOME'] = self.tmpdir
+        self.path = os.path.join(self.tmpdir, 'edb.rsrc')
+        with open(self.path, 'w') as rsrc_file:
+            rsrc_file.write('speed 1: 20\n')
+        self.nparsed = 0
+
+    def tearDown(self):
+        """Runs after each test."""
+        rsrc_cache._rsrc_cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, path):
+        self.nparsed += 1
+        return FakeRsrc(path)
+
+    def test_load_from_disk(self):
+        """Test that code trees are restored from disk cache."""
+        rsrc_cache.load_rsrc(self.path, self.parse)
+        rsrc_cache._rsrc_cache.clear()
+        rsrc = rsrc_cache.load_rsrc(self.path, self.parse)
+        self.assertEqual(self.nparsed, 1)
+        tree = rsrc.gc[0]
+        self.assertEqual(tree.name, 'Municipalities')
+        self.assertEqual(tree.depth(), 2)
+        self.assertEqual(
+            [node.attrib['name'] for node in tree.root.findall('14/*')],
+            ['City']
+        )
+
+    def test_children_index(self):
+        """Test index from code path to child codes."""
+        rsrc = rsrc_cache.load_rsrc(self.path, self.parse)
+        tree = rsrc.gc[0]
+        self.assertEqual(tree.children(), [('14', '14 County')])
+        self.assertEqual(tree.children(['14']), [('80', '80 City')])
+        self.assertEqual(tree.children(['14', '80']), [])
+        self.assertEqual(tree.children(['None']), [])
+
+    def test_reload_on_change(self):
+        """Test that a modified rsrc is parsed again."""
+        rsrc = rsrc_cache.load_rsrc(self.path, self.parse)
+        self.assertIs(rsrc_cache.load_rsrc(self.path, self.parse), rsrc)
+        with open(self.path, 'a') as rsrc_file:
+            rsrc_file.write('speed 2: 30\n')
+        rsrc_cache.load_rsrc(self.path, self.parse)
+        self.assertEqual(self.nparsed, 2)
+        self.assertEqual(len(os.listdir(rsrc_cache.cache_dir())), 1)
+
+    def test_non_ascii_path(self):
+        """Test cache file of an rsrc in a non-ascii directory."""
+        path = u'/data/v\xe4gar/edb.rsrc'
+        stamp = (1.0, 10)
+        filename = rsrc_cache.cache_filename(path, stamp)
+        self.assertEqual(
+            filename, rsrc_cache.cache_filename(path.encode('utf-8'), stamp)
+        )
+        self.assertNotEqual(
+            filename, rsrc_cache.cache_filename(u'/data/edb.rsrc', stamp)
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RsrcCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""Schema catalog test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import sqlite3
+import unittest
+from xml.dom import minidom
+
+from AirviroOfflineEdb import schema_catalog
+from AirviroOfflineEdb.lookup_cache import LOOKUPS
+
+
+def create_point_edb():
+    con = sqlite3.connect(':memory:')
+    con.executescript(
+        """
+        CREATE TABLE companies (id INTEGER PRIMARY KEY, name VARCHAR(20));
+        CREATE TABLE point_timevars (id INTEGER PRIMARY KEY, label TEXT);
+        CREATE TABLE points (
+          id INTEGER PRIMARY KEY,
+          name VARCHAR(47) NOT NULL,
+          height REAL NOT NULL DEFAULT 10,
+          company INTEGER REFERENCES companies(id),
+          timevar INTEGER REFERENCES point_timevars,
+          geom POINT
+        );
+        INSERT INTO companies VALUES (2, 'B company');
+        INSERT INTO companies VALUES (1, 'A company');
+        """
+    )
+    return con
+
+
+class SchemaCatalogTest(unittest.TestCase):
+    """Test form definitions derived from the schema."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = create_point_edb()
+
+    def test_read_form_fields(self):
+        """Test widget kinds, rules and references of fields."""
+        fields = schema_catalog.read_form_fields(self.con, 'points')
+        by_name = dict((field.name, field) for field in fields)
+        self.assertEqual(
+            [field.name for field in fields],
+            ['id', 'name', 'height', 'company', 'timevar']
+        )
+        self.assertEqual(by_name['id'].kind, schema_catalog.READ_ONLY)
+        self.assertEqual(by_name['name'].rule.max_len, 47)
+        self.assertTrue(by_name['name'].rule.required)
+        self.assertEqual(by_name['height'].rule.type, float)
+        self.assertFalse(by_name['height'].rule.required)
+        self.assertEqual(by_name['company'].kind, schema_catalog.REFERENCE)
+        self.assertEqual(by_name['company'].references, ('companies', 'id'))
+        self.assertEqual(
+            by_name['timevar'].references, ('point_timevars', 'id')
+        )
+
+    def test_reference_lookup(self):
+        """Test that reference lookups give rows ordered by label."""
+        fields = schema_catalog.read_form_fields(self.con, 'points')
+        company = [field for field in fields if field.name == 'company'][0]
+        tables, loader = LOOKUPS[company.lookup]
+        self.assertEqual(tables, ('companies',))
+        self.assertEqual(
+            [tuple(row) for row in loader(self.con)],
+            [(1, 'A company'), (2, 'B company')]
+        )
+
+    def test_form_ui(self):
+        """Test that the form ui has a widget named as each field."""
+        fields = schema_catalog.read_form_fields(self.con, 'points')
+        doc = minidom.parseString(schema_catalog.form_ui('points', fields))
+        widgets = dict(
+            (widget.getAttribute('name'), widget.getAttribute('class'))
+            for widget in doc.getElementsByTagName('widget')
+        )
+        for field in fields:
+            self.assertEqual(widgets[field.name], 'QLineEdit')
+        self.assertEqual(widgets['company_combo'], 'QComboBox')
+        self.assertEqual(widgets['form_validation_msg_label'], 'QLabel')
+        self.assertNotIn('geom', widgets)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SchemaCatalogTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
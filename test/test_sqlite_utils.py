@@ -0,0 +1,74 @@
+# coding=utf-8
+"""Sqlite utilities test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb.sqlite_utils import relation_in_db, transaction
+
+
+class SqliteUtilsTest(unittest.TestCase):
+    """Test sqlite helpers."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        self.con = sqlite3.connect(self.filename)
+        self.con.execute('CREATE TABLE roads (id INTEGER PRIMARY KEY)')
+        self.con.commit()
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.con.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_transaction_rollback(self):
+        """Test that statements before CREATE TABLE are rolled back."""
+        try:
+            with transaction(self.con):
+                self.con.execute('INSERT INTO roads VALUES (1)')
+                self.con.execute('CREATE TABLE report (id INTEGER)')
+                raise ValueError('failed')
+        except ValueError:
+            pass
+        self.assertEqual(
+            self.con.execute('SELECT count(*) FROM roads').fetchone()[0], 0
+        )
+        self.assertFalse(relation_in_db(self.con, 'report'))
+        self.assertEqual(self.con.isolation_level, '')
+
+    def test_transaction_commit(self):
+        """Test that other connections only see the whole transaction."""
+        other = sqlite3.connect(self.filename)
+        with transaction(self.con):
+            self.con.execute('INSERT INTO roads VALUES (1)')
+            self.con.execute('CREATE TABLE report (id INTEGER)')
+            self.con.execute('INSERT INTO roads VALUES (2)')
+            self.assertEqual(
+                other.execute('SELECT count(*) FROM roads').fetchone()[0], 0
+            )
+        self.assertEqual(
+            other.execute('SELECT count(*) FROM roads').fetchone()[0], 2
+        )
+        other.close()
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SqliteUtilsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
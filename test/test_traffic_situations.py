@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Traffic situations test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import sqlite3
+import unittest
+
+from AirviroOfflineEdb.traffic_situations import load_traffic_situations
+
+
+def create_situation_edb():
+    con = sqlite3.connect(':memory:')
+    con.executescript(
+        """
+        CREATE TABLE traffic_situation_col1 (id INTEGER PRIMARY KEY, label);
+        CREATE TABLE traffic_situation_col2 (id INTEGER PRIMARY KEY, label);
+        CREATE TABLE traffic_situations (
+          id INTEGER PRIMARY KEY, situation1 INTEGER, situation2 INTEGER,
+          situation3 INTEGER
+        );
+        INSERT INTO traffic_situation_col1 VALUES (1, 'Rural');
+        INSERT INTO traffic_situation_col1 VALUES (2, 'Urban');
+        INSERT INTO traffic_situation_col2 VALUES (1, '50 km/h');
+        INSERT INTO traffic_situation_col2 VALUES (2, '70 km/h');
+        INSERT INTO traffic_situations VALUES (10, 2, 2, NULL);
+        INSERT INTO traffic_situations VALUES (11, 2, 1, NULL);
+        INSERT INTO traffic_situations VALUES (12, 1, 2, NULL);
+        """
+    )
+    return con
+
+
+class TrafficSituationsTest(unittest.TestCase):
+    """Test traffic situation trie."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.situations = load_traffic_situations(create_situation_edb())
+
+    def test_children(self):
+        """Test filtering on leading indices."""
+        self.assertEqual(
+            self.situations.children(), [(1, 'Rural'), (2, 'Urban')]
+        )
+        self.assertEqual(
+            self.situations.children([2]), [(1, '50 km/h'), (2, '70 km/h')]
+        )
+        self.assertEqual(self.situations.children([1]), [(2, '70 km/h')])
+        self.assertEqual(self.situations.children([3]), [])
+
+    def test_lookup(self):
+        """Test id from indices and indices from id."""
+        self.assertEqual(self.situations.situation_id([2, 1]), 11)
+        self.assertEqual(self.situations.situation_id([1, 1]), None)
+        self.assertEqual(self.situations.indices(12), (1, 2))
+        self.assertEqual(self.situations.indices(99), None)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TrafficSituationsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
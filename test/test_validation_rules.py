@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Validation rules test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import unittest
+
+from AirviroOfflineEdb.validation_rules import (
+    RULES,
+    Rule,
+    check_table,
+    compile_array_check,
+    compile_value_check
+)
+from test_quality_scan import create_road_edb
+
+
+class ValidationRulesTest(unittest.TestCase):
+    """Test compilation of validation rules."""
+
+    def test_value_and_array_checks_agree(self):
+        """Test that form and bulk checks give the same messages."""
+        rule = Rule('nolanes', int, required=True, min=1, max=8)
+        values = ['2', '', 'two', '2.5', '9']
+        value_check = compile_value_check(rule)
+        self.assertEqual(
+            [value_check(value) for value in values],
+            [None, 'may not be empty', 'is non-numeric',
+             'should be an integer', 'outside range 1 - 8']
+        )
+        self.assertEqual(
+            compile_array_check(rule)([2, None, 'two', 2.5, 9]),
+            [(i, value_check(value)) for i, value in enumerate(values)][1:]
+        )
+
+    def test_same_parsing(self):
+        """Test that form and bulk checks parse all values the same way."""
+        values = [
+            None, '', ' ', '3', '3.0', 3, 3.0, ' 3 ', '3.5', 3.5, '1e2',
+            'abc', 'nan', 'inf', float('nan'), '-1', 0, '4 5', 'x' * 48
+        ]
+        for rule in RULES['roads']:
+            value_check = compile_value_check(rule)
+            expected = [
+                (i, value_check(None if value is None else unicode(value)))
+                for i, value in enumerate(values)
+            ]
+            self.assertEqual(
+                compile_array_check(rule)(values),
+                [(i, message) for i, message in expected
+                 if message is not None],
+                rule.column
+            )
+        rule = Rule('nolanes', int, min=1, max=8)
+        self.assertIsNone(compile_value_check(rule)('3.0'))
+
+    def test_check_table(self):
+        """Test rules on all rows of a table."""
+        con = create_road_edb()
+        self.assertEqual(
+            check_table(con, 'roads'),
+            [(4, 'corrfactor', 'outside range 0 - 5', 7.0)]
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ValidationRulesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,109 @@
+# coding=utf-8
+"""Headless validation runner test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb import validation_runner
+from test_quality_scan import create_road_edb
+
+
+class ValidationRunnerTest(unittest.TestCase):
+    """Test validation of whole tables."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        mem_con = create_road_edb()
+        # duplicate vehicle on road 6, no vehicles on road 3
+        mem_con.executemany(
+            'INSERT INTO road_vehicle_link VALUES (?, ?, ?, ?)',
+            [(6, 1, 1, 50), (6, 1, 1, 50)] +
+            [(road, 1, 1, 100) for road in [4] + range(7, 21)]
+        )
+        con = sqlite3.connect(self.filename)
+        con.executescript('\n'.join(mem_con.iterdump()))
+        con.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_check_vehicle_compositions(self):
+        """Test set-based checks of vehicle compositions."""
+        con = sqlite3.connect(self.filename)
+        issues = validation_runner.check_vehicle_compositions(con)
+        self.assertEqual([issue[0] for issue in issues], [2, 3, 6])
+        self.assertEqual(
+            issues[0][2], 'has sum of all traffic vehicle 95.0 != 100 [%]'
+        )
+        self.assertEqual(
+            issues[1][2], 'has sum of all traffic vehicle 0.0 != 100 [%]'
+        )
+        self.assertEqual(
+            issues[2][2], 'has duplicate rows for vehicle car in table'
+        )
+        self.assertEqual(
+            validation_runner.check_vehicle_compositions(con, 3, 20),
+            issues[1:]
+        )
+
+    def read_report(self):
+        con = sqlite3.connect(self.filename)
+        report = con.execute(
+            'SELECT source, "column" FROM validation_report ORDER BY source'
+        ).fetchall()
+        summary = con.execute(
+            'SELECT id, nissues FROM roads_validation ORDER BY id'
+        ).fetchall()
+        con.close()
+        return report, summary
+
+    def test_run_validation(self):
+        """Test report of validation in the current process."""
+        nissues = validation_runner.run_validation(self.filename, processes=1)
+        self.assertEqual(nissues, {'roads': 4})
+        # the connection used for the validation is closed
+        self.assertIsNone(validation_runner._worker_con)
+        report, summary = self.read_report()
+        self.assertEqual(
+            report,
+            [(2, 'vehicle_table'), (3, 'vehicle_table'), (4, 'corrfactor'),
+             (6, 'vehicle_table')]
+        )
+        self.assertEqual(summary, [(2, 1), (3, 1), (4, 1), (6, 1)])
+
+    def test_run_validation_parallel(self):
+        """Test that parallel validation gives the same report."""
+        validation_runner.run_validation(self.filename, processes=1)
+        expected = self.read_report()
+        validation_runner.run_validation(self.filename, processes=2)
+        self.assertEqual(self.read_report(), expected)
+
+    def test_unknown_table(self):
+        """Test that tables without rules are rejected."""
+        self.assertRaises(
+            ValueError,
+            validation_runner.run_validation, self.filename, ['road_vehicles']
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ValidationRunnerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,85 @@
+# coding=utf-8
+"""Vehicle table model test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import unittest
+
+from PyQt4 import QtCore
+
+from AirviroOfflineEdb.road_vehicles import VehicleRow
+from AirviroOfflineEdb.vehicle_table import (
+    VehicleTableModel,
+    FRACTION_COL,
+    ISHEAVY_COL,
+    TIMEVAR_COL
+)
+
+from utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+VEHICLES = [
+    {'id': 1, 'name': 'car', 'isheavy': 0, 'istraffic': 1},
+    {'id': 2, 'name': 'truck', 'isheavy': 1, 'istraffic': 1}
+]
+TIMEVARS = [{'id': 1, 'name': 'STANDARD'}, {'id': 2, 'name': 'NIGHT'}]
+
+
+class VehicleTableModelTest(unittest.TestCase):
+    """Test vehicle table model."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.model = VehicleTableModel(VEHICLES, TIMEVARS)
+        self.model.set_rows([{'vehicle': 2, 'timevar': 2, 'fraction': 10.0}])
+
+    def test_data(self):
+        """Test display of looked up names."""
+        self.assertEqual(
+            self.model.data(self.model.index(0, TIMEVAR_COL)), 'NIGHT'
+        )
+        self.assertEqual(
+            self.model.data(self.model.index(0, ISHEAVY_COL)), 'Heavy'
+        )
+
+    def test_edit(self):
+        """Test adding, editing and removing rows."""
+        self.model.add_row(1)
+        self.assertTrue(self.model.setData(
+            self.model.index(1, FRACTION_COL), 90.0, QtCore.Qt.EditRole
+        ))
+        self.assertEqual(
+            self.model.vehicle_rows(),
+            [VehicleRow(2, 2, 10.0), VehicleRow(1, 1, 90.0)]
+        )
+        self.model.remove_rows([0])
+        self.assertEqual(self.model.vehicle_rows(), [VehicleRow(1, 1, 90.0)])
+
+    def test_null_fraction_and_unknown_vehicle(self):
+        """Test loading a NULL fraction and a vehicle missing in lookup."""
+        self.model.set_rows([
+            {'vehicle': 1, 'timevar': 1, 'fraction': None},
+            {'vehicle': 9, 'timevar': 1, 'fraction': 20.0}
+        ])
+        self.assertEqual(self.model.vehicle_rows()[0], VehicleRow(1, 1, 0.0))
+        self.assertEqual(self.model.sums.traffic, 0.0)
+        self.assertEqual(self.model.unknown_vehicles(), [9])
+        self.assertEqual(
+            self.model.data(self.model.index(1, ISHEAVY_COL)), ''
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(VehicleTableModelTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,174 @@
+# coding=utf-8
+"""Working copy test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'david.segersson@smhi.se'
+__date__ = '2015-11-10'
+__copyright__ = 'Copyright 2015, David Segersson'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from AirviroOfflineEdb.working_copy import (
+    WorkingCopy,
+    WriteBackConflict,
+    source_filename
+)
+from test_quality_scan import create_road_edb
+
+
+def rows(filename, table):
+    con = sqlite3.connect(filename)
+    try:
+        return con.execute(
+            'SELECT rowid, * FROM %s ORDER BY rowid' % table
+        ).fetchall()
+    finally:
+        con.close()
+
+
+class WorkingCopyTest(unittest.TestCase):
+    """Test editing a working copy and writing back changes."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'edb.sqlite')
+        self.copy_dir = os.path.join(self.tmpdir, 'copies')
+        con = sqlite3.connect(self.filename)
+        con.executescript('\n'.join(create_road_edb().iterdump()))
+        con.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def edit_copy(self, path):
+        con = sqlite3.connect(path)
+        with con:
+            con.execute('UPDATE roads SET vehicles = 1 WHERE id = 3')
+            con.execute('DELETE FROM road_vehicle_link WHERE road = 5')
+            con.execute(
+                'INSERT INTO road_vehicle_link VALUES (7, 1, 1, 100)'
+            )
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS road_emissions (source, emis)'
+            )
+            con.execute('INSERT INTO road_emissions VALUES (3, 1.5)')
+        con.close()
+
+    def test_write_back(self):
+        """Test that only changed rows are written back."""
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        self.assertEqual(copy.open(), 0)
+        self.assertEqual(
+            rows(copy.path, 'roads'), rows(self.filename, 'roads')
+        )
+        self.edit_copy(copy.path)
+        # the inserted link reuses the rowid of the deleted link, the new
+        # emission table is tracked on write-back
+        self.assertEqual(copy.pending(), 2)
+
+        self.assertEqual(copy.write_back(), 3)
+        self.assertEqual(copy.pending(), 0)
+        self.assertEqual(copy.write_back(), 0)
+        for table in ('roads', 'road_vehicle_link', 'road_emissions'):
+            self.assertEqual(
+                rows(copy.path, table), rows(self.filename, table)
+            )
+        self.assertEqual(rows(self.filename, 'roads')[2][3], 1)
+
+        # sidecar files are looked up next to the original
+        self.assertEqual(source_filename(copy.path), self.filename)
+        copy.close()
+        self.assertEqual(source_filename(copy.path), copy.path)
+
+    def test_write_back_conflict(self):
+        """Test that changes of others to the original are not overwritten."""
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        copy.open()
+        self.edit_copy(copy.path)
+        con = sqlite3.connect(self.filename)
+        with con:
+            con.execute('UPDATE roads SET vehicles = 2 WHERE id = 3')
+        con.close()
+        self.assertRaises(WriteBackConflict, copy.write_back)
+        self.assertEqual(rows(self.filename, 'roads')[2][3], 2)
+        self.assertEqual(copy.pending(), 3)
+        copy.close(write_back=False)
+
+    def test_recreated_table(self):
+        """Test that a table created again in the copy is replaced."""
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        copy.open()
+        con = sqlite3.connect(copy.path)
+        con.executescript(
+            """
+            DROP TABLE road_vehicle_link;
+            CREATE TABLE road_vehicle_link (
+              road INTEGER, vehicle INTEGER, timevar INTEGER, fraction REAL
+            );
+            INSERT INTO road_vehicle_link VALUES (7, 1, 1, 100);
+            """
+        )
+        con.close()
+        self.assertEqual(copy.write_back(), 1)
+        self.assertEqual(
+            rows(self.filename, 'road_vehicle_link'), [(1, 7, 1, 1, 100.0)]
+        )
+
+        # later edits are written back row by row again
+        con = sqlite3.connect(copy.path)
+        with con:
+            con.execute('INSERT INTO road_vehicle_link VALUES (8, 1, 1, 100)')
+        con.close()
+        self.assertEqual(copy.pending(), 1)
+        self.assertEqual(copy.write_back(), 1)
+        self.assertEqual(
+            rows(copy.path, 'road_vehicle_link'),
+            rows(self.filename, 'road_vehicle_link')
+        )
+        copy.close()
+
+    def test_resume(self):
+        """Test resuming a copy with changes not written back."""
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        copy.open()
+        self.edit_copy(copy.path)
+        copy.close(write_back=False)
+
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        self.assertEqual(copy.open(), 3)
+        copy.close()
+        self.assertEqual(
+            rows(copy.path, 'road_vehicle_link'),
+            rows(self.filename, 'road_vehicle_link')
+        )
+
+        # conflict if the original was modified after the last write-back
+        copy = WorkingCopy(self.filename, self.copy_dir)
+        copy.open()
+        self.edit_copy(copy.path)
+        copy.close(write_back=False)
+        con = sqlite3.connect(self.filename)
+        with con:
+            con.execute('UPDATE roads SET vehicles = 2 WHERE id = 4')
+        con.close()
+        self.assertRaises(
+            ValueError, WorkingCopy(self.filename, self.copy_dir).open
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(WorkingCopyTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
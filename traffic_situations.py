@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of the traffic situations of an edb.
+
+A traffic situation is identified by one index per dimension
+(situation1..N in table traffic_situations), each index referring to a
+label in table traffic_situation_col<N>. The rows are read once into a
+prefix trie, which gives the valid indices of the next dimension for any
+combination of previous indices, the id of a complete combination and the
+indices of a given id without querying the edb.
+
+The trie is registered as lookup 'traffic_situations' and is shared by
+all forms of an edb through the lookup cache.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from collections import OrderedDict
+
+from AirviroOfflineEdb.lookup_cache import register_lookup
+from AirviroOfflineEdb.queries import situation_columns
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+
+# maximum number of traffic situation dimensions
+MAX_SITUATION_COLS = 6
+
+SITUATION_TABLES = (
+    ['traffic_situations', 'traffic_situation_columns'] +
+    ['traffic_situation_col%i' % i for i in range(1, MAX_SITUATION_COLS + 1)]
+)
+
+
+class TrieNode(object):
+
+    __slots__ = ('children', 'id')
+
+    def __init__(self):
+        self.children = OrderedDict()
+        self.id = None
+
+
+class TrafficSituations(object):
+
+    """Prefix trie over the index combinations of traffic situations."""
+
+    def __init__(self, rows, labels):
+        """Build trie.
+
+        @param rows: sequence of (id, situation1, ..., situationN)
+        @param labels: list with a dict {index: label} per dimension
+        """
+        self.labels = labels
+        self.root = TrieNode()
+        self._indices = {}
+        for row in rows:
+            ts_id = row[0]
+            indices = []
+            for index in row[1:]:
+                if index is None:
+                    break
+                indices.append(index)
+            node = self.root
+            for index in indices:
+                node = node.children.setdefault(index, TrieNode())
+            node.id = ts_id
+            self._indices[ts_id] = tuple(indices)
+        self._sort(self.root, 0)
+
+    def _sort(self, node, level):
+        """Order children as the labels of the dimension."""
+        if level < len(self.labels):
+            order = dict(
+                (index, i) for i, index in enumerate(self.labels[level])
+            )
+            node.children = OrderedDict(sorted(
+                node.children.iteritems(),
+                key=lambda item: (order.get(item[0], len(order)), item[0])
+            ))
+        for child in node.children.itervalues():
+            self._sort(child, level + 1)
+
+    def _find(self, indices):
+        node = self.root
+        for index in indices:
+            node = node.children.get(index)
+            if node is None:
+                return None
+        return node
+
+    def children(self, indices=()):
+        """Return (index, label) valid after the given leading indices."""
+        node = self._find(indices)
+        if node is None:
+            return []
+        level = len(indices)
+        labels = self.labels[level] if level < len(self.labels) else {}
+        return [
+            (index, labels.get(index, unicode(index)))
+            for index in node.children
+        ]
+
+    def situation_id(self, indices):
+        """Return id of the traffic situation with given indices, or None."""
+        node = self._find(indices)
+        if node is None:
+            return None
+        return node.id
+
+    def indices(self, ts_id):
+        """Return indices of a traffic situation id, or None."""
+        return self._indices.get(ts_id)
+
+
+def load_traffic_situations(con):
+    """Read traffic situations and dimension labels of an edb."""
+    if not relation_in_db(con, 'traffic_situations'):
+        return TrafficSituations([], [])
+    columns = situation_columns(con)
+
+    labels = []
+    for col in range(1, len(columns) + 1):
+        table = 'traffic_situation_col%i' % col
+        if not relation_in_db(con, table):
+            break
+        labels.append(OrderedDict(
+            (row[0], row[1]) for row in con.execute(
+                'SELECT id, label FROM %s ORDER BY id' % table
+            )
+        ))
+
+    rows = con.execute(
+        'SELECT id, %s FROM traffic_situations' % ', '.join(columns)
+    ).fetchall()
+    return TrafficSituations(rows, labels)
+
+
+register_lookup(
+    'traffic_situations', SITUATION_TABLES, load_traffic_situations
+)
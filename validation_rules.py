@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Declarative validation rules for edb tables.
+
+Rules are defined once per table and column in RULES and compiled into
+
+- value checks, validating the text of a form widget, and
+- array checks, validating a whole column loaded into an array.
+
+Both parse values with is_empty and to_number and give the same
+messages, so a value rejected in a form is reported with the same message
+when scanning all rows of a layer.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import math
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+
+class Rule(namedtuple(
+        'Rule', 'column type required min max max_len')):
+
+    """Validation rule of a column.
+
+    type is one of float, int, unicode or 'int list' (space separated
+    integers, e.g. building heights).
+    """
+
+    def __new__(cls, column, type=float, required=False, min=None, max=None,
+                max_len=None):
+        return super(Rule, cls).__new__(
+            cls, column, type, required, min, max, max_len
+        )
+
+
+RULES = {
+    'roads': [
+        Rule('corrfactor', float, required=True, min=0, max=5.0),
+        Rule('name', unicode, required=True, max_len=47),
+        Rule('vehicles', int, required=True, min=0, max=200000),
+        Rule('nolanes', int, min=1, max=8),
+        Rule('width', float, min=3, max=60),
+        Rule('disthouses', float, min=3, max=1000),
+        Rule('height', 'int list'),
+    ]
+}
+
+TYPE_NAMES = {float: 'a number', int: 'an integer'}
+
+# compiled value checks per table, see value_checks
+_value_checks = {}
+
+
+def range_message(rule):
+    return 'outside range %g - %g' % (rule.min, rule.max)
+
+
+def is_empty(value):
+    """Return True for None and blank text."""
+    return value is None or len(unicode(value).strip()) == 0
+
+
+def to_number(value):
+    """Return value as a finite float, raise ValueError if not numeric."""
+    try:
+        number = float(value)
+    except TypeError:
+        raise ValueError('%r is non-numeric' % (value,))
+    if math.isnan(number) or math.isinf(number):
+        raise ValueError('%r is non-numeric' % (value,))
+    return number
+
+
+def compile_value_check(rule):
+    """Compile rule into a function check(text) returning message or None."""
+    numeric = rule.type in (float, int)
+    has_range = rule.min is not None and rule.max is not None
+
+    def check(text):
+        if is_empty(text):
+            if rule.required:
+                return 'may not be empty'
+            return None
+
+        if numeric:
+            try:
+                value = to_number(text)
+            except ValueError:
+                return 'is non-numeric'
+            if rule.type is int and value != math.floor(value):
+                return 'should be %s' % TYPE_NAMES[int]
+            if has_range and (value < rule.min or value > rule.max):
+                return range_message(rule)
+        elif rule.type == 'int list':
+            try:
+                map(int, unicode(text).split())
+            except ValueError:
+                return 'value is not a list of integers'
+        elif rule.max_len is not None and len(unicode(text)) > rule.max_len:
+            return 'more than %i characters' % rule.max_len
+        return None
+
+    return check
+
+
+def value_checks(table):
+    """Return {column: check} with compiled value checks of a table."""
+    if table not in _value_checks:
+        _value_checks[table] = OrderedDict(
+            (rule.column, compile_value_check(rule))
+            for rule in RULES.get(table, [])
+        )
+    return _value_checks[table]
+
+
+def compile_array_check(rule):
+    """Compile rule into a function check(values) for a whole column.
+
+    values is a sequence of column values as read from sqlite. The check
+    returns a list of (index, message).
+    """
+    numeric = rule.type in (float, int)
+
+    def check_numeric(values):
+        values = np.asarray(values, dtype=object)
+        missing = np.array([is_empty(v) for v in values], dtype=bool)
+        numbers = np.full(len(values), np.nan)
+        non_numeric = np.zeros(len(values), dtype=bool)
+        for i in np.flatnonzero(~missing):
+            try:
+                numbers[i] = to_number(values[i])
+            except ValueError:
+                non_numeric[i] = True
+        messages = []
+        if rule.required:
+            messages.append((missing, 'may not be empty'))
+        messages.append((non_numeric, 'is non-numeric'))
+        valid = ~missing & ~non_numeric
+        with np.errstate(invalid='ignore'):
+            if rule.type is int:
+                messages.append((
+                    valid & (numbers != np.floor(numbers)),
+                    'should be %s' % TYPE_NAMES[int]
+                ))
+            if rule.min is not None and rule.max is not None:
+                messages.append((
+                    valid & ((numbers < rule.min) | (numbers > rule.max)),
+                    range_message(rule)
+                ))
+        return first_messages(len(values), messages)
+
+    def check_text(values):
+        value_check = compile_value_check(rule)
+        return [
+            (i, message) for i, message in
+            enumerate(value_check(value) for value in values)
+            if message is not None
+        ]
+
+    if numeric:
+        return check_numeric
+    return check_text
+
+
+def first_messages(nvalues, messages):
+    """Return (index, message) with the first failing check per value."""
+    reported = np.zeros(nvalues, dtype=bool)
+    result = []
+    for mask, message in messages:
+        mask = mask & ~reported
+        result += [(int(i), message) for i in np.flatnonzero(mask)]
+        reported |= mask
+    return sorted(result)
+
+
+def check_table(con, table, rules=None, first=None, last=None):
+    """Check all rows of a table, return list of (id, column, message, value).
+
+    Only rules for existing columns are checked. The check can be limited
+    to an inclusive range of id's with first and last.
+    """
+    rules = rules if rules is not None else RULES.get(table, [])
+    existing = set(
+        row[1] for row in con.execute('PRAGMA table_info(%s)' % table)
+    )
+    rules = [rule for rule in rules if rule.column in existing]
+    if len(rules) == 0:
+        return []
+    query = 'SELECT id, %s FROM %s' % (
+        ', '.join('"%s"' % rule.column for rule in rules), table
+    )
+    params = []
+    if first is not None and last is not None:
+        query += ' WHERE id BETWEEN ? AND ?'
+        params = [first, last]
+    rows = con.execute(query + ' ORDER BY id', params).fetchall()
+    if len(rows) == 0:
+        return []
+    ids = [row[0] for row in rows]
+    result = []
+    for col_index, rule in enumerate(rules, 1):
+        values = [row[col_index] for row in rows]
+        for i, message in compile_array_check(rule)(values):
+            result.append((ids[i], rule.column, message, values[i]))
+    return result
+
+
+# allowed deviation of the traffic vehicle fractions of a road from 100 %
+TRAFFIC_SUM_TOLERANCE = 0.01
+
+
+def duplicate_vehicle_message(name):
+    return 'has duplicate rows for vehicle %s in table' % name
+
+
+def unknown_vehicle_message(vehicle):
+    return 'has vehicle %s, which is not in road_vehicles' % vehicle
+
+
+def traffic_sum_message(total):
+    return 'has sum of all traffic vehicle {f} != 100 [%]'.format(f=total)
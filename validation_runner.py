@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Validation of whole edb tables, optionally in parallel.
+
+All rows of a table are checked with the same rules as the feature forms
+(see validation_rules). For roads, the vehicle compositions are checked
+as in the vehicle table of the road form, using set-based SQL over
+road_vehicle_link instead of one query per road. The work is partitioned
+by table and ranges of id's and distributed over a pool of processes,
+each reading the edb through its own read-only connection.
+
+The result is written to the edb as
+
+- validation_report, with one row per issue, and
+- <table>_validation, with the number of issues and the messages per
+  feature, that can be joined to the layer of the table on id.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+from __future__ import division
+
+import multiprocessing
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.emission_calc import (
+    CHUNKS_PER_PROCESS,
+    id_ranges,
+    set_python_executable
+)
+from AirviroOfflineEdb.readonly_edb import connect_readonly
+from AirviroOfflineEdb.sqlite_utils import relation_in_db, transaction
+from AirviroOfflineEdb.validation_rules import (
+    RULES,
+    TRAFFIC_SUM_TOLERANCE,
+    check_table,
+    duplicate_vehicle_message,
+    traffic_sum_message
+)
+
+REPORT_TABLE = 'validation_report'
+
+# column name used for issues of the vehicle composition of a road
+VEHICLE_TABLE_COLUMN = 'vehicle_table'
+
+# connection of the current worker process, see _init_worker
+_worker_con = None
+
+
+def summary_table(table):
+    """Return name of the joinable validation summary of a table."""
+    return '%s_validation' % table
+
+
+def check_vehicle_compositions(con, first=None, last=None):
+    """Check vehicle compositions of roads, optionally in an id-range.
+
+    Returns a list of (road, column, message, value) for roads with
+    duplicate vehicles or a sum of traffic vehicle fractions != 100 %.
+    Roads without vehicles have the sum 0. Vehicles missing in
+    road_vehicles are not counted as traffic, as in the road form.
+    """
+    where = ''
+    params = []
+    if first is not None and last is not None:
+        where = 'WHERE l.road BETWEEN ? AND ?'
+        params = [first, last]
+
+    issues = {}
+    for road, name in con.execute(
+            """
+            SELECT l.road, coalesce(v.name, l.vehicle)
+            FROM road_vehicle_link l
+            LEFT JOIN road_vehicles v ON v.id = l.vehicle
+            %s
+            GROUP BY l.road, l.vehicle
+            HAVING count(*) > 1
+            ORDER BY l.road, l.vehicle
+            """ % where, params):
+        issues.setdefault(road, (
+            road, VEHICLE_TABLE_COLUMN, duplicate_vehicle_message(name), name
+        ))
+
+    for road, total in con.execute(
+            """
+            SELECT r.id,
+              total(CASE WHEN v.istraffic THEN l.fraction ELSE 0 END)
+            FROM roads r
+            LEFT JOIN road_vehicle_link l ON l.road = r.id
+            LEFT JOIN road_vehicles v ON v.id = l.vehicle
+            %s
+            GROUP BY r.id
+            """ % where.replace('l.road', 'r.id'), params):
+        if road not in issues and \
+           abs(total - 100.0) > TRAFFIC_SUM_TOLERANCE:
+            issues[road] = (
+                road, VEHICLE_TABLE_COLUMN, traffic_sum_message(total), total
+            )
+    return [issues[road] for road in sorted(issues)]
+
+
+def check_range(con, table, first=None, last=None):
+    """Return issues (id, column, message, value) of a table or id-range."""
+    issues = check_table(con, table, first=first, last=last)
+    if table == 'roads' and relation_in_db(con, 'road_vehicle_link'):
+        issues += check_vehicle_compositions(con, first, last)
+    return issues
+
+
+def _init_worker(filename):
+    global _worker_con
+    # the edb may be edited while validating, it is not immutable
+    _worker_con = connect_readonly(filename, immutable=False)
+
+
+def _close_worker():
+    global _worker_con
+    if _worker_con is not None:
+        _worker_con.close()
+        _worker_con = None
+
+
+def _validate_task(task):
+    table, first, last = task
+    return table, check_range(_worker_con, table, first, last)
+
+
+def create_tasks(con, tables, processes):
+    """Partition the validation by table and id-range."""
+    tasks = []
+    for table in tables:
+        for first, last in id_ranges(
+                con, table, processes * CHUNKS_PER_PROCESS):
+            tasks.append((table, first, last))
+    return tasks
+
+
+def create_report_tables(con, tables):
+    """Create report and summary tables if not existing."""
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS main.%s (
+          source_table TEXT NOT NULL,
+          source INTEGER NOT NULL,
+          "column" TEXT,
+          message TEXT,
+          value TEXT
+        )
+        """ % REPORT_TABLE
+    )
+    for table in tables:
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS main.%s (
+              id INTEGER PRIMARY KEY,
+              nissues INTEGER NOT NULL,
+              messages TEXT
+            )
+            """ % summary_table(table)
+        )
+
+
+def write_report(con, tables):
+    """Write report and summary tables from the collected issues.
+
+    Issues are read from the attached database val. Missing tables are
+    created first, the rows of all tables are then replaced in a single
+    transaction, so other connections, e.g. layers joined on a summary
+    table, see either the previous or the new report.
+    """
+    create_report_tables(con, tables)
+    with transaction(con, 'BEGIN IMMEDIATE'):
+        con.execute('DELETE FROM main.%s' % REPORT_TABLE)
+        con.execute(
+            'INSERT INTO main.%s SELECT * FROM val.issues '
+            'ORDER BY source_table, source' % REPORT_TABLE
+        )
+        for table in tables:
+            summary = summary_table(table)
+            con.execute('DELETE FROM main.%s' % summary)
+            con.execute(
+                """
+                INSERT INTO main.%s (id, nissues, messages)
+                SELECT source, count(*),
+                  group_concat("column" || ' ' || message, '; ')
+                FROM val.issues
+                WHERE source_table = ?
+                GROUP BY source
+                """ % summary,
+                (table,)
+            )
+
+
+def run_validation(filename, tables=None, processes=None, progress=None):
+    """Validate tables of an edb and write the validation report.
+
+    @param filename: path to edb
+    @param tables: tables to validate, default is all tables with rules
+    that exist in the edb
+    @param processes: number of worker processes, 1 validates in the
+    current process, default is the number of cores
+    @param progress: optional callable progress(done, total)
+
+    Returns a dict with the number of issues per table.
+    """
+    con = sqlite3.connect(filename)
+    if tables is None:
+        tables = [
+            table for table in sorted(RULES) if relation_in_db(con, table)
+        ]
+    else:
+        for table in tables:
+            if table not in RULES:
+                raise ValueError('No validation rules for %s' % table)
+            if not relation_in_db(con, table):
+                raise ValueError('Table %s not found in edb' % table)
+
+    processes = processes or multiprocessing.cpu_count()
+    tasks = create_tasks(con, tables, processes)
+
+    # issues are collected in a temporary database, writing to the edb
+    # while the workers are reading would make them wait for locks
+    con.execute("ATTACH DATABASE '' AS val")
+    con.execute(
+        'CREATE TABLE val.issues '
+        '(source_table TEXT, source INTEGER, "column" TEXT, '
+        'message TEXT, value TEXT)'
+    )
+
+    if processes == 1:
+        _init_worker(filename)
+        results = (_validate_task(task) for task in tasks)
+        pool = None
+    else:
+        set_python_executable()
+        pool = multiprocessing.Pool(processes, _init_worker, (filename,))
+        results = pool.imap_unordered(_validate_task, tasks)
+
+    nissues = dict((table, 0) for table in tables)
+    try:
+        for done, (table, issues) in enumerate(results, 1):
+            con.executemany(
+                'INSERT INTO val.issues VALUES (?, ?, ?, ?, ?)',
+                ((table, source, column, message,
+                  None if value is None else unicode(value))
+                 for source, column, message, value in issues)
+            )
+            nissues[table] += len(issues)
+            if progress is not None:
+                progress(done, len(tasks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            _close_worker()
+
+    write_report(con, tables)
+    con.execute('DETACH DATABASE val')
+    con.close()
+    return nissues
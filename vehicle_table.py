@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Table model and delegate for the vehicle composition of a road.
+
+The rows of the model are compact [vehicle, timevar, fraction] lists,
+names and heavy/traffic flags are looked up from the vehicle and timevar
+lookups when displayed. Fraction sums and vehicle counts are kept in
+model.sums, updated by each edit. A single delegate is shared by all rows
+and only creates an editor, e.g. a timevar combo, for the cell being
+edited.
+"""
+
+from PyQt4 import QtCore, QtGui
+
+from AirviroOfflineEdb.road_vehicles import VehicleRow, VehicleSums
+
+VEHICLE_COL = 0
+TIMEVAR_COL = 1
+FRACTION_COL = 2
+ISHEAVY_COL = 3
+ISTRAFFIC_COL = 4
+
+HEADERS = ['Vehicle', 'Timevar', 'fraction [%]', 'Light/Heavy', 'Traffic']
+
+INACTIVE_COLOR = QtGui.QColor(100, 100, 100)
+
+
+class VehicleTableModel(QtCore.QAbstractTableModel):
+
+    """Vehicles on a road, with editable timevar and fraction."""
+
+    def __init__(self, vehicles, timevars, parent=None):
+        """Create model.
+
+        @param vehicles: rows with id, name, isheavy and istraffic
+        @param timevars: rows with id and name
+        """
+        super(VehicleTableModel, self).__init__(parent)
+        self.vehicles = dict(
+            (row['id'], (row['name'], row['isheavy'], row['istraffic']))
+            for row in vehicles
+        )
+        self.timevars = [(row['id'], row['name']) for row in timevars]
+        self.timevar_names = dict(self.timevars)
+        self.sums = VehicleSums()
+        self._rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and \
+           orientation == QtCore.Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def vehicle_meta(self, vehicle):
+        """Return (name, isheavy, istraffic) of a vehicle.
+
+        isheavy and istraffic are None for vehicles missing in the
+        lookup, which are not counted in any fraction sum, see
+        unknown_vehicles.
+        """
+        return self.vehicles.get(vehicle, (unicode(vehicle), None, None))
+
+    def unknown_vehicles(self):
+        """Return vehicles of rows that are missing in the lookup."""
+        return [row[0] for row in self._rows if row[0] not in self.vehicles]
+
+    def _add_to_sums(self, row):
+        name, isheavy, istraffic = self.vehicle_meta(row[0])
+        self.sums.add(row[0], isheavy, istraffic, row[2])
+
+    def _remove_from_sums(self, row):
+        name, isheavy, istraffic = self.vehicle_meta(row[0])
+        self.sums.remove(row[0], isheavy, istraffic, row[2])
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        vehicle, timevar, fraction = self._rows[index.row()]
+        col = index.column()
+        if role == QtCore.Qt.DisplayRole:
+            name, isheavy, istraffic = self.vehicle_meta(vehicle)
+            if col == VEHICLE_COL:
+                return name
+            elif col == TIMEVAR_COL:
+                return self.timevar_names.get(timevar, timevar)
+            elif col == FRACTION_COL:
+                return unicode(fraction)
+            elif col == ISHEAVY_COL:
+                if isheavy is None:
+                    return ''
+                return 'Heavy' if isheavy else 'Light'
+            elif col == ISTRAFFIC_COL:
+                if istraffic is None:
+                    return ''
+                return 'yes' if istraffic else 'no'
+        elif role in (QtCore.Qt.EditRole, QtCore.Qt.UserRole):
+            if col == VEHICLE_COL:
+                return vehicle
+            elif col == TIMEVAR_COL:
+                return timevar
+            elif col == FRACTION_COL:
+                return fraction
+            elif col == ISHEAVY_COL:
+                return self.vehicle_meta(vehicle)[1]
+            elif col == ISTRAFFIC_COL:
+                return self.vehicle_meta(vehicle)[2]
+        elif role == QtCore.Qt.ForegroundRole:
+            if col in (ISHEAVY_COL, ISTRAFFIC_COL):
+                return INACTIVE_COLOR
+        return None
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() in (TIMEVAR_COL, FRACTION_COL):
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        row = self._rows[index.row()]
+        if index.column() == TIMEVAR_COL:
+            row[1] = value
+        elif index.column() == FRACTION_COL:
+            try:
+                fraction = float(value)
+            except (TypeError, ValueError):
+                return False
+            name, isheavy, istraffic = self.vehicle_meta(row[0])
+            self.sums.change_fraction(isheavy, istraffic, row[2], fraction)
+            row[2] = fraction
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        return True
+
+    def set_rows(self, rows):
+        """Replace all rows, rows have vehicle, timevar and fraction.
+
+        A NULL fraction is shown and saved as 0.
+        """
+        self.beginResetModel()
+        self._rows = [
+            [row['vehicle'], row['timevar'], row['fraction'] or 0.0]
+            for row in rows
+        ]
+        self.sums.clear()
+        for row in self._rows:
+            self._add_to_sums(row)
+        self.endResetModel()
+
+    def add_row(self, vehicle, timevar=None, fraction=0.0):
+        if timevar is None and self.timevars:
+            timevar = self.timevars[0][0]
+        nrows = len(self._rows)
+        self.beginInsertRows(QtCore.QModelIndex(), nrows, nrows)
+        self._rows.append([vehicle, timevar, fraction])
+        self._add_to_sums(self._rows[-1])
+        self.endInsertRows()
+
+    def remove_rows(self, rows):
+        for row in sorted(set(rows), reverse=True):
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            self._remove_from_sums(self._rows[row])
+            del self._rows[row]
+            self.endRemoveRows()
+
+    def vehicle_rows(self):
+        """Return rows as VehicleRow."""
+        return [VehicleRow(*row) for row in self._rows]
+
+
+class VehicleDelegate(QtGui.QStyledItemDelegate):
+
+    """Delegate creating an editor for the edited cell only."""
+
+    def createEditor(self, parent, option, index):
+        if index.column() == FRACTION_COL:
+            spinbox = QtGui.QDoubleSpinBox(parent)
+            spinbox.setRange(0, 100)
+            spinbox.setDecimals(3)
+            return spinbox
+        if index.column() != TIMEVAR_COL:
+            return super(VehicleDelegate, self).createEditor(
+                parent, option, index
+            )
+        combo = QtGui.QComboBox(parent)
+        for timevar_id, name in index.model().timevars:
+            combo.addItem(name, timevar_id)
+        return combo
+
+    def setEditorData(self, editor, index):
+        if index.column() != TIMEVAR_COL:
+            return super(VehicleDelegate, self).setEditorData(editor, index)
+        editor.setCurrentIndex(
+            editor.findData(index.model().data(index, QtCore.Qt.EditRole))
+        )
+
+    def setModelData(self, editor, model, index):
+        if index.column() != TIMEVAR_COL:
+            return super(VehicleDelegate, self).setModelData(
+                editor, model, index
+            )
+        model.setData(index, editor.itemData(editor.currentIndex()))
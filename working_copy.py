@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""Local working copy of an edb with incremental write-back.
+
+Editing an edb on a network drive or a slow disk makes every commit
+slow. A WorkingCopy copies the edb to a local directory, where layers and
+forms edit it, and writes the changes back to the original edb on save
+or periodically.
+
+Changes are tracked by triggers in the copy, which log the rowid of each
+inserted, updated or deleted row in the table _wc_changes. The log is
+written in the same transaction as the edit, so it is never out of sync
+with the data. Tables created in the copy after it was opened, or
+dropped and created again, are instead replaced as a whole. write_back
+replaces the logged rows and tables in the original and clears the
+written part of the log in one transaction spanning both databases,
+which sqlite commits atomically through a super-journal. If QGIS
+crashes, at worst the same rows are written again.
+
+Changes are only written back if the original has not been modified
+since the copy was made or last written back, otherwise a conflict is
+reported instead of overwriting the changes of others. A copy with
+changes not yet written back is resumed when the edb is opened again,
+with the same check.
+
+This module does not depend on QGIS and can be used headless.
+"""
+
+import os
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from AirviroOfflineEdb.lookup_cache import file_stamp
+from AirviroOfflineEdb.rsrc_cache import path_digest
+from AirviroOfflineEdb.sqlite_utils import relation_in_db
+
+# table logging changed rows in the working copy
+CHANGES_TABLE = '_wc_changes'
+
+# table with the stamp of the original when last in sync with the copy,
+# and with the tables to replace as a whole
+META_TABLE = '_wc_meta'
+
+# key in META_TABLE of a table to replace as a whole
+REPLACE_KEY = 'replace %s'
+
+# original edb of each open working copy, path: filename
+_originals = {}
+
+# tables maintained by spatialite and sqlite, not tracked
+UNTRACKED_PREFIXES = (
+    '_wc_', 'sqlite_', 'idx_', 'geometry_columns', 'views_geometry_columns',
+    'virts_geometry_columns', 'spatial_ref_sys', 'spatialite_history',
+    'sql_statements_log', 'vector_layers', 'ElementaryGeometries',
+    'SpatialIndex', 'KNN'
+)
+
+TRIGGER_SQL = """
+CREATE TRIGGER "_wc_%(table)s_insert" AFTER INSERT ON "%(table)s" BEGIN
+  INSERT OR REPLACE INTO _wc_changes (tbl, rid)
+  VALUES ('%(table)s', new.rowid);
+END;
+CREATE TRIGGER "_wc_%(table)s_update" AFTER UPDATE ON "%(table)s" BEGIN
+  INSERT OR REPLACE INTO _wc_changes (tbl, rid)
+  VALUES ('%(table)s', old.rowid);
+  INSERT OR REPLACE INTO _wc_changes (tbl, rid)
+  VALUES ('%(table)s', new.rowid);
+END;
+CREATE TRIGGER "_wc_%(table)s_delete" AFTER DELETE ON "%(table)s" BEGIN
+  INSERT OR REPLACE INTO _wc_changes (tbl, rid)
+  VALUES ('%(table)s', old.rowid);
+END;
+"""
+
+
+def backup(filename, path):
+    """Copy a database consistently, also while it is used by others."""
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(filename)
+    con.isolation_level = None
+    try:
+        try:
+            con.execute('VACUUM INTO ?', (tmp_path,))
+        except sqlite3.OperationalError:
+            # VACUUM INTO requires sqlite 3.27, copy the file pages while
+            # a read transaction keeps writers out instead
+            con.execute('BEGIN')
+            con.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            with open(filename, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for block in iter(lambda: src.read(1 << 20), b''):
+                    dst.write(block)
+            con.execute('COMMIT')
+    finally:
+        con.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def working_copy_path(directory, filename):
+    """Return path of the working copy of an edb in directory."""
+    filename = os.path.abspath(filename)
+    edb_name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(directory, '%s-%s.sqlite' % (
+        edb_name, path_digest(filename)[:8]
+    ))
+
+
+def source_filename(filename):
+    """Return the original edb of an open working copy, else filename.
+
+    Files kept next to an edb, e.g. edb.rsrc and grid caches, are found
+    next to the original edb and not next to its working copy.
+    """
+    return _originals.get(os.path.abspath(filename), filename)
+
+
+def tracked(table):
+    return not table.startswith(UNTRACKED_PREFIXES)
+
+
+class WriteBackConflict(ValueError):
+
+    """The original edb has been modified since the copy was in sync."""
+
+
+class WorkingCopy(object):
+
+    """A local copy of an edb, edited instead of the original.
+
+    connect is called with a filename to open connections used to write
+    back changes, e.g. one with spatialite loaded, which the triggers of
+    geometry tables of the original require.
+    """
+
+    def __init__(self, filename, directory, connect=sqlite3.connect):
+        if not os.path.isfile(filename):
+            raise ValueError('Edb %s does not exist' % filename)
+        self.filename = os.path.abspath(filename)
+        self.path = working_copy_path(directory, self.filename)
+        self.connect = connect
+        self.con = None
+
+    def open(self):
+        """Copy the edb, or resume an existing copy.
+
+        Returns the number of changes of a resumed copy that have not
+        been written back, 0 for a new copy.
+        """
+        if os.path.exists(self.path):
+            self.con = sqlite3.connect(self.path)
+            npending = self.pending()
+            if self.original_stamp() == file_stamp(self.filename):
+                self.track_tables()
+                _originals[self.path] = self.filename
+                return self.pending()
+            self.con.close()
+            self.con = None
+            if npending > 0:
+                raise self.conflict(npending)
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        backup(self.filename, self.path)
+        self.con = sqlite3.connect(self.path)
+        with self.con:
+            self.con.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'seq INTEGER PRIMARY KEY, tbl TEXT NOT NULL, '
+                'rid INTEGER NOT NULL, UNIQUE (tbl, rid))' % CHANGES_TABLE
+            )
+            self.con.execute(
+                'CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value)'
+                % META_TABLE
+            )
+        self.track_tables(log_rows=False)
+        self.set_original_stamp()
+        _originals[self.path] = self.filename
+        return 0
+
+    def conflict(self, npending):
+        return WriteBackConflict(
+            'Working copy %s has %i changes not written back, but %s has '
+            'been modified since' % (self.path, npending, self.filename)
+        )
+
+    def original_stamp(self):
+        """Return stamp of the original when last in sync, see file_stamp."""
+        if not relation_in_db(self.con, META_TABLE):
+            # copied, but not opened completely
+            return None
+        rows = dict(self.con.execute('SELECT key, value FROM %s' % META_TABLE))
+        if 'mtime' not in rows:
+            return None
+        return rows['mtime'], rows['size']
+
+    def set_original_stamp(self):
+        mtime, size = file_stamp(self.filename)
+        with self.con:
+            self.con.executemany(
+                'INSERT OR REPLACE INTO %s (key, value) VALUES (?, ?)'
+                % META_TABLE,
+                [('mtime', mtime), ('size', size)]
+            )
+
+    def tables(self):
+        """Return tables of the copy with changes tracked."""
+        return [
+            row[0] for row in self.con.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' "
+                "AND sql NOT LIKE 'CREATE VIRTUAL%' ORDER BY name"
+            ) if tracked(row[0])
+        ]
+
+    def track_tables(self, log_rows=True):
+        """Add change triggers to tables not tracked yet.
+
+        Tables created in the copy after it was opened, e.g. emission
+        tables, or dropped and created again, are replaced as a whole on
+        write-back, unless log_rows is False.
+        """
+        triggers = set(
+            row[0] for row in self.con.execute(
+                "SELECT name FROM sqlite_master WHERE type='trigger'"
+            )
+        )
+        with self.con:
+            for table in self.tables():
+                if '_wc_%s_insert' % table in triggers:
+                    continue
+                self.con.executescript(TRIGGER_SQL % {'table': table})
+                if log_rows:
+                    self.con.execute(
+                        'INSERT OR REPLACE INTO %s (key, value) '
+                        'VALUES (?, 1)' % META_TABLE,
+                        (REPLACE_KEY % table,)
+                    )
+
+    def replaced_tables(self, con=None, schema='main'):
+        """Return tables of the copy to replace as a whole."""
+        con = con or self.con
+        prefix = REPLACE_KEY % ''
+        return [
+            row[0][len(prefix):] for row in con.execute(
+                'SELECT key FROM %s.%s WHERE key LIKE ?' % (
+                    schema, META_TABLE
+                ),
+                (prefix + '%',)
+            )
+        ]
+
+    def pending(self):
+        """Return number of changed rows not written back."""
+        if not relation_in_db(self.con, CHANGES_TABLE):
+            return 0
+        replaced = [
+            table for table in self.replaced_tables()
+            if relation_in_db(self.con, table)
+        ]
+        npending = self.con.execute(
+            'SELECT count(*) FROM %s WHERE tbl NOT IN (%s)' % (
+                CHANGES_TABLE, ', '.join('?' * len(replaced))
+            ),
+            replaced
+        ).fetchone()[0]
+        for table in replaced:
+            npending += self.con.execute(
+                'SELECT count(*) FROM "%s"' % table
+            ).fetchone()[0]
+        return npending
+
+    def write_back(self):
+        """Write changed rows to the original, return number of rows.
+
+        Raises WriteBackConflict if the original has been modified since
+        the copy was in sync with it.
+        """
+        self.track_tables()
+        con = self.connect(self.filename)
+        con.isolation_level = None
+        try:
+            # rows are replaced by delete and insert, which must not
+            # cascade to rows of other tables
+            con.execute('PRAGMA foreign_keys = OFF')
+            con.execute('ATTACH DATABASE ? AS copy', (self.path,))
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                # other users can not write to the original from here on
+                npending = self.pending()
+                changed = npending > 0 or len(self.replaced_tables()) > 0
+                if changed and \
+                   self.original_stamp() != file_stamp(self.filename):
+                    raise self.conflict(npending)
+                nrows = self._write_changes(con)
+                con.execute('COMMIT')
+            except:
+                con.execute('ROLLBACK')
+                raise
+        finally:
+            con.close()
+        if changed:
+            self.set_original_stamp()
+        return nrows
+
+    def _create_table(self, con, table):
+        """Create a table of the copy in the original if missing.
+
+        A table with another definition in the original is dropped and
+        created again. Returns False if the table is not in the copy.
+        """
+        copy_sql = con.execute(
+            "SELECT sql FROM copy.sqlite_master WHERE type='table' "
+            "AND name=?", (table,)
+        ).fetchone()
+        if copy_sql is None:
+            return False
+        main_sql = con.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type='table' "
+            "AND name=?", (table,)
+        ).fetchone()
+        if main_sql != copy_sql:
+            if main_sql is not None:
+                con.execute('DROP TABLE main."%s"' % table)
+            con.execute(copy_sql[0])
+        return True
+
+    def _columns(self, con, table):
+        return ', '.join(['rowid'] + [
+            '"%s"' % row[1] for row in con.execute(
+                'PRAGMA copy.table_info("%s")' % table
+            )
+        ])
+
+    def _write_changes(self, con):
+        nrows = 0
+        replaced = self.replaced_tables(con, 'copy')
+        for table in replaced:
+            if not self._create_table(con, table):
+                continue
+            columns = self._columns(con, table)
+            con.execute('DELETE FROM main."%s"' % table)
+            nrows += con.execute(
+                'INSERT INTO main."%s" (%s) SELECT %s FROM copy."%s"' % (
+                    table, columns, columns, table
+                )
+            ).rowcount
+            con.execute(
+                'DELETE FROM copy.%s WHERE tbl = ?' % CHANGES_TABLE, (table,)
+            )
+            con.execute(
+                'DELETE FROM copy.%s WHERE key = ?' % META_TABLE,
+                (REPLACE_KEY % table,)
+            )
+
+        last = con.execute(
+            'SELECT max(seq) FROM copy.%s' % CHANGES_TABLE
+        ).fetchone()[0]
+        if last is None:
+            return nrows
+        tables = [row[0] for row in con.execute(
+            'SELECT DISTINCT tbl FROM copy.%s WHERE seq <= ?' % CHANGES_TABLE,
+            (last,)
+        )]
+        for table in tables:
+            if not self._create_table(con, table):
+                # dropped in the copy
+                continue
+            columns = self._columns(con, table)
+            changed = (
+                'SELECT rid FROM copy.%s WHERE tbl = ? AND seq <= ?'
+                % CHANGES_TABLE
+            )
+            con.execute(
+                'DELETE FROM main."%s" WHERE rowid IN (%s)' % (table, changed),
+                (table, last)
+            )
+            con.execute(
+                'INSERT INTO main."%s" (%s) SELECT %s FROM copy."%s" '
+                'WHERE rowid IN (%s)' % (
+                    table, columns, columns, table, changed
+                ),
+                (table, last)
+            )
+        return nrows + con.execute(
+            'DELETE FROM copy.%s WHERE seq <= ?' % CHANGES_TABLE, (last,)
+        ).rowcount
+
+    def close(self, write_back=True):
+        """Write back changes and close, the copy is kept for reuse."""
+        if self.con is None:
+            return
+        if write_back:
+            self.write_back()
+        self.con.close()
+        self.con = None
+        _originals.pop(self.path, None)